@@ -1,13 +1,18 @@
 from fastapi import APIRouter, HTTPException, BackgroundTasks
 from fastapi import Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import os
-import requests
 from typing import Optional, Any, Dict
 from uuid import UUID
 from app.schemas.query import QueryResponse, QueryRequest
 from app.core import orchestrator
-from app.services import gemini_service
+from app.core.config import CHAT_HISTORY_PAGE_SIZE
+from app.core.executor import run_blocking
+from app.core.result_store import result_store
+from app.core.sse import SSE_HEADERS, sse_event
+from app.services import chat_store, gemini_service, supabase_client
+from app.services.chat_store import ChatConflict, ChatStoreError
+from app.services.supabase_client import sb_headers
 
 
 class CreateChatRequest(BaseModel):
@@ -19,73 +24,59 @@ class ChatMessageRequest(BaseModel):
   chat_id: str
   user_id: str
   message: str
+  # Optional optimistic-concurrency check: seq of the last message the client has seen
+  expected_seq: Optional[int] = None
 
 
 router = APIRouter()
 
 
-SUPABASE_URL = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-
-def _sb_headers(prefer: str | None = None) -> Dict[str, str]:
-  if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
-    raise RuntimeError("Supabase env vars missing (SUPABASE_URL / SUPABASE_SERVICE_KEY)")
-  headers = {
-    "apikey": SUPABASE_SERVICE_KEY,
-    "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
-    "Content-Type": "application/json",
-  }
-  if prefer:
-    headers["Prefer"] = prefer
-  return headers
-
-
 @router.post("/chat/create")
-def create_chat(req: CreateChatRequest) -> Dict[str, Any]:
+async def create_chat(req: CreateChatRequest) -> Dict[str, Any]:
   payload = {"user_id": req.user_id, "title": req.title or None, "data_source_id": None, "messages": []}
-  r = requests.post(
-    f"{SUPABASE_URL}/rest/v1/chats",
-    headers=_sb_headers("return=representation"),
+  r = await supabase_client.get_client().post(
+    "/chats",
+    headers=sb_headers("return=representation"),
     json=payload,
   )
-  if not r.ok:
+  if not r.is_success:
     raise HTTPException(status_code=400, detail=r.text)
   data = r.json()
   chat_id = data[0]["id"] if isinstance(data, list) and data else data.get("id")
   return {"chat_id": chat_id}
 
 
-def _get_chat(chat_id: str, user_id: str) -> Dict[str, Any]:
-  r = requests.get(
-    f"{SUPABASE_URL}/rest/v1/chats",
-    headers=_sb_headers(),
-    params={"id": f"eq.{chat_id}", "user_id": f"eq.{user_id}", "select": "*"},
+async def _get_chat(chat_id: str, user_id: str) -> Dict[str, Any]:
+  r = await supabase_client.get_client().get(
+    "/chats",
+    headers=sb_headers(),
+    params={"id": f"eq.{chat_id}", "user_id": f"eq.{user_id}", "select": "id,title,data_source_id"},
   )
-  if not r.ok or not r.json():
+  if not r.is_success or not r.json():
     raise HTTPException(status_code=404, detail="Chat not found")
   return r.json()[0]
 
 
-def _get_chat_title(chat_id: str) -> Dict[str, Any] | None:
+async def _get_chat_title(chat_id: str) -> Dict[str, Any] | None:
   """Fetch only minimal fields (title) for a chat id."""
   try:
-    r = requests.get(
-      f"{SUPABASE_URL}/rest/v1/chats",
-      headers=_sb_headers(),
+    r = await supabase_client.get_client().get(
+      "/chats",
+      headers=sb_headers(),
       params={"id": f"eq.{chat_id}", "select": "title"},
     )
-    if r.ok and r.json():
+    if r.is_success and r.json():
       return r.json()[0]
   except Exception as e:
     print(f"Error fetching chat title: {e}")
   return None
 
 
-def _update_chat_title(chat_id: str, title: str) -> None:
+async def _update_chat_title(chat_id: str, title: str) -> None:
   try:
-    requests.patch(
-      f"{SUPABASE_URL}/rest/v1/chats",
-      headers=_sb_headers(),
+    await supabase_client.get_client().patch(
+      "/chats",
+      headers=sb_headers(),
       params={"id": f"eq.{chat_id}"},
       json={"title": title},
     )
@@ -93,27 +84,60 @@ def _update_chat_title(chat_id: str, title: str) -> None:
     print(f"Error updating chat title: {e}")
 
 
-def _get_connection(conn_id: str, user_id: str) -> Dict[str, Any]:
-  r = requests.get(
-    f"{SUPABASE_URL}/rest/v1/connections",
-    headers=_sb_headers(),
+async def _get_connection(conn_id: str, user_id: str) -> Dict[str, Any]:
+  r = await supabase_client.get_client().get(
+    "/connections",
+    headers=sb_headers(),
     params={"id": f"eq.{conn_id}", "user_id": f"eq.{user_id}", "select": "*"},
   )
-  if not r.ok or not r.json():
+  if not r.is_success or not r.json():
     raise HTTPException(status_code=404, detail="Connection not found")
   return r.json()[0]
 
 
+async def _check_expected_seq(req: ChatMessageRequest) -> None:
+  if req.expected_seq is None:
+    return
+  # Reject stale clients before spending an LLM call
+  try:
+    current_seq = await chat_store.current_seq(req.chat_id, req.user_id)
+  except ChatStoreError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  if current_seq != req.expected_seq:
+    raise HTTPException(status_code=409, detail={"error": "Chat has newer messages", "current_seq": current_seq})
+
+
+def _schedule_title(background_tasks: BackgroundTasks, chat: Dict[str, Any], req: ChatMessageRequest, seq: Optional[int]) -> None:
+  # Background title generation if missing
+  try:
+    needs_title = not (chat.get("title") or "").strip()
+    is_first_message = seq == 2  # the exchange just stored was seq 1 (user) + 2 (assistant)
+    if needs_title and is_first_message and req.message:
+      async def update_title_task():
+        try:
+          new_title = await gemini_service.generate_chat_title(req.message)
+          if new_title:
+            await _update_chat_title(req.chat_id, new_title)
+        except Exception as e:
+          print(f"Background title generation failed: {e}")
+
+      background_tasks.add_task(update_title_task)
+  except Exception as e:
+    print(f"Could not schedule title generation: {e}")
+
+
 @router.post("/chat/message")
-def chat_message(req: ChatMessageRequest, background_tasks: BackgroundTasks) -> Dict[str, Any]:
-  chat = _get_chat(req.chat_id, req.user_id)
+async def chat_message(req: ChatMessageRequest, background_tasks: BackgroundTasks) -> Dict[str, Any]:
+  chat = await _get_chat(req.chat_id, req.user_id)
   data_source_id = chat.get("data_source_id")
   if not data_source_id:
     raise HTTPException(status_code=400, detail="Please select a data source before chatting.")
 
+  await _check_expected_seq(req)
+
   # Build a request to use cached schema by connection id
   qr = QueryRequest(question=req.message, connection_id=data_source_id, user_id=req.user_id)
-  resp = orchestrator.process_query(qr)  # returns QueryResponse
+  resp = await orchestrator.process_query(qr)  # returns QueryResponse
   if not isinstance(resp, QueryResponse):
     # fallback: ensure dict
     result = resp
@@ -121,55 +145,157 @@ def chat_message(req: ChatMessageRequest, background_tasks: BackgroundTasks) ->
     sql = result.get("sql_query", "")
     data = result.get("data", [])
     response_type = result.get("response_type", None)
+    truncated = result.get("truncated", False)
+    chart = result.get("chart")
+    rows = data
   else:
     explanation = resp.explanation
     sql = resp.sql_query
     data = resp.data
     response_type = resp.response_type
+    truncated = resp.truncated
+    chart = resp.chart
+    rows = data
+    if resp.result_handle:
+      # `data` is a preview of a shaped result; history keeps the full rows
+      rows = await run_blocking(result_store.rows, resp.result_handle, req.user_id) or data
 
-  # Append messages to chat
-  from datetime import datetime, timezone
-  messages = chat.get("messages") or []
-  now = datetime.now(timezone.utc).isoformat()
-  messages.append({"role": "user", "content": req.message, "timestamp": now})
-  messages.append({"role": "assistant", "content": explanation, "timestamp": now, "sql": sql, "results": data, "response_type": response_type})
-
-  ur = requests.patch(
-    f"{SUPABASE_URL}/rest/v1/chats?id=eq.{req.chat_id}",
-    headers=_sb_headers(),
-    json={"messages": messages},
-  )
-  if not ur.ok:
+  # Append the exchange as two new rows; earlier history is never read or rewritten
+  seq = None
+  result_id = None
+  try:
+    stored = await chat_store.append_exchange(
+      req.chat_id,
+      req.user_id,
+      req.message,
+      {"explanation": explanation, "sql": sql, "results": rows, "response_type": response_type, "truncated": truncated, "chart": chart},
+      expected_seq=req.expected_seq,
+    )
+    seq = stored["seq"]
+    result_id = stored["result_id"]
+  except ChatConflict as e:
+    raise HTTPException(status_code=409, detail={"error": "Chat has newer messages", "current_seq": e.current_seq})
+  except ChatStoreError as e:
     # non-fatal; still return the LLM response
-    pass
+    print(f"Error storing chat messages: {e}")
 
-  # Background title generation if missing
+  _schedule_title(background_tasks, chat, req, seq)
+
+  return {
+    "explanation": explanation, "sql": sql, "results": data, "response_type": response_type, "truncated": truncated,
+    "seq": seq, "result_id": result_id,
+    "chart": chart, "summary": getattr(resp, "summary", None), "result_handle": getattr(resp, "result_handle", None),
+  }
+
+
+@router.get("/chat/{chat_id}/messages")
+async def chat_messages(
+  chat_id: str,
+  user_id: str = Query(...),
+  before_seq: Optional[int] = None,
+  limit: int = Query(CHAT_HISTORY_PAGE_SIZE, ge=1, le=500),
+) -> Dict[str, Any]:
+  """Paginated history (ascending). Pass `next_before_seq` back as `before_seq` for older pages."""
   try:
-    needs_title = not (chat.get("title") or "").strip()
-    is_first_message = len(messages) <= 2  # we just appended user + assistant; before this, there were 0
-    if needs_title and is_first_message and req.message:
-      def update_title_task():
-        try:
-          new_title = gemini_service.generate_chat_title(req.message)
-          if new_title:
-            _update_chat_title(req.chat_id, new_title)
-        except Exception as e:
-          print(f"Background title generation failed: {e}")
+    messages = await chat_store.list_messages(chat_id, user_id, before_seq, limit)
+  except ChatStoreError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  next_before = messages[0]["seq"] if len(messages) == limit else None
+  return {"messages": messages, "next_before_seq": next_before}
 
-      background_tasks.add_task(update_title_task)
-  except Exception as e:
-    print(f"Could not schedule title generation: {e}")
 
-  return {"explanation": explanation, "sql": sql, "results": data, "response_type": response_type}
+@router.get("/chat/results/{result_id}")
+async def chat_results(result_id: str, user_id: str = Query(...)) -> Dict[str, Any]:
+  """Full stored result set of an assistant message (messages only carry a preview)."""
+  try:
+    stored = await chat_store.get_results(result_id, user_id)
+  except ChatStoreError as e:
+    raise HTTPException(status_code=400, detail=str(e))
+  if stored is None:
+    raise HTTPException(status_code=404, detail="Result not found")
+  return stored
+
+
+@router.post("/chat/message/stream")
+async def chat_message_stream(req: ChatMessageRequest, background_tasks: BackgroundTasks) -> StreamingResponse:
+  """
+  Server-Sent Events variant of /chat/message: stage events, `sql`, `explanation` deltas and
+  `rows` batches while the answer is produced. The exchange is stored before the last event:
+  `done` (or, when the answer failed, `error`) then carries `seq` / `result_id`. A chat that
+  moved on in the meantime ends the stream with an `error` carrying `current_seq` instead.
+  """
+  chat = await _get_chat(req.chat_id, req.user_id)
+  data_source_id = chat.get("data_source_id")
+  if not data_source_id:
+    raise HTTPException(status_code=400, detail="Please select a data source before chatting.")
+  await _check_expected_seq(req)
+
+  qr = QueryRequest(question=req.message, connection_id=data_source_id, user_id=req.user_id)
+
+  async def events():
+    final = None
+    last_event = None
+    rows = []
+    sql_query = ""
+    async for event, data in orchestrator.stream_query_events(qr):
+      if event == "rows":
+        rows.extend(data["rows"])
+      if event == "sql":
+        sql_query = data.get("sql_query") or sql_query
+      if event in ("done", "error"):
+        # Both end the stream; held back until the exchange is stored
+        final, last_event = data, event
+        continue
+      yield sse_event(event, data)
+    if final is None:
+      return
+
+    if last_event == "error":
+      # Stored like /chat/message stores error answers, so the question stays in history
+      answer = {"explanation": final.get("error"), "sql": sql_query, "results": [{"error": final.get("error")}],
+                "response_type": "error"}
+    else:
+      answer = {
+        "explanation": final.get("explanation"),
+        "sql": final.get("sql_query"),
+        "results": rows,
+        "response_type": final.get("response_type"),
+        "truncated": final.get("truncated"),
+        "chart": final.get("chart"),
+      }
+    final["seq"] = None
+    final["result_id"] = None
+    try:
+      stored = await chat_store.append_exchange(req.chat_id, req.user_id, req.message, answer,
+                                                expected_seq=req.expected_seq)
+      final["seq"] = stored["seq"]
+      final["result_id"] = stored["result_id"]
+    except ChatConflict as e:
+      if last_event == "error":
+        final["current_seq"] = e.current_seq
+      else:
+        # The stream ends with the error, as documented; no `done` follows
+        yield sse_event("error", {"error": "Chat has newer messages", "current_seq": e.current_seq})
+        return
+    except ChatStoreError as e:
+      # non-fatal; still finish the stream
+      print(f"Error storing chat messages: {e}")
+
+    # Background tasks run after the last frame is sent
+    _schedule_title(background_tasks, chat, req, final["seq"])
+    yield sse_event(last_event, final)
+
+  return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS,
+                           background=background_tasks)
 
 
 @router.delete("/chat/delete_all")
-def delete_all_chats(user_id: str = Query(...)) -> Dict[str, Any]:
+async def delete_all_chats(user_id: str = Query(...)) -> Dict[str, Any]:
   """Delete all chats for a given user (Supabase REST)."""
   try:
-    r = requests.delete(
-      f"{SUPABASE_URL}/rest/v1/chats?user_id=eq.{user_id}",
-      headers=_sb_headers("return=minimal"),
+    r = await supabase_client.get_client().delete(
+      f"/chats?user_id=eq.{user_id}",
+      headers=sb_headers("return=minimal"),
     )
     if r.status_code in (200, 204):
       count_header = r.headers.get("Content-Range") or r.headers.get("content-range")
@@ -182,13 +308,13 @@ def delete_all_chats(user_id: str = Query(...)) -> Dict[str, Any]:
 
 
 @router.delete("/chat/{chat_id}")
-def delete_chat(chat_id: UUID, user_id: str = Query(...)) -> Dict[str, Any]:
+async def delete_chat(chat_id: UUID, user_id: str = Query(...)) -> Dict[str, Any]:
   """Delete a single chat if it belongs to the provided user."""
   try:
     chat_str = str(chat_id)
-    r = requests.delete(
-      f"{SUPABASE_URL}/rest/v1/chats?id=eq.{chat_str}&user_id=eq.{user_id}",
-      headers=_sb_headers("return=minimal"),
+    r = await supabase_client.get_client().delete(
+      f"/chats?id=eq.{chat_str}&user_id=eq.{user_id}",
+      headers=sb_headers("return=minimal"),
     )
     if r.status_code == 204:
       return {"deleted": True, "id": chat_str}
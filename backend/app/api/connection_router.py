@@ -1,42 +1,44 @@
 from __future__ import annotations
 
 import json
-import os
+from datetime import datetime, timezone
 from typing import Any, Dict, List, Optional
 
-import requests
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
 
+from app.core.connection_cache import connection_cache
+from app.core.data_manager_factory import invalidate_data_manager
+from app.core.executor import run_blocking
+from app.core.file_datasets import FILE_SOURCE_TYPES, parse_datasets
+from app.core.fingerprint import source_fingerprint
+from app.core.index_cache import index_cache
+from app.core.jobs import JobCancelled, JobContext, job_manager
+from app.core.query_cache import invalidate_connection as invalidate_query_cache, result_cache
 from app.core.schema_discovery_service import SchemaDiscoveryService
+from app.core.schema_index import invalidate_schema_index
 from app.schemas.query import DataSource, DBDetails
+from app.services import supabase_client
+from app.services.supabase_client import sb_headers
 
 
 router = APIRouter()
 
 
-SUPABASE_URL = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
-
-
 def _sb_headers() -> Dict[str, str]:
-    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
-        raise RuntimeError("Supabase env vars missing (SUPABASE_URL / SUPABASE_SERVICE_KEY)")
-    return {
-        "apikey": SUPABASE_SERVICE_KEY,
-        "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
-        "Content-Type": "application/json",
-        # Ensure PostgREST returns inserted/updated rows so we can read IDs
-        "Prefer": "return=representation",
-    }
+    # Ensure PostgREST returns inserted/updated rows so we can read IDs
+    return sb_headers("return=representation")
 
 
 class ConnectionCreateRequest(BaseModel):
     user_id: str
     name: str
-    source_type: str = Field(..., description="postgresql | mysql | csv | excel")
+    source_type: str = Field(..., description="postgresql | mysql | csv | excel | parquet | json")
     db_details: Optional[DBDetails] = None
-    s3_uri: Optional[str] = None
+    s3_uri: Optional[str] = Field(
+        None, description="File, glob or prefix/ (Hive-partitioned) location; several comma/newline separated"
+    )
 
 
 class ConnectionListItem(BaseModel):
@@ -53,22 +55,81 @@ def _build_datasource_from_payload(payload: ConnectionCreateRequest) -> DataSour
         if not payload.db_details:
             raise HTTPException(status_code=400, detail="db_details is required for SQL sources")
         return DataSource(source_type=st, db_details=payload.db_details, file_path=None)
-    elif st in ("csv", "excel"):
+    elif st in FILE_SOURCE_TYPES:
         if not payload.s3_uri:
             raise HTTPException(status_code=400, detail="s3_uri (or file path) is required for file sources")
+        try:
+            parse_datasets(st, payload.s3_uri)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         return DataSource(source_type=st, db_details=None, file_path=payload.s3_uri)
     else:
         raise HTTPException(status_code=400, detail=f"Unsupported source_type: {st}")
 
 
-@router.post("/connections")
-def create_connection(req: ConnectionCreateRequest) -> Dict[str, Any]:
-    """Create a connection, discover schema, and persist all fields in Supabase."""
-    ds = _build_datasource_from_payload(req)
+def _sync_index(connection_id: Any, artifacts: Dict[str, Any], job: Optional[JobContext] = None,
+                start: float = 0.0) -> None:
+    """Prebuild the semantic index for large schemas so queries never embed on the hot path."""
+    if not connection_id:
+        return
+    try:
+        if artifacts.get("is_large"):
+            def progress(done: int, total: int) -> None:
+                # Lands in the job's progress/message fields (GET /api/jobs/{job_id})
+                job.progress(start + (1.0 - start) * done / max(total, 1), f"Embedding schema ({done}/{total})")
+
+            index_cache.build(str(connection_id), artifacts.get("schema_elements_flat") or [],
+                              progress=progress if job is not None else None,
+                              strategy=artifacts.get("index_strategy"))
+        else:
+            index_cache.invalidate(str(connection_id), remove_files=True)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        # Non-fatal: the query path rebuilds the index lazily on a cache miss
+        print(f"Index build failed for connection {connection_id}: {e}")
+
+
+def _blocking_runner(job: Optional[JobContext]):
+    """Job bodies run blocking steps on the job pool; inline requests use the shared executor."""
+    return job.run_blocking if job is not None else run_blocking
+
+
+def _report(job: Optional[JobContext], fraction: float, message: str) -> None:
+    if job is not None:
+        job.progress(fraction, message)
+
+
+async def _load_connection(connection_id: str, user_id: str) -> tuple[Dict[str, Any], DataSource]:
+    gr = await supabase_client.get_client().get(
+        "/connections",
+        headers=_sb_headers(),
+        params={"id": f"eq.{connection_id}", "user_id": f"eq.{user_id}", "select": "*"},
+    )
+    if not gr.is_success or not gr.json():
+        raise HTTPException(status_code=404, detail="Connection not found")
+    conn = gr.json()[0]
+
+    st = (conn.get("source_type") or "").lower()
+    if st in ("postgresql", "mysql"):
+        raw = conn.get("db_details") or "{}"
+        details_obj = json.loads(raw) if isinstance(raw, str) else raw
+        ds = DataSource(source_type=st, db_details=DBDetails(**details_obj), file_path=None)
+    elif st in FILE_SOURCE_TYPES:
+        ds = DataSource(source_type=st, db_details=None, file_path=conn.get("s3_uri"))
+    else:
+        raise HTTPException(status_code=400, detail=f"Unsupported source type: {st}")
+    return conn, ds
+
+
+async def _create_connection(req: ConnectionCreateRequest, ds: DataSource,
+                             job: Optional[JobContext] = None) -> Dict[str, Any]:
+    run = _blocking_runner(job)
 
     # Discover schema artifacts
+    _report(job, 0.05, "Discovering schema")
     svc = SchemaDiscoveryService()
-    artifacts = svc.discover_and_process_schema(ds)
+    artifacts = await run(svc.discover_and_process_schema, ds)
 
     # Prepare payload for Supabase
     payload: Dict[str, Any] = {
@@ -80,72 +141,163 @@ def create_connection(req: ConnectionCreateRequest) -> Dict[str, Any]:
         "s3_uri": req.s3_uri,
         "schema_json": artifacts.get("schema_json"),
         "schema_elements_flat": artifacts.get("schema_elements_flat"),
+        "schema_index": artifacts.get("schema_index"),
+        "schema_pack": artifacts.get("schema_pack"),
         "is_large": artifacts.get("is_large"),
+        "index_strategy": artifacts.get("index_strategy"),
+        "schema_hash": artifacts.get("schema_hash"),
+        "table_hashes": artifacts.get("table_hashes"),
+        "source_version": artifacts.get("source_version"),
     }
 
-    r = requests.post(f"{SUPABASE_URL}/rest/v1/connections", headers=_sb_headers(), json=payload)
-    if not r.ok:
+    _report(job, 0.4, "Saving connection")
+    r = await supabase_client.get_client().post("/connections", headers=_sb_headers(), json=payload)
+    if not r.is_success:
         raise HTTPException(status_code=400, detail=r.text)
     data = r.json()
     # Return a simple envelope
     created = data[0] if isinstance(data, list) and data else data
+    _report(job, 0.5, "Building semantic index")
+    await run(_sync_index, created.get("id"), artifacts, job, 0.5)
     return {
         "id": created.get("id"),
         "is_large": artifacts.get("is_large"),
+        "index_strategy": artifacts.get("index_strategy"),
         "schema_size": len(artifacts.get("schema_elements_flat") or []),
     }
 
 
-@router.put("/connections/{connection_id}/refresh")
-def refresh_connection(connection_id: str, user_id: str = Query(...)) -> Dict[str, Any]:
-    """Re-discover schema for an existing connection and update only schema fields."""
-    # Read existing connection
-    gr = requests.get(
-        f"{SUPABASE_URL}/rest/v1/connections",
-        headers=_sb_headers(),
-        params={"id": f"eq.{connection_id}", "user_id": f"eq.{user_id}", "select": "*"},
-    )
-    if not gr.ok or not gr.json():
-        raise HTTPException(status_code=404, detail="Connection not found")
-    conn = gr.json()[0]
-
-    st = (conn.get("source_type") or "").lower()
-    if st in ("postgresql", "mysql"):
-        raw = conn.get("db_details") or "{}"
-        details_obj = json.loads(raw) if isinstance(raw, str) else raw
-        ds = DataSource(source_type=st, db_details=DBDetails(**details_obj), file_path=None)
-    elif st in ("csv", "excel"):
-        ds = DataSource(source_type=st, db_details=None, file_path=conn.get("s3_uri"))
-    else:
-        raise HTTPException(status_code=400, detail=f"Unsupported source type: {st}")
+async def _refresh_connection(connection_id: str, conn: Dict[str, Any], ds: DataSource,
+                              job: Optional[JobContext] = None) -> Dict[str, Any]:
+    run = _blocking_runner(job)
 
+    _report(job, 0.05, "Checking for schema changes")
     svc = SchemaDiscoveryService()
-    artifacts = svc.discover_and_process_schema(ds)
+    artifacts = await run(svc.refresh_schema, ds, conn)
+    diff = artifacts.get("diff")
 
-    pr = requests.patch(
-        f"{SUPABASE_URL}/rest/v1/connections?id=eq.{connection_id}",
-        headers=_sb_headers(),
-        json={
+    if not artifacts.get("changed"):
+        # Nothing moved since the last refresh: no write, caches and index stay valid
+        return {
+            "id": connection_id,
+            "changed": False,
+            "is_large": conn.get("is_large"),
+            "index_strategy": conn.get("index_strategy"),
+            "schema_size": len(conn.get("schema_elements_flat") or []),
+            "diff": diff,
+        }
+
+    if artifacts.get("schema_changed"):
+        patch = {
             "schema_json": artifacts.get("schema_json"),
             "schema_elements_flat": artifacts.get("schema_elements_flat"),
+            "schema_index": artifacts.get("schema_index"),
+            "schema_pack": artifacts.get("schema_pack"),
             "is_large": artifacts.get("is_large"),
-        },
+            "index_strategy": artifacts.get("index_strategy"),
+            "schema_hash": artifacts.get("schema_hash"),
+            "table_hashes": artifacts.get("table_hashes"),
+            "source_version": artifacts.get("source_version"),
+        }
+    else:
+        # File contents changed but its columns did not: only the version marker moves
+        patch = {"source_version": artifacts.get("source_version")}
+    # Version marker the query path's connection cache revalidates against
+    patch["updated_at"] = datetime.now(timezone.utc).isoformat()
+
+    _report(job, 0.4, "Saving schema")
+    pr = await supabase_client.get_client().patch(
+        f"/connections?id=eq.{connection_id}",
+        headers=_sb_headers(),
+        json=patch,
     )
-    if not pr.ok:
+    if not pr.is_success:
         raise HTTPException(status_code=400, detail=pr.text)
 
+    connection_cache.invalidate(connection_id)
+    await run_blocking(invalidate_data_manager, connection_id)
+    if artifacts.get("schema_changed"):
+        invalidate_query_cache(connection_id)
+        invalidate_schema_index(connection_id)
+        # Incremental build: only elements of changed tables are re-embedded
+        _report(job, 0.5, "Building semantic index")
+        await run(_sync_index, connection_id, artifacts, job, 0.5)
+        current = artifacts
+    else:
+        # Same columns, new data: cached answers (SQL) stay valid, cached results do not
+        result_cache.invalidate(connection_id)
+        current = conn
     return {
         "id": connection_id,
-        "is_large": artifacts.get("is_large"),
-        "schema_size": len(artifacts.get("schema_elements_flat") or []),
+        "changed": True,
+        "is_large": current.get("is_large"),
+        "index_strategy": current.get("index_strategy"),
+        "schema_size": len(current.get("schema_elements_flat") or []),
+        "diff": diff,
     }
 
 
+@router.post("/connections")
+async def create_connection(req: ConnectionCreateRequest, background: bool = Query(False)) -> Any:
+    """
+    Create a connection, discover schema, and persist all fields in Supabase.
+    With `background=true` the work runs as a job and a 202 with the job record is returned.
+    """
+    ds = _build_datasource_from_payload(req)
+    if background:
+        job = job_manager.submit(
+            "create_connection",
+            lambda ctx: _create_connection(req, ds, ctx),
+            user_id=req.user_id,
+            source_key=source_fingerprint(ds),
+        )
+        return JSONResponse(status_code=202, content=job)
+    return await _create_connection(req, ds)
+
+
+@router.put("/connections/{connection_id}/refresh")
+async def refresh_connection(connection_id: str, user_id: str = Query(...), background: bool = Query(False)) -> Any:
+    """
+    Re-discover schema for an existing connection and update only schema fields.
+    Unchanged sources are detected via stored fingerprints and skip the write entirely,
+    so this endpoint is cheap enough to call on a schedule. `background=true` runs it as a job.
+    """
+    conn, ds = await _load_connection(connection_id, user_id)
+    if background:
+        job = job_manager.submit(
+            "refresh_connection",
+            lambda ctx: _refresh_connection(connection_id, conn, ds, ctx),
+            user_id=user_id,
+            source_key=source_fingerprint(ds),
+            connection_id=connection_id,
+        )
+        return JSONResponse(status_code=202, content=job)
+    return await _refresh_connection(connection_id, conn, ds)
+
+
+@router.post("/connections/{connection_id}/reindex", status_code=202)
+async def reindex_connection(connection_id: str, user_id: str = Query(...)) -> Dict[str, Any]:
+    """Rebuild the semantic index from the stored schema as a background job."""
+    conn, _ = await _load_connection(connection_id, user_id)
+
+    async def body(ctx: JobContext) -> Dict[str, Any]:
+        ctx.progress(0.0, "Building semantic index")
+        await ctx.run_blocking(_sync_index, connection_id, conn, ctx)
+        return {
+            "id": connection_id,
+            "is_large": conn.get("is_large"),
+            "index_strategy": conn.get("index_strategy"),
+            "schema_size": len(conn.get("schema_elements_flat") or []),
+        }
+
+    return job_manager.submit("reindex_connection", body, user_id=user_id, connection_id=connection_id)
+
+
 @router.get("/connections", response_model=List[ConnectionListItem])
-def list_connections(user_id: str = Query(...)) -> List[ConnectionListItem]:
+async def list_connections(user_id: str = Query(...)) -> List[ConnectionListItem]:
     """List connections for a user without sensitive fields."""
-    r = requests.get(
-        f"{SUPABASE_URL}/rest/v1/connections",
+    r = await supabase_client.get_client().get(
+        "/connections",
         headers=_sb_headers(),
         params={
             "user_id": f"eq.{user_id}",
@@ -153,17 +305,26 @@ def list_connections(user_id: str = Query(...)) -> List[ConnectionListItem]:
             "order": "created_at.desc",
         },
     )
-    if not r.ok:
+    if not r.is_success:
         raise HTTPException(status_code=400, detail=r.text)
     return r.json()
 
 
 @router.delete("/connections/{connection_id}")
-def delete_connection(connection_id: str, user_id: str = Query(...)) -> Dict[str, Any]:
-    r = requests.delete(
-        f"{SUPABASE_URL}/rest/v1/connections?id=eq.{connection_id}&user_id=eq.{user_id}",
+async def delete_connection(connection_id: str, user_id: str = Query(...)) -> Dict[str, Any]:
+    r = await supabase_client.get_client().delete(
+        "/connections",
         headers=_sb_headers(),
+        params={"id": f"eq.{connection_id}", "user_id": f"eq.{user_id}", "select": "id"},
     )
-    if not r.ok:
+    if not r.is_success:
         raise HTTPException(status_code=400, detail=r.text)
+    if not r.json():
+        # Nothing of this user's was deleted: leave caches and index files of the id alone
+        raise HTTPException(status_code=404, detail="Connection not found")
+    connection_cache.invalidate(connection_id)
+    await run_blocking(invalidate_data_manager, connection_id)
+    invalidate_query_cache(connection_id)
+    invalidate_schema_index(connection_id)
+    await run_blocking(index_cache.invalidate, connection_id, True)
     return {"deleted": True, "id": connection_id}
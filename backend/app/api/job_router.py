@@ -0,0 +1,41 @@
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query
+
+from app.core.jobs import FINISHED, job_manager
+
+
+router = APIRouter()
+
+
+def _owned_job(job_id: str, user_id: str) -> Dict[str, Any]:
+    job = job_manager.get(job_id)
+    if not job or job.get("user_id") != str(user_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.get("/jobs")
+async def list_jobs(user_id: str = Query(...), status: Optional[str] = None,
+                    limit: int = Query(50, ge=1, le=500)) -> List[Dict[str, Any]]:
+    """Most recent jobs of a user, optionally filtered by status."""
+    return job_manager.list(user_id, status, limit)
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, user_id: str = Query(...)) -> Dict[str, Any]:
+    """Status, progress (0..1), message and, once finished, result or error of a job."""
+    return _owned_job(job_id, user_id)
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, user_id: str = Query(...)) -> Dict[str, Any]:
+    """Cancel a queued or running job."""
+    job = _owned_job(job_id, user_id)
+    if job.get("status") in FINISHED:
+        raise HTTPException(status_code=409, detail=f"Job already {job.get('status')}")
+    if not job_manager.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job is not running in this process")
+    return {"id": job_id, "cancelling": True}
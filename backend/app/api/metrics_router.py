@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+from typing import Dict, Iterator
+
+from fastapi import APIRouter
+from fastapi.responses import Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+
+from app.core import executor
+from app.core.connection_cache import connection_cache
+from app.core.data_manager_factory import data_manager_stats
+from app.core.index_cache import index_cache
+from app.core.query_cache import cache_stats
+
+router = APIRouter()
+
+# Outcomes that did not come from the cache; every other counter is a hit
+_MISSES = ("misses", "builds")
+
+
+def _cache_counters() -> Dict[str, Dict[str, int]]:
+    return {**cache_stats(), "connections": dict(connection_cache.stats), "indexes": dict(index_cache.stats)}
+
+
+class _StateCollector:
+    """Cache counters and pool occupancy, read from the live objects at scrape time."""
+
+    def collect(self) -> Iterator[Metric]:
+        lookups = CounterMetricFamily("querai_cache_lookups", "Cache lookups by outcome.", labels=("cache", "outcome"))
+        hit_ratio = GaugeMetricFamily("querai_cache_hit_ratio", "Share of lookups served from the cache.",
+                                      labels=("cache",))
+        for cache, counters in _cache_counters().items():
+            for outcome, count in counters.items():
+                lookups.add_metric([cache, outcome], count)
+            total = sum(counters.values())
+            misses = sum(counters.get(name, 0) for name in _MISSES)
+            hit_ratio.add_metric([cache], (total - misses) / total if total else 0.0)
+        yield lookups
+        yield hit_ratio
+
+        managers = data_manager_stats()
+        yield GaugeMetricFamily("querai_data_managers", "Pooled data managers (engines / DuckDB databases).",
+                                value=managers["managers"])
+        pool = GaugeMetricFamily("querai_db_pool_connections", "SQL connections across pooled engines.",
+                                 labels=("state",))
+        for state in ("checked_out", "idle", "overflow"):
+            pool.add_metric([state], managers[state])
+        yield pool
+
+        blocking = executor.stats()
+        yield GaugeMetricFamily("querai_executor_max_workers", "Size of the blocking-work executor.",
+                                value=blocking["max_workers"])
+        yield GaugeMetricFamily("querai_executor_threads", "Threads started by the blocking-work executor.",
+                                value=blocking["threads"])
+        yield GaugeMetricFamily("querai_executor_queued", "Blocking calls waiting for an executor thread.",
+                                value=blocking["queued"])
+        yield GaugeMetricFamily("querai_index_cache_bytes", "Approximate memory of hot FAISS indexes.",
+                                value=index_cache.memory_bytes)
+
+
+REGISTRY.register(_StateCollector())
+
+
+@router.get("/metrics", include_in_schema=False)
+def metrics() -> Response:
+    """Prometheus text format: latency histograms, cache hit ratios, pool sizes and LLM token counts."""
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
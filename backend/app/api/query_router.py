@@ -1,10 +1,52 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from app.schemas.query import QueryRequest, QueryResponse
 from app.core import orchestrator
+from app.core.connection_cache import connection_cache
+from app.core.executor import run_blocking
+from app.core.query_cache import cache_stats
+from app.core.result_store import result_store
+from app.core.sse import SSE_HEADERS, sse_event
 
 router = APIRouter()
 
 @router.post("/query", response_model=QueryResponse)
-def handle_query(request: QueryRequest) -> QueryResponse:
-    response = orchestrator.process_query(request)
-    return response
\ No newline at end of file
+async def handle_query(request: QueryRequest) -> QueryResponse:
+    response = await orchestrator.process_query(request)
+    return response
+
+
+@router.post("/query/rows")
+async def stream_query_rows(request: QueryRequest) -> StreamingResponse:
+    """Same as /query but streams rows as NDJSON (meta line, row batches, summary line)."""
+    return StreamingResponse(orchestrator.stream_query_rows(request), media_type="application/x-ndjson")
+
+
+@router.post("/query/stream")
+async def stream_query(request: QueryRequest) -> StreamingResponse:
+    """Server-Sent Events: stage events, SQL, explanation deltas, row batches, then `done`."""
+    async def events():
+        async for event, data in orchestrator.stream_query_events(request):
+            yield sse_event(event, data)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.get("/query/results/{handle}")
+async def get_query_results(
+    handle: str,
+    user_id: str | None = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=10000),
+):
+    """Page of the full rows behind a shaped response's `result_handle` (kept RESULT_HANDLE_TTL seconds)."""
+    page = await run_blocking(result_store.page, handle, user_id, offset, limit)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired")
+    return page
+
+
+@router.get("/cache/stats")
+def get_cache_stats():
+    """Hit/miss counters of the question (LLM), result and connection caches."""
+    return {**cache_stats(), "connections": dict(connection_cache.stats)}
@@ -6,4 +6,131 @@ load_dotenv()
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable not set!")
\ No newline at end of file
+    raise ValueError("GEMINI_API_KEY environment variable not set!")
+
+SUPABASE_URL = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
+SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+
+# Shared async HTTP client for Supabase REST (HTTP/2, keep-alive pool)
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "50"))
+SUPABASE_MAX_KEEPALIVE = int(os.getenv("SUPABASE_MAX_KEEPALIVE", "20"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "15"))
+
+# Dedicated executor for blocking work (DB drivers, DuckDB, embeddings)
+BLOCKING_EXECUTOR_WORKERS = int(os.getenv("BLOCKING_EXECUTOR_WORKERS", "16"))
+
+# Local on-disk cache root (FAISS indexes, file snapshots, ...)
+CACHE_DIR = os.getenv("QUERAI_CACHE_DIR", os.path.join(os.getcwd(), ".cache"))
+
+# Semantic search index cache
+INDEX_CACHE_DIR = os.getenv("INDEX_CACHE_DIR", os.path.join(CACHE_DIR, "indexes"))
+INDEX_CACHE_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Parsed per-connection schema lookup indexes kept in memory
+SCHEMA_INDEX_CACHE_MAX_ENTRIES = int(os.getenv("SCHEMA_INDEX_CACHE_MAX_ENTRIES", "256"))
+
+# Pooled data managers (one per connection, reused across queries)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+MANAGER_MAX_ENTRIES = int(os.getenv("MANAGER_MAX_ENTRIES", "64"))
+MANAGER_IDLE_TTL = int(os.getenv("MANAGER_IDLE_TTL", "900"))
+
+# Result limits (rows and JSON-encoded bytes) for inline and streamed answers
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", "1000"))
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "5000"))
+QUERY_MAX_BYTES = int(os.getenv("QUERY_MAX_BYTES", str(5 * 1024 * 1024)))
+QUERY_STREAM_MAX_ROWS = int(os.getenv("QUERY_STREAM_MAX_ROWS", "1000000"))
+QUERY_STREAM_MAX_BYTES = int(os.getenv("QUERY_STREAM_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# SQL guard: plan ceilings checked with EXPLAIN before execution (0 disables a check)
+SQL_MAX_PLAN_COST = float(os.getenv("SQL_MAX_PLAN_COST", "50000000"))
+SQL_MAX_PLAN_ROWS = float(os.getenv("SQL_MAX_PLAN_ROWS", "1000000000"))
+# Server-side statement timeout for query connections (per-connection `statement_timeout_ms` overrides)
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "30000"))
+
+# Self-repair of failed SQL: rewrites asked from the LLM, overall deadline (seconds, from the
+# first execution) and the schema slice sent along with the error
+SQL_REPAIR_MAX_ATTEMPTS = int(os.getenv("SQL_REPAIR_MAX_ATTEMPTS", "2"))
+SQL_REPAIR_DEADLINE = float(os.getenv("SQL_REPAIR_DEADLINE", "45"))
+SQL_REPAIR_SCHEMA_TOKEN_BUDGET = int(os.getenv("SQL_REPAIR_SCHEMA_TOKEN_BUDGET", "1500"))
+
+# Local Parquet snapshots of CSV/Excel sources (keyed by S3 ETag)
+FILE_CACHE_DIR = os.getenv("FILE_CACHE_DIR", os.path.join(CACHE_DIR, "files"))
+# Rows per Arrow chunk when streaming Excel sheets into Parquet (bounds ingestion memory)
+EXCEL_CHUNK_ROWS = int(os.getenv("EXCEL_CHUNK_ROWS", "50000"))
+
+# Question/answer caches
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2048"))
+LLM_CACHE_SEMANTIC = os.getenv("LLM_CACHE_SEMANTIC", "false").lower() in ("1", "true", "yes")
+LLM_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("LLM_CACHE_SEMANTIC_THRESHOLD", "0.95"))
+LLM_CACHE_SEMANTIC_MAX_PER_CONNECTION = int(os.getenv("LLM_CACHE_SEMANTIC_MAX_PER_CONNECTION", "512"))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "60"))
+
+# Connection rows for the query path: served from memory for CONNECTION_CACHE_FRESH seconds,
+# then revalidated with a schema_hash/updated_at probe
+CONNECTION_CACHE_MAX_ENTRIES = int(os.getenv("CONNECTION_CACHE_MAX_ENTRIES", "64"))
+CONNECTION_CACHE_FRESH = float(os.getenv("CONNECTION_CACHE_FRESH", "10"))
+
+# Result shaping: results of at least RESULT_SHAPE_MIN_ROWS rows (0 turns the automatic
+# stage off) get a chart series of up to RESULT_SHAPE_MAX_POINTS points and column statistics.
+# Above RESULT_PREVIEW_ROWS rows `data` is a preview and the full rows stay behind a handle
+# (Parquet under RESULT_HANDLE_DIR) for RESULT_HANDLE_TTL seconds.
+RESULT_SHAPE_MIN_ROWS = int(os.getenv("RESULT_SHAPE_MIN_ROWS", "500"))
+RESULT_SHAPE_MAX_POINTS = int(os.getenv("RESULT_SHAPE_MAX_POINTS", "500"))
+RESULT_SHAPE_TOP_N = int(os.getenv("RESULT_SHAPE_TOP_N", "10"))
+RESULT_PREVIEW_ROWS = int(os.getenv("RESULT_PREVIEW_ROWS", "100"))
+RESULT_HANDLE_DIR = os.getenv("RESULT_HANDLE_DIR", os.path.join(CACHE_DIR, "results"))
+RESULT_HANDLE_TTL = float(os.getenv("RESULT_HANDLE_TTL", "3600"))
+
+# Embedding model (loaded lazily on first use)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "paraphrase-multilingual-mpnet-base-v2")
+EMBEDDING_WARMUP = os.getenv("EMBEDDING_WARMUP", "false").lower() in ("1", "true", "yes")
+# Optional shared embedding service (see app/services/embedding_server.py) so N workers don't load N models
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL")
+EMBEDDING_SERVICE_TIMEOUT = float(os.getenv("EMBEDDING_SERVICE_TIMEOUT", "60"))
+
+# Schema embedding pipeline
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_PROCESSES = int(os.getenv("EMBED_PROCESSES", "1"))
+EMBED_MULTIPROCESS_MIN = int(os.getenv("EMBED_MULTIPROCESS_MIN", "20000"))
+EMBED_PROGRESS_CHUNK = int(os.getenv("EMBED_PROGRESS_CHUNK", "4096"))
+
+# FAISS index strategy: auto | flat | hnsw | ivfpq (auto picks by schema size)
+INDEX_STRATEGY = os.getenv("INDEX_STRATEGY", "auto").lower()
+INDEX_HNSW_MIN = int(os.getenv("INDEX_HNSW_MIN", "50000"))
+INDEX_IVFPQ_MIN = int(os.getenv("INDEX_IVFPQ_MIN", "1000000"))
+INDEX_HNSW_M = int(os.getenv("INDEX_HNSW_M", "32"))
+INDEX_HNSW_EF_SEARCH = int(os.getenv("INDEX_HNSW_EF_SEARCH", "64"))
+INDEX_IVF_NPROBE = int(os.getenv("INDEX_IVF_NPROBE", "16"))
+
+# Schema discovery
+DISCOVERY_CONCURRENCY = int(os.getenv("DISCOVERY_CONCURRENCY", "8"))
+
+# Background jobs (connection create/refresh, index builds); state persisted in SQLite
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", os.path.join(CACHE_DIR, "jobs.sqlite3"))
+JOBS_MAX_WORKERS = int(os.getenv("JOBS_MAX_WORKERS", "2"))
+JOBS_PER_SOURCE = int(os.getenv("JOBS_PER_SOURCE", "1"))
+JOBS_RETENTION = int(os.getenv("JOBS_RETENTION", str(7 * 24 * 3600)))
+
+# Chat history storage (chat_messages / chat_results tables)
+CHAT_RESULT_PREVIEW_ROWS = int(os.getenv("CHAT_RESULT_PREVIEW_ROWS", "100"))
+CHAT_RESULT_MAX_BYTES = int(os.getenv("CHAT_RESULT_MAX_BYTES", str(2 * 1024 * 1024)))
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+CHAT_APPEND_RETRIES = int(os.getenv("CHAT_APPEND_RETRIES", "3"))
+
+# Schema prompt: token budget for the schema section (also the is_large threshold)
+PROMPT_SCHEMA_TOKEN_BUDGET = int(os.getenv("PROMPT_SCHEMA_TOKEN_BUDGET", "4000"))
+# Columns retrieved from the vector index before packing them into the budget
+SEMANTIC_CANDIDATES = int(os.getenv("SEMANTIC_CANDIDATES", "60"))
+# Longest foreign-key path (in joins) added between tables matched by semantic search
+JOIN_PATH_MAX_HOPS = int(os.getenv("JOIN_PATH_MAX_HOPS", "3"))
+
+# Tracing: per-request stage timings are printed for requests slower than TRACE_SLOW_MS
+# (0 prints every request, negative disables); spans go to an OTLP collector when
+# OTEL_EXPORTER_OTLP_ENDPOINT is set and the OpenTelemetry SDK is installed
+TRACE_SLOW_MS = int(os.getenv("TRACE_SLOW_MS", "2000"))
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "querai-backend")
@@ -0,0 +1,127 @@
+"""
+In-process cache of the connection rows the query path reads.
+
+Rows are fetched with only the columns queries need: the compact `schema_pack` instead of
+the `schema_elements_flat` JSON list, and not the `schema_json` UX tree. Cached rows hold
+the decoded pack, with `schema_elements_flat` as its lazy element list. Within
+CONNECTION_CACHE_FRESH seconds of the last check a row is served without a Supabase call;
+after that a one-row `schema_hash,updated_at` probe revalidates it and only a changed
+version refetches the row. Refresh/delete invalidate the entry in this process; other
+workers pick the change up at their next probe.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import CONNECTION_CACHE_FRESH, CONNECTION_CACHE_MAX_ENTRIES
+from app.core.executor import run_blocking
+from app.core.fingerprint import schema_hash
+from app.core.schema_index import SCHEMA_INDEX_VERSION
+from app.core.schema_pack import SchemaPack
+from app.services import supabase_client
+
+QUERY_COLUMNS = ("id", "user_id", "source_type", "db_details", "s3_uri", "schema_pack", "schema_index",
+                 "is_large", "index_strategy", "schema_hash", "updated_at")
+VERSION_COLUMNS = ("schema_hash", "updated_at")
+
+Version = Tuple[Any, ...]
+
+
+def _version(row: Dict[str, Any]) -> Version:
+    return tuple(row.get(c) for c in VERSION_COLUMNS)
+
+
+async def _fetch(connection_id: str, columns: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+    r = await supabase_client.get_client().get(
+        "/connections",
+        headers=supabase_client.sb_headers(),
+        params={"id": f"eq.{connection_id}", "select": ",".join(columns)},
+    )
+    if not r.is_success:
+        raise RuntimeError(f"Connection could not be read: {r.text}")
+    rows = r.json()
+    return rows[0] if rows else None
+
+
+class ConnectionCache:
+    """LRU of (last check, stored version, row) per connection id, with hit/revalidation counters."""
+
+    def __init__(self, max_entries: int, fresh_seconds: float):
+        self._max_entries = max_entries
+        self._fresh = fresh_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Version, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0}
+
+    def _lookup(self, cid: str) -> Tuple[float, Version, Dict[str, Any]] | None:
+        with self._lock:
+            entry = self._entries.get(cid)
+            if entry is not None:
+                self._entries.move_to_end(cid)
+            return entry
+
+    def _store(self, cid: str, version: Version, row: Dict[str, Any], counter: str) -> None:
+        with self._lock:
+            self._entries[cid] = (time.monotonic(), version, row)
+            self._entries.move_to_end(cid)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+            self.stats[counter] += 1
+
+    async def _load(self, cid: str) -> Dict[str, Any] | None:
+        row = await _fetch(cid, QUERY_COLUMNS)
+        if row is None:
+            return None
+        version = _version(row)
+        pack = await run_blocking(SchemaPack.decode, row.get("schema_pack"))
+        row["schema_pack"] = pack
+        if pack is not None:
+            # Lazy: strings are only built if this request (or a later one) needs the flat list
+            row["schema_elements_flat"] = pack.elements
+        else:
+            # Rows saved before schema packs: the JSON list (and, for an outdated index, the UX tree's types)
+            extra_columns = ("schema_elements_flat",)
+            if (row.get("schema_index") or {}).get("v") != SCHEMA_INDEX_VERSION:
+                extra_columns += ("schema_json",)
+            row.update(await _fetch(cid, extra_columns) or {})
+        if not row.get("schema_hash"):
+            row["schema_hash"] = await run_blocking(schema_hash, row.get("schema_elements_flat") or [])
+        self._store(cid, version, row, "misses")
+        return row
+
+    async def get(self, connection_id: str, user_id: str | None = None) -> Dict[str, Any]:
+        """
+        Connection row for the query path (treat as read-only: it is shared between requests).
+        Raises RuntimeError when the connection does not exist or belongs to another user.
+        """
+        cid = str(connection_id)
+        entry = self._lookup(cid)
+        row = None
+        if entry is not None:
+            checked_at, version, cached = entry
+            if time.monotonic() - checked_at < self._fresh:
+                with self._lock:
+                    self.stats["hits"] += 1
+                row = cached
+            else:
+                current = await _fetch(cid, VERSION_COLUMNS)
+                if current is not None and _version(current) == version:
+                    self._store(cid, version, cached, "revalidated")
+                    row = cached
+        if row is None:
+            row = await self._load(cid)
+        if row is None or (user_id and str(row.get("user_id")) != str(user_id)):
+            if row is None:
+                self.invalidate(cid)
+            raise RuntimeError("Connection not found or cannot be read")
+        return row
+
+    def invalidate(self, connection_id: str) -> None:
+        with self._lock:
+            self._entries.pop(str(connection_id), None)
+
+
+connection_cache = ConnectionCache(CONNECTION_CACHE_MAX_ENTRIES, CONNECTION_CACHE_FRESH)
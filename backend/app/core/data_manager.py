@@ -1,8 +1,100 @@
-import pandas as pd
-import duckdb
+import datetime
+import decimal
+import json
+import threading
+import uuid
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
 from sqlalchemy import inspect, Engine
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Union
+
+from app.core.config import DISCOVERY_CONCURRENCY
+
+DEFAULT_BATCH_SIZE = 1000
+
+IGNORE_SCHEMAS = [
+    'information_schema', 'pg_catalog', 'performance_schema',
+    'mysql', 'sys', 'topology', 'tiger', 'tiger_data', 'public'
+]
+
+
+def json_default(value: Any) -> Any:
+    """json.dumps fallback for driver/Arrow values (Decimal, dates, UUID, bytes)."""
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return str(value)
+
+
+class ArrowRows(list):
+    """
+    Row dicts that also carry the Arrow data they were decoded from (`arrow`: a record batch
+    or table). DuckDB results keep it so result shaping can work on the columnar data
+    instead of rebuilding Arrow from Python rows.
+    """
+
+    def __init__(self, rows: Iterable[Dict[str, Any]], arrow: Union[pa.RecordBatch, pa.Table]):
+        super().__init__(rows)
+        self.arrow = arrow
+
+
+def collect_rows(batches: Iterable[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Concatenate row batches; the result is ArrowRows when every batch carried Arrow data."""
+    batches = list(batches)
+    rows = [row for batch in batches for row in batch]
+    arrows = [getattr(batch, "arrow", None) for batch in batches]
+    if not arrows or any(a is None for a in arrows):
+        return rows
+    try:
+        return ArrowRows(rows, pa.Table.from_batches(arrows))
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return rows
+
+
+def limit_batches(
+    batches: Iterable[List[Dict[str, Any]]],
+    max_rows: int,
+    max_bytes: int,
+    stats: Dict[str, Any],
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Pass batches through until the row or (JSON-encoded) byte cap is hit.
+    Fills `stats` with `row_count` and `truncated`; closes the source iterator early on truncation
+    so server-side cursors are released.
+    """
+    stats.update(row_count=0, truncated=False)
+    size = 0
+    try:
+        for batch in batches:
+            out = []
+            for row in batch:
+                if stats["row_count"] >= max_rows:
+                    stats["truncated"] = True
+                    break
+                size += len(json.dumps(row, default=json_default))
+                if size > max_bytes:
+                    stats["truncated"] = True
+                    break
+                out.append(row)
+                stats["row_count"] += 1
+            if out:
+                arrow = getattr(batch, "arrow", None)
+                yield ArrowRows(out, arrow.slice(0, len(out))) if arrow is not None else out
+            if stats["truncated"]:
+                return
+    finally:
+        close = getattr(batches, "close", None)
+        if close:
+            close()
+
 
 class DataSourceManager(ABC):
     """Abstract base class for data source operations."""
@@ -14,6 +106,50 @@ class DataSourceManager(ABC):
     def execute_query(self, sql_query: str) -> List[Dict[str, Any]]:
         pass
 
+    def execute_query_iter(self, sql_query: str, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Stream the result as batches of row dicts without materializing the full result.
+        Default falls back to execute_query; concrete managers override with cursor streaming.
+        """
+        rows = self.execute_query(sql_query)
+        for i in range(0, len(rows), batch_size):
+            yield rows[i:i + batch_size]
+
+    def estimate_row_count(self, sql_query: str) -> Optional[int]:
+        """Cheap total-row hint for truncated results; None when unknown."""
+        return None
+
+    def explain_estimate(self, sql_query: str) -> Optional[Dict[str, float]]:
+        """
+        Planner estimate without running the query: {"cost": total plan cost, "rows": largest
+        row estimate of any plan node}; either may be None. None when the engine has no EXPLAIN.
+        """
+        return None
+
+    def execute_query_limited(
+        self,
+        sql_query: str,
+        max_rows: int,
+        max_bytes: int,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        count_query: Optional[str] = None,
+    ) -> tuple[List[Dict[str, Any]], bool, Optional[int]]:
+        """
+        Execute with row/byte caps.
+        `count_query` is the statement the row-count hint describes (defaults to `sql_query`).
+        Returns a tuple: (rows, truncated, total_count_hint)
+        """
+        stats: Dict[str, Any] = {}
+        rows = collect_rows(limit_batches(self.execute_query_iter(sql_query, batch_size), max_rows, max_bytes, stats))
+        if not stats["truncated"]:
+            return rows, False, stats["row_count"]
+        try:
+            hint = self.estimate_row_count(count_query or sql_query)
+        except Exception as e:
+            print(f"Row count estimate failed: {e}")
+            hint = None
+        return rows, True, hint
+
     def get_schema_columns_with_types(self) -> List[Dict[str, str]]:
         """
         Optional convenience: return a list of dicts with schema/table/column/type.
@@ -22,83 +158,459 @@ class DataSourceManager(ABC):
         """
         return []
 
+    def discover_schema(self) -> tuple[list[str], List[Dict[str, str]]]:
+        """
+        Single-pass discovery returning (flat elements, typed rows).
+        Default calls both getters; managers override to crawl the source only once.
+        """
+        return self.get_schema_elements(), self.get_schema_columns_with_types()
+
+    def table_fingerprints(self) -> Optional[Dict[str, str]]:
+        """
+        Cheap per-table change markers {"schema.table": hash} read from the source catalog.
+        None means the source has none; callers then hash the discovered columns instead.
+        """
+        return None
+
+    def discover_tables(self, tables: List[str]) -> List[Dict[str, str]]:
+        """Typed rows for the given "schema.table" names only. Default filters a full crawl."""
+        wanted = set(tables)
+        return [d for d in self.discover_schema()[1] if f"{d['schema']}.{d['table']}" in wanted]
+
+    def discover_relations(self) -> Optional[Dict[str, Any]]:
+        """
+        Keys and size hints read from the source catalog:
+          {"primary_keys": {"schema.table": [column, ...]},
+           "foreign_keys": [{"table", "columns", "ref_table", "ref_columns"}, ...],
+           "row_estimates": {"schema.table": int}}
+        None means the source declares none; join edges are then inferred from column names.
+        """
+        return None
+
+    def pool_status(self) -> Optional[Dict[str, int]]:
+        """Connection pool occupancy {"checked_out", "idle", "overflow"}; None when there is no pool."""
+        return None
+
+    def close(self) -> None:
+        """Release underlying connections/pools. Default is a no-op."""
+        pass
+
+def _typed_row(schema_name: str, table_name: str, col: Dict[str, Any]) -> Dict[str, str]:
+    return {
+        "schema": schema_name,
+        "table": table_name,
+        "column": col.get('name'),
+        "type": str(col.get('type', '')),
+    }
+
+
 class SQLAlchemyManager(DataSourceManager):
     """Manages connections and queries for SQLAlchemy compatible databases."""
     def __init__(self, engine: Engine):
         self._engine = engine
 
     def get_schema_elements(self) -> list[str]:
+        return self.discover_schema()[0]
+
+    def get_schema_columns_with_types(self) -> List[Dict[str, str]]:
+        return self.discover_schema()[1]
+
+    def discover_schema(self) -> tuple[list[str], List[Dict[str, str]]]:
+        details = self._discover_columns()
+        elements = [f"{d['schema']}.{d['table']}.{d['column']}" for d in details]
+        return elements, details
+
+    def _discover_columns(self) -> List[Dict[str, str]]:
+        dialect = self._engine.dialect.name
+        if dialect in ('postgresql', 'mysql'):
+            try:
+                return self._bulk_columns(dialect)
+            except Exception as e:
+                print(f"Bulk column discovery failed, falling back to reflection: {e}")
+        return self._reflect_columns()
+
+    def table_fingerprints(self) -> Optional[Dict[str, str]]:
+        dialect = self._engine.dialect.name
+        ignored = ", ".join(f"'{name}'" for name in IGNORE_SCHEMAS)
+        if dialect == 'postgresql':
+            # Hash of each table's live attributes straight from the catalog (no row data read)
+            sql = f"""
+                SELECT n.nspname, c.relname,
+                       md5(string_agg(a.attname || ':' || format_type(a.atttypid, a.atttypmod), ','
+                                      ORDER BY a.attnum))
+                FROM pg_catalog.pg_attribute a
+                JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+                JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                WHERE c.relkind IN ('r', 'p') AND a.attnum > 0 AND NOT a.attisdropped
+                  AND n.nspname NOT IN ({ignored})
+                GROUP BY n.nspname, c.relname
+            """
+        elif dialect == 'mysql':
+            sql = f"""
+                SELECT c.table_schema, c.table_name,
+                       md5(group_concat(concat(c.column_name, ':', c.column_type)
+                                        ORDER BY c.ordinal_position SEPARATOR ','))
+                FROM information_schema.columns c
+                JOIN information_schema.tables t
+                  ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+                WHERE t.table_type = 'BASE TABLE'
+                  AND c.table_schema NOT IN ({ignored})
+                GROUP BY c.table_schema, c.table_name
+            """
+        else:
+            return None
+        try:
+            with self._engine.connect() as connection:
+                if dialect == 'mysql':
+                    # Default limit (1024) would silently truncate wide tables
+                    connection.exec_driver_sql("SET SESSION group_concat_max_len = 1048576")
+                rows = connection.exec_driver_sql(sql).fetchall()
+        except Exception as e:
+            print(f"Reading table fingerprints failed: {e}")
+            return None
+        return {f"{schema}.{table}": str(digest) for schema, table, digest in rows}
+
+    def discover_relations(self) -> Optional[Dict[str, Any]]:
+        dialect = self._engine.dialect.name
+        relations = None
+        if dialect in ('postgresql', 'mysql'):
+            try:
+                relations = self._bulk_relations(dialect)
+            except Exception as e:
+                print(f"Bulk key discovery failed, falling back to reflection: {e}")
+        if relations is None:
+            try:
+                relations = self._reflect_relations()
+            except Exception as e:
+                print(f"Key discovery failed: {e}")
+                return None
+        return relations
+
+    def _bulk_relations(self, dialect: str) -> Dict[str, Any]:
+        """Primary/foreign keys and planner row estimates in two catalog round trips."""
+        ignored = ", ".join(f"'{name}'" for name in IGNORE_SCHEMAS)
+        primary_keys: Dict[str, List[str]] = {}
+        foreign_keys: List[Dict[str, Any]] = []
+        row_estimates: Dict[str, int] = {}
+        with self._engine.connect() as connection:
+            if dialect == 'postgresql':
+                constraints = connection.exec_driver_sql(f"""
+                    SELECT con.contype, n.nspname, c.relname,
+                           array(SELECT a.attname::text
+                                 FROM unnest(con.conkey) WITH ORDINALITY k(attnum, ord)
+                                 JOIN pg_catalog.pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+                                 ORDER BY k.ord),
+                           fn.nspname, fc.relname,
+                           array(SELECT a.attname::text
+                                 FROM unnest(con.confkey) WITH ORDINALITY k(attnum, ord)
+                                 JOIN pg_catalog.pg_attribute a ON a.attrelid = con.confrelid AND a.attnum = k.attnum
+                                 ORDER BY k.ord)
+                    FROM pg_catalog.pg_constraint con
+                    JOIN pg_catalog.pg_class c ON c.oid = con.conrelid
+                    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                    LEFT JOIN pg_catalog.pg_class fc ON fc.oid = con.confrelid
+                    LEFT JOIN pg_catalog.pg_namespace fn ON fn.oid = fc.relnamespace
+                    WHERE con.contype IN ('p', 'f') AND n.nspname NOT IN ({ignored})
+                """).fetchall()
+                for kind, schema, table, columns, ref_schema, ref_table, ref_columns in constraints:
+                    if kind == 'p':
+                        primary_keys[f"{schema}.{table}"] = list(columns)
+                    else:
+                        foreign_keys.append({
+                            "table": f"{schema}.{table}", "columns": list(columns),
+                            "ref_table": f"{ref_schema}.{ref_table}", "ref_columns": list(ref_columns),
+                        })
+                # reltuples is the planner's estimate (-1 until the table is first analyzed)
+                sizes = connection.exec_driver_sql(f"""
+                    SELECT n.nspname, c.relname, c.reltuples::bigint
+                    FROM pg_catalog.pg_class c
+                    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+                    WHERE c.relkind IN ('r', 'p') AND n.nspname NOT IN ({ignored})
+                """).fetchall()
+            else:
+                usage = connection.exec_driver_sql(f"""
+                    SELECT k.table_schema, k.table_name, k.constraint_name, k.column_name,
+                           k.referenced_table_schema, k.referenced_table_name, k.referenced_column_name
+                    FROM information_schema.key_column_usage k
+                    WHERE k.table_schema NOT IN ({ignored})
+                      AND (k.constraint_name = 'PRIMARY' OR k.referenced_table_name IS NOT NULL)
+                    ORDER BY k.table_schema, k.table_name, k.constraint_name, k.ordinal_position
+                """).fetchall()
+                by_constraint: Dict[tuple, Dict[str, Any]] = {}
+                for schema, table, name, column, ref_schema, ref_table, ref_column in usage:
+                    if name == 'PRIMARY':
+                        primary_keys.setdefault(f"{schema}.{table}", []).append(column)
+                        continue
+                    fk = by_constraint.setdefault((schema, table, name), {
+                        "table": f"{schema}.{table}", "columns": [],
+                        "ref_table": f"{ref_schema}.{ref_table}", "ref_columns": [],
+                    })
+                    fk["columns"].append(column)
+                    fk["ref_columns"].append(ref_column)
+                foreign_keys.extend(by_constraint.values())
+                # table_rows is InnoDB's sampled estimate
+                sizes = connection.exec_driver_sql(f"""
+                    SELECT table_schema, table_name, table_rows
+                    FROM information_schema.tables
+                    WHERE table_type = 'BASE TABLE' AND table_schema NOT IN ({ignored})
+                """).fetchall()
+        for schema, table, rows in sizes:
+            if rows is not None and int(rows) >= 0:
+                row_estimates[f"{schema}.{table}"] = int(rows)
+        return {"primary_keys": primary_keys, "foreign_keys": foreign_keys, "row_estimates": row_estimates}
+
+    def _reflect_relations(self) -> Dict[str, Any]:
+        """Inspector fallback: per-schema key reflection (no row estimates)."""
         inspector = inspect(self._engine)
-        schema_elements = []
-        ignore_schemas = [
-            'information_schema', 'pg_catalog', 'performance_schema',
-            'mysql', 'sys', 'topology', 'tiger', 'tiger_data', 'public'
+        schemas = [s for s in inspector.get_schema_names() if s not in IGNORE_SCHEMAS]
+
+        def reflect_schema(schema_name: str):
+            local = inspect(self._engine)
+            if hasattr(local, "get_multi_pk_constraint"):
+                pks = {t: pk for (_, t), pk in local.get_multi_pk_constraint(schema=schema_name).items()}
+                fks = {t: fk for (_, t), fk in local.get_multi_foreign_keys(schema=schema_name).items()}
+            else:
+                names = local.get_table_names(schema=schema_name)
+                pks = {t: local.get_pk_constraint(t, schema=schema_name) for t in names}
+                fks = {t: local.get_foreign_keys(t, schema=schema_name) for t in names}
+            return schema_name, pks, fks
+
+        primary_keys: Dict[str, List[str]] = {}
+        foreign_keys: List[Dict[str, Any]] = []
+        with ThreadPoolExecutor(max_workers=DISCOVERY_CONCURRENCY) as pool:
+            for schema_name, pks, fks in pool.map(reflect_schema, schemas):
+                for table, pk in pks.items():
+                    if pk and pk.get("constrained_columns"):
+                        primary_keys[f"{schema_name}.{table}"] = list(pk["constrained_columns"])
+                for table, keys in fks.items():
+                    for fk in keys or []:
+                        foreign_keys.append({
+                            "table": f"{schema_name}.{table}",
+                            "columns": list(fk.get("constrained_columns") or []),
+                            "ref_table": f"{fk.get('referred_schema') or schema_name}.{fk.get('referred_table')}",
+                            "ref_columns": list(fk.get("referred_columns") or []),
+                        })
+        return {"primary_keys": primary_keys, "foreign_keys": foreign_keys, "row_estimates": {}}
+
+    def discover_tables(self, tables: List[str]) -> List[Dict[str, str]]:
+        if not tables:
+            return []
+        dialect = self._engine.dialect.name
+        if dialect in ('postgresql', 'mysql'):
+            try:
+                return self._bulk_columns(dialect, tables)
+            except Exception as e:
+                print(f"Bulk column discovery failed, falling back to reflection: {e}")
+        return super().discover_tables(tables)
+
+    def _bulk_columns(self, dialect: str, tables: Optional[List[str]] = None) -> List[Dict[str, str]]:
+        """One information_schema round trip for every column of every base table (or of `tables`)."""
+        ignored = ", ".join(f"'{name}'" for name in IGNORE_SCHEMAS)
+        only = ""
+        if tables:
+            pairs = []
+            for name in tables:
+                schema, _, table = name.partition(".")
+                pairs.append("('{}', '{}')".format(schema.replace("'", "''"), table.replace("'", "''")))
+            only = f"AND (c.table_schema, c.table_name) IN ({', '.join(pairs)})"
+        if dialect == 'postgresql':
+            type_expr = (
+                "upper(c.data_type) || coalesce('(' || c.character_maximum_length || ')', '')"
+            )
+        else:
+            type_expr = "upper(c.column_type)"
+        sql = f"""
+            SELECT c.table_schema, c.table_name, c.column_name, {type_expr}
+            FROM information_schema.columns c
+            JOIN information_schema.tables t
+              ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+            WHERE t.table_type = 'BASE TABLE'
+              AND c.table_schema NOT IN ({ignored})
+              {only}
+            ORDER BY c.table_schema, c.table_name, c.ordinal_position
+        """
+        with self._engine.connect() as connection:
+            rows = connection.exec_driver_sql(sql).fetchall()
+        return [
+            {"schema": schema, "table": table, "column": column, "type": str(col_type or "")}
+            for schema, table, column, col_type in rows
         ]
-        for schema_name in inspector.get_schema_names():
-            if schema_name in ignore_schemas:
-                continue
-            for table_name in inspector.get_table_names(schema=schema_name):
-                columns = inspector.get_columns(table_name, schema=schema_name)
-                for col in columns:
-                    schema_elements.append(f"{schema_name}.{table_name}.{col['name']}")
-        return schema_elements
 
-    def get_schema_columns_with_types(self) -> List[Dict[str, str]]:
+    def _reflect_columns(self) -> List[Dict[str, str]]:
+        """Inspector fallback: bulk per-schema reflection, or concurrent per-table calls."""
         inspector = inspect(self._engine)
+        schemas = [s for s in inspector.get_schema_names() if s not in IGNORE_SCHEMAS]
+
+        def reflect_schema(schema_name: str) -> List[Dict[str, str]]:
+            # Inspectors cache per instance and are not thread-safe: one per task
+            local = inspect(self._engine)
+            out: List[Dict[str, str]] = []
+            if hasattr(local, "get_multi_columns"):
+                columns_by_table = local.get_multi_columns(schema=schema_name)
+                tables = sorted(columns_by_table.items(), key=lambda item: item[0][1])
+                for (_, table_name), columns in tables:
+                    for col in columns:
+                        out.append(_typed_row(schema_name, table_name, col))
+                return out
+            table_names = local.get_table_names(schema=schema_name)
+            with ThreadPoolExecutor(max_workers=DISCOVERY_CONCURRENCY) as pool:
+                per_table = pool.map(
+                    lambda t: (t, inspect(self._engine).get_columns(t, schema=schema_name)), table_names
+                )
+                for table_name, columns in per_table:
+                    for col in columns:
+                        out.append(_typed_row(schema_name, table_name, col))
+            return out
+
         details: List[Dict[str, str]] = []
-        ignore_schemas = [
-            'information_schema', 'pg_catalog', 'performance_schema',
-            'mysql', 'sys', 'topology', 'tiger', 'tiger_data', 'public'
-        ]
-        for schema_name in inspector.get_schema_names():
-            if schema_name in ignore_schemas:
-                continue
-            for table_name in inspector.get_table_names(schema=schema_name):
-                columns = inspector.get_columns(table_name, schema=schema_name)
-                for col in columns:
-                    col_type = str(col.get('type', ''))
-                    details.append({
-                        "schema": schema_name,
-                        "table": table_name,
-                        "column": col.get('name'),
-                        "type": col_type,
-                    })
+        with ThreadPoolExecutor(max_workers=DISCOVERY_CONCURRENCY) as pool:
+            for rows in pool.map(reflect_schema, schemas):
+                details.extend(rows)
         return details
 
     def execute_query(self, sql_query: str) -> List[Dict[str, Any]]:
+        return [row for batch in self.execute_query_iter(sql_query) for row in batch]
+
+    def explain_estimate(self, sql_query: str) -> Optional[Dict[str, float]]:
+        dialect = self._engine.dialect.name
+        if dialect == 'postgresql':
+            with self._engine.connect() as connection:
+                plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql_query}").scalar()
+            plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+            rows, stack = 0.0, [plan]
+            while stack:
+                node = stack.pop()
+                rows = max(rows, float(node.get("Plan Rows") or 0))
+                stack.extend(node.get("Plans") or [])
+            return {"cost": float(plan["Total Cost"]), "rows": rows}
+        if dialect == 'mysql':
+            with self._engine.connect() as connection:
+                plan = json.loads(connection.exec_driver_sql(f"EXPLAIN FORMAT=JSON {sql_query}").scalar())
+            cost = plan.get("query_block", {}).get("cost_info", {}).get("query_cost")
+            return {"cost": float(cost) if cost is not None else None, "rows": None}
+        return None
+
+    def execute_query_iter(self, sql_query: str, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
         with self._engine.connect() as connection:
-            df = pd.read_sql(sql_query, connection)
-            return df.to_dict(orient='records')
+            # stream_results -> server-side cursor (psycopg2 named cursor / PyMySQL SSCursor)
+            result = connection.execution_options(
+                stream_results=True, max_row_buffer=batch_size
+            ).exec_driver_sql(sql_query)
+            try:
+                keys = list(result.keys())
+                while True:
+                    rows = result.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield [dict(zip(keys, row)) for row in rows]
+            finally:
+                result.close()
+
+    def pool_status(self) -> Optional[Dict[str, int]]:
+        pool = self._engine.pool
+        if not hasattr(pool, "checkedout"):
+            return None
+        return {"checked_out": pool.checkedout(), "idle": pool.checkedin(), "overflow": max(pool.overflow(), 0)}
+
+    def close(self) -> None:
+        self._engine.dispose()
 
 class DuckDBManager(DataSourceManager):
     """Manages connections and queries for file-based sources via DuckDB."""
-    def __init__(self, connection):
+    def __init__(self, connection, statement_timeout_ms: Optional[int] = None):
         self._con = connection
-        self._table_name = self._get_table_name()
+        # DuckDB has no server-side timeout: queries are interrupted from a timer instead
+        self._statement_timeout_ms = statement_timeout_ms
 
-    def _get_table_name(self) -> str:
-        return self._con.execute("PRAGMA show_tables;").fetchdf()['name'][0]
+    def _table_names(self) -> List[str]:
+        """Every table/view of the connection: one per file dataset or sheet."""
+        rows = self._con.execute(
+            "SELECT table_name FROM information_schema.tables WHERE table_schema = 'main' ORDER BY table_name"
+        ).fetchall()
+        return [name for (name,) in rows]
 
     def get_schema_elements(self) -> list[str]:
-        columns_df = self._con.execute(f"DESCRIBE SELECT * FROM {self._table_name};").fetchdf()
-        columns = columns_df['column_name'].tolist()
-        return [f"{self._table_name}.{col_name}" for col_name in columns]
+        return self.discover_schema()[0]
 
     def execute_query(self, sql_query: str) -> List[Dict[str, Any]]:
-        df = self._con.execute(sql_query).fetchdf()
-        return df.to_dict(orient='records')
+        return [row for batch in self.execute_query_iter(sql_query) for row in batch]
+
+    def execute_query_iter(self, sql_query: str, batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
+        # A cursor is a separate handle on the same database, so pooled managers
+        # can serve concurrent requests without sharing one connection object
+        cur = self._con.cursor()
+        timer = None
+        if self._statement_timeout_ms:
+            timer = threading.Timer(self._statement_timeout_ms / 1000, cur.interrupt)
+            timer.daemon = True
+            timer.start()
+        try:
+            reader = cur.execute(sql_query).fetch_record_batch(batch_size)
+            for batch in reader:
+                yield ArrowRows(batch.to_pylist(), batch)
+        finally:
+            if timer is not None:
+                timer.cancel()
+            cur.close()
+
+    def explain_estimate(self, sql_query: str) -> Optional[Dict[str, float]]:
+        cur = self._con.cursor()
+        try:
+            plan = json.loads(cur.execute(f"EXPLAIN (FORMAT JSON) {sql_query}").fetchall()[0][1])
+        finally:
+            cur.close()
+
+        largest = 0.0
+
+        def cardinality(node: Dict[str, Any]) -> float:
+            nonlocal largest
+            children = [cardinality(child) for child in node.get("children") or []]
+            estimate = (node.get("extra_info") or {}).get("Estimated Cardinality")
+            if estimate is not None:
+                own = float(estimate)
+            elif node.get("name") in ("CROSS_PRODUCT", "NESTED_LOOP_JOIN", "BLOCKWISE_NL_JOIN") and children:
+                # Unestimated joins: assume the worst case, a full cross product
+                own = 1.0
+                for child in children:
+                    own *= child
+            else:
+                own = max(children, default=0.0)
+            largest = max(largest, own)
+            return own
+
+        for root in plan:
+            cardinality(root)
+        return {"cost": None, "rows": largest}
+
+    def estimate_row_count(self, sql_query: str) -> Optional[int]:
+        # Local/cached data: an exact count is cheap enough to serve as the hint
+        inner = sql_query.strip().rstrip(";")
+        cur = self._con.cursor()
+        try:
+            return int(cur.execute(f"SELECT count(*) FROM ({inner}) AS _q").fetchone()[0])
+        finally:
+            cur.close()
+
+    def close(self) -> None:
+        self._con.close()
+
+    def discover_schema(self) -> tuple[list[str], List[Dict[str, str]]]:
+        details = self.get_schema_columns_with_types()
+        return [f"{d['table']}.{d['column']}" for d in details], details
 
     def get_schema_columns_with_types(self) -> List[Dict[str, str]]:
-        df = self._con.execute(f"DESCRIBE SELECT * FROM {self._table_name};").fetchdf()
-        # DuckDB returns column_name and column_type
-        names = df['column_name'].tolist() if 'column_name' in df.columns else []
-        types = df['column_type'].tolist() if 'column_type' in df.columns else [""] * len(names)
         out: List[Dict[str, str]] = []
-        for name, typ in zip(names, types):
-            out.append({
-                "schema": "public",
-                "table": self._table_name,
-                "column": name,
-                "type": str(typ),
-            })
+        for table in self._table_names():
+            safe_table = table.replace('"', '""')
+            df = self._con.execute(f'DESCRIBE SELECT * FROM "{safe_table}";').fetchdf()
+            # DuckDB returns column_name and column_type
+            names = df['column_name'].tolist() if 'column_name' in df.columns else []
+            types = df['column_type'].tolist() if 'column_type' in df.columns else [""] * len(names)
+            for name, typ in zip(names, types):
+                out.append({
+                    "schema": "public",
+                    "table": table,
+                    "column": name,
+                    "type": str(typ),
+                })
         return out
@@ -1,46 +1,145 @@
 import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
 from sqlalchemy import create_engine
 import duckdb
-import pandas as pd
-import s3fs
 from app.schemas.query import DataSource
+from app.core.config import (
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+    MANAGER_MAX_ENTRIES, MANAGER_IDLE_TTL, SQL_STATEMENT_TIMEOUT_MS,
+)
 from app.core.data_manager import DataSourceManager, SQLAlchemyManager, DuckDBManager
+from app.core.file_cache import SNAPSHOT_TABLE, configure_s3, ensure_file_snapshot, write_snapshot
+from app.core.file_datasets import DEFAULT_TABLE, FILE_SOURCE_TYPES, Dataset, parse_datasets, reader_sql
+from app.core.fingerprint import source_fingerprint
+from app.core.telemetry import span
+
+
+def _create_view(con, name: str, select_sql: str) -> None:
+    # Non-temporary view so per-query cursors on the same database can see it
+    con.execute(f'CREATE OR REPLACE VIEW "{name}" AS SELECT * FROM {select_sql}')
+
+
+def _snapshot_tables(table: str, snapshot_dir: str) -> list[tuple[str, str]]:
+    """
+    (table name, SQL-quoted path) per Parquet file of a snapshot. `<SNAPSHOT_TABLE>.parquet`
+    is the dataset's own table; sheets keep their names, prefixed by the dataset when there are several.
+    """
+    out = []
+    for name in sorted(os.listdir(snapshot_dir)):
+        if not name.endswith(".parquet"):
+            continue
+        stem = name[:-len(".parquet")]
+        if stem == SNAPSHOT_TABLE:
+            view = table
+        else:
+            view = stem if table == DEFAULT_TABLE else f"{table}_{stem}"
+        out.append((view, os.path.join(snapshot_dir, name).replace("'", "''")))
+    return out
+
+
+def _attach_snapshot(con, table: str, snapshot_dir: str) -> None:
+    for view, safe_path in _snapshot_tables(table, snapshot_dir):
+        _create_view(con, view, f"read_parquet('{safe_path}')")
+
 
+def _attach_file_direct(con, source_type: str, dataset: Dataset) -> None:
+    """Fallback: read the source file straight from its location on every manager build."""
+    if source_type != 'excel':
+        _create_view(con, dataset.name, reader_sql(source_type, dataset))
+        return
+    # Stream the sheets through a throwaway Parquet conversion, then copy them into the database
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        write_snapshot(source_type, dataset.uri, tmp_dir)
+        for view, safe_path in _snapshot_tables(dataset.name, tmp_dir):
+            con.execute(f'CREATE OR REPLACE TABLE "{view}" AS SELECT * FROM read_parquet(\'{safe_path}\')')
 
-def create_data_manager(source: DataSource) -> DataSourceManager:
-    """Creates the appropriate data manager and connection engine from source details."""
+
+def _dataset_directory(uri: str) -> str:
+    """Directory a glob/prefix reads from (`s3://b/logs/2024-*.csv` -> `s3://b/logs/`)."""
+    head = re.split(r"[*?\[]", uri, maxsplit=1)[0]
+    return head[:head.rfind("/") + 1]
+
+
+def _sql_list(values: list[str]) -> str:
+    # Local paths are listed as given (that is how the views name them) and absolute
+    local = [os.path.abspath(v) + ("/" if v.endswith("/") else "") for v in values if "://" not in v]
+    return "[" + ", ".join("'" + v.replace("'", "''") + "'" for v in dict.fromkeys(values + local)) + "]"
+
+
+def _lock_down(con, directories: list[str], paths: list[str]) -> None:
+    """
+    Once the views exist, limit the database to the files behind them: no other local
+    files, URLs or secrets are reachable, and the settings cannot be changed back.
+    """
+    con.execute(f"SET allowed_directories = {_sql_list(directories)}")
+    con.execute(f"SET allowed_paths = {_sql_list(paths)}")
+    con.execute("SET enable_external_access = false")
+    con.execute("SET lock_configuration = true")
+
+
+def _connect_files(source_type: str, file_path: str, statement_timeout_ms: Optional[int] = None) -> DataSourceManager:
+    """
+    In-memory DuckDB with one table per dataset. Single CSV/Excel files are queried from a
+    local, typed Parquet snapshot keyed by the file's ETag; globs, prefixes and Parquet/JSON
+    files are read in place so partition and filename filters prune the files scanned.
+    """
+    con = duckdb.connect(database=':memory:')
+    s3_configured = False
+    directories: list[str] = []
+    paths: list[str] = []
+    for dataset in parse_datasets(source_type, file_path):
+        if not dataset.multi_file and source_type in ('csv', 'excel'):
+            try:
+                snapshot_dir = ensure_file_snapshot(source_type, dataset.uri)
+                _attach_snapshot(con, dataset.name, snapshot_dir)
+                directories.append(os.path.join(snapshot_dir, ""))
+                continue
+            except Exception as e:
+                print(f"File snapshot unavailable, reading source directly: {e}")
+        if dataset.uri.startswith("s3://") and source_type != 'excel' and not s3_configured:
+            # Enable S3 support
+            configure_s3(con)
+            s3_configured = True
+        _attach_file_direct(con, source_type, dataset)
+        if source_type == 'excel':
+            continue  # copied into tables; nothing is read later
+        if dataset.multi_file:
+            directories.append(_dataset_directory(dataset.uri))
+        else:
+            paths.append(dataset.uri)
+    _lock_down(con, directories, paths)
+    return DuckDBManager(con, statement_timeout_ms)
+
+
+def query_timeout_ms(source: DataSource) -> int:
+    """Per-connection statement timeout, falling back to SQL_STATEMENT_TIMEOUT_MS."""
+    if source.db_details and source.db_details.statement_timeout_ms:
+        return source.db_details.statement_timeout_ms
+    return SQL_STATEMENT_TIMEOUT_MS
+
+
+def create_data_manager(source: DataSource, statement_timeout_ms: Optional[int] = None,
+                        read_only: bool = False) -> DataSourceManager:
+    """
+    Creates the appropriate data manager and connection engine from source details.
+    Query managers pass `read_only` (database sessions refuse writes) and
+    `statement_timeout_ms` (bounds every statement server-side; 0/None disables it);
+    discovery crawls run without either.
+    """
 
     source_type = source.source_type.lower()
     uri = ""
 
     # If file_path is provided and source is one of the file-based types, prefer file workflow
-    if source.file_path and source_type in ['csv', 'excel']:
-        file_path = source.file_path
-        con = duckdb.connect(database=':memory:')
-        # Enable S3 support
-        con.execute("INSTALL httpfs; LOAD httpfs;")
-        region = os.getenv("AWS_REGION")
-        if region:
-            con.execute(f"SET s3_region='{region}'")
-        access_key = os.getenv("AWS_ACCESS_KEY_ID")
-        secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
-        if access_key and secret_key:
-            con.execute(f"SET s3_access_key_id='{access_key}'")
-            con.execute(f"SET s3_secret_access_key='{secret_key}'")
-
-        if source_type == 'csv':
-            # DuckDB can read CSV directly from s3:// URIs.
-            safe_uri = file_path.replace("'", "''")
-            con.execute(
-                f"CREATE OR REPLACE TEMP VIEW data AS SELECT * FROM read_csv_auto('{safe_uri}', HEADER=TRUE)"
-            )
-            return DuckDBManager(con)
-
-        if source_type == 'excel':
-            # Use pandas + s3fs for Excel, then register
-            df = pd.read_excel(file_path)
-            con.register("data", df)
-            return DuckDBManager(con)
+    if source.file_path and source_type in FILE_SOURCE_TYPES:
+        return _connect_files(source_type, source.file_path, statement_timeout_ms)
 
 
     # Fallback to DB workflow
@@ -55,8 +154,196 @@ def create_data_manager(source: DataSource) -> DataSourceManager:
         elif source_type == 'mysql':
             uri = f"mysql+pymysql://{details.username}:{details.password}@{details.host}:{details.port}/{details.database}"
 
-        engine = create_engine(uri)
+        # Read-only sessions as a second line of defence behind the SQL guard
+        connect_args = {}
+        if source_type == 'postgresql':
+            options = ["-c default_transaction_read_only=on"] if read_only else []
+            if statement_timeout_ms:
+                options.append(f"-c statement_timeout={int(statement_timeout_ms)}")
+            if options:
+                connect_args["options"] = " ".join(options)
+        else:
+            # One SET statement: init_command runs without multi-statement support
+            assignments = ["SESSION transaction_read_only = ON"] if read_only else []
+            if statement_timeout_ms:
+                assignments.append(f"SESSION max_execution_time = {int(statement_timeout_ms)}")
+            if assignments:
+                connect_args["init_command"] = "SET " + ", ".join(assignments)
+
+        engine = create_engine(
+            uri,
+            connect_args=connect_args,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+        )
         return SQLAlchemyManager(engine)
 
     else:
         raise ValueError(f"Unsupported data source type: '{source_type}'")
+
+
+class _Entry:
+    """A pooled manager with its lease count; closed once retired and no longer leased."""
+
+    __slots__ = ("manager", "last_used", "holders", "retired")
+
+    def __init__(self, manager: DataSourceManager):
+        self.manager = manager
+        self.last_used = time.monotonic()
+        self.holders = 0
+        self.retired = False
+
+
+class DataManagerRegistry:
+    """
+    Long-lived data managers keyed by (connection_id, credentials fingerprint).
+
+    Warm queries reuse the pooled SQLAlchemy engine / DuckDB database instead of paying
+    for engine creation, httpfs setup and file reads on every question. Entries idle for
+    longer than `idle_ttl` seconds are dropped, the map is capped at `max_entries` (LRU),
+    and a changed fingerprint (e.g. rotated password) replaces the stale manager.
+
+    Managers are leased (`acquire` / `release`): a dropped entry is only closed once its
+    last holder releases it, so eviction, refresh or delete never close a database under
+    a query that is still running on it.
+    """
+
+    def __init__(self, max_entries: int, idle_ttl: int):
+        self._max_entries = max_entries
+        self._idle_ttl = idle_ttl
+        self._entries: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def _retire(entries: list[_Entry]) -> list[DataSourceManager]:
+        """Mark dropped entries retired; returns the managers nobody holds (to close now)."""
+        closable = []
+        for entry in entries:
+            entry.retired = True
+            if entry.holders == 0:
+                closable.append(entry.manager)
+        return closable
+
+    def _pop_idle(self, now: float) -> list[DataSourceManager]:
+        stale = [k for k, e in self._entries.items() if e.holders == 0 and now - e.last_used > self._idle_ttl]
+        return self._retire([self._entries.pop(k) for k in stale])
+
+    def _pop_connection(self, connection_id: str) -> list[DataSourceManager]:
+        keys = [k for k in self._entries if k[0] == connection_id]
+        return self._retire([self._entries.pop(k) for k in keys])
+
+    @staticmethod
+    def _close(managers: list[DataSourceManager]) -> None:
+        for manager in managers:
+            try:
+                manager.close()
+            except Exception as e:
+                print(f"Error closing data manager: {e}")
+
+    def _lease(self, key: Tuple[str, str], now: float) -> Optional[_Entry]:
+        # Caller holds self._lock
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.last_used = now
+            entry.holders += 1
+            self._entries.move_to_end(key)
+        return entry
+
+    def acquire(self, connection_id: str, source: DataSource) -> _Entry:
+        """Lease the manager for a connection, building it on first use. Pair with `release`."""
+        cid = str(connection_id)
+        key = (cid, source_fingerprint(source))
+        now = time.monotonic()
+
+        with self._lock:
+            to_close = self._pop_idle(now)
+            entry = self._lease(key, now)
+            build_lock = self._build_locks.setdefault(cid, threading.Lock())
+        self._close(to_close)
+        if entry is not None:
+            return entry
+
+        with build_lock:
+            with self._lock:
+                entry = self._lease(key, time.monotonic())
+            if entry is not None:
+                return entry
+
+            with span("datasource.connect", source_type=source.source_type.lower()):
+                entry = _Entry(create_data_manager(source, query_timeout_ms(source), read_only=True))
+            entry.holders = 1
+
+            with self._lock:
+                # Credentials changed: drop managers built from the old fingerprint
+                to_close = self._pop_connection(cid)
+                self._entries[key] = entry
+                evicted = []
+                while len(self._entries) > self._max_entries:
+                    evicted.append(self._entries.popitem(last=False)[1])
+                to_close += self._retire(evicted)
+            self._close(to_close)
+            return entry
+
+    def release(self, entry: _Entry) -> None:
+        with self._lock:
+            entry.holders -= 1
+            entry.last_used = time.monotonic()
+            close = entry.retired and entry.holders == 0
+        if close:
+            self._close([entry.manager])
+
+    def invalidate(self, connection_id: str) -> None:
+        """Forget every manager for a connection (refresh / delete); each closes once released."""
+        with self._lock:
+            to_close = self._pop_connection(str(connection_id))
+            self._build_locks.pop(str(connection_id), None)
+        self._close(to_close)
+
+    def stats(self) -> Dict[str, int]:
+        """Pooled managers and the summed occupancy of their connection pools."""
+        with self._lock:
+            managers = [e.manager for e in self._entries.values()]
+        totals = {"managers": len(managers), "checked_out": 0, "idle": 0, "overflow": 0}
+        for manager in managers:
+            for state, count in (manager.pool_status() or {}).items():
+                totals[state] += count
+        return totals
+
+    def close_all(self) -> None:
+        """Shutdown: close every pooled manager, leased or not."""
+        with self._lock:
+            to_close = [e.manager for e in self._entries.values()]
+            for entry in self._entries.values():
+                entry.retired = True
+            self._entries.clear()
+            self._build_locks.clear()
+        self._close(to_close)
+
+
+_registry = DataManagerRegistry(MANAGER_MAX_ENTRIES, MANAGER_IDLE_TTL)
+
+
+@contextmanager
+def lease_data_manager(connection_id: str, source: DataSource) -> Iterator[DataSourceManager]:
+    """A pooled, long-lived manager for a saved connection, held for the `with` block."""
+    entry = _registry.acquire(connection_id, source)
+    try:
+        yield entry.manager
+    finally:
+        _registry.release(entry)
+
+
+def invalidate_data_manager(connection_id: str) -> None:
+    _registry.invalidate(connection_id)
+
+
+def data_manager_stats() -> Dict[str, int]:
+    return _registry.stats()
+
+
+def close_all_data_managers() -> None:
+    _registry.close_all()
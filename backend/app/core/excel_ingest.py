@@ -0,0 +1,133 @@
+"""
+Streaming conversion of Excel workbooks into Parquet, one file per sheet.
+
+Sheets are read with openpyxl in read-only mode (rows are parsed as they are iterated, not
+loaded as a whole) and converted EXCEL_CHUNK_ROWS rows at a time into Arrow record batches,
+each written as its own Parquet part. DuckDB then merges the parts of a sheet into one
+typed, zstd-compressed file, unifying chunk types (`union_by_name`) so a column that is
+empty in one chunk or mixes numbers and text across chunks still gets a single type.
+Memory stays bounded by the chunk size whatever the workbook size.
+"""
+from __future__ import annotations
+
+import os
+import re
+import shutil
+from typing import Any, Iterable, List, Sequence, Tuple
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.core.config import EXCEL_CHUNK_ROWS
+
+
+def _table_name(sheet: str, used: set[str]) -> str:
+    base = re.sub(r"\W+", "_", sheet).strip("_").lower() or "sheet"
+    if base[0].isdigit():
+        base = f"t_{base}"
+    name, suffix = base, 2
+    while name in used:
+        name = f"{base}_{suffix}"
+        suffix += 1
+    used.add(name)
+    return name
+
+
+def _header(row: Sequence[Any]) -> List[str]:
+    """Column names from the first row: blanks become `column_<n>`, duplicates get a suffix."""
+    names: List[str] = []
+    seen: set[str] = set()
+    for i, value in enumerate(row):
+        base = str(value).strip() if value is not None and str(value).strip() else f"column_{i + 1}"
+        name, suffix = base, 2
+        while name in seen:
+            name = f"{base}_{suffix}"
+            suffix += 1
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def _column(values: Tuple[Any, ...]) -> pa.Array:
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Mixed cell types within the chunk: keep them as text
+        return pa.array([None if v is None else str(v) for v in values], pa.string())
+
+
+def _batch(names: List[str], rows: List[Tuple[Any, ...]]) -> pa.RecordBatch:
+    width = len(names)
+    padded = [tuple(row[:width]) + (None,) * (width - len(row)) for row in rows]
+    columns = list(zip(*padded)) if padded else [()] * width
+    return pa.RecordBatch.from_arrays([_column(values) for values in columns], names=names)
+
+
+def _write_parts(rows: Iterable[Tuple[Any, ...]], parts_dir: str) -> int:
+    """Write a sheet's rows as Parquet parts of EXCEL_CHUNK_ROWS rows; returns the part count."""
+    rows = iter(rows)
+    names = None
+    for row in rows:
+        if row is not None and any(v is not None for v in row):
+            names = _header(row)
+            break
+    if names is None:
+        return 0  # empty sheet
+    parts = 0
+    chunk: List[Tuple[Any, ...]] = []
+
+    def flush() -> None:
+        nonlocal parts
+        pq.write_table(pa.Table.from_batches([_batch(names, chunk)]), os.path.join(parts_dir, f"part-{parts:05d}.parquet"))
+        parts += 1
+        chunk.clear()
+
+    for row in rows:
+        if row is None or all(v is None for v in row):
+            continue
+        chunk.append(row)
+        if len(chunk) >= EXCEL_CHUNK_ROWS:
+            flush()
+    if chunk or parts == 0:
+        flush()
+    return parts
+
+
+def excel_to_parquet(workbook_path: str, target_dir: str, single_name: str) -> List[str]:
+    """
+    Convert every non-empty sheet of a local workbook into `<table>.parquet` under
+    `target_dir`. A workbook with one such sheet is written as `<single_name>.parquet`;
+    otherwise tables are named after their sheets. Returns the table names.
+    """
+    from openpyxl import load_workbook
+
+    parts_root = os.path.join(target_dir, ".parts")
+    workbook = load_workbook(workbook_path, read_only=True, data_only=True)
+    sheets: List[Tuple[str, str]] = []  # (sheet title, parts dir)
+    try:
+        for index, sheet in enumerate(workbook.worksheets):
+            parts_dir = os.path.join(parts_root, str(index))
+            os.makedirs(parts_dir, exist_ok=True)
+            if _write_parts(sheet.iter_rows(values_only=True), parts_dir):
+                sheets.append((sheet.title, parts_dir))
+    finally:
+        workbook.close()
+
+    used: set[str] = {single_name}  # reserved for the single-sheet case
+    tables: List[str] = []
+    con = duckdb.connect(database=':memory:')
+    try:
+        for title, parts_dir in sheets:
+            table = single_name if len(sheets) == 1 else _table_name(title, used)
+            safe_parts = os.path.join(parts_dir, "*.parquet").replace("'", "''")
+            safe_target = os.path.join(target_dir, f"{table}.parquet").replace("'", "''")
+            con.execute(
+                f"COPY (SELECT * FROM read_parquet('{safe_parts}', union_by_name = true)) "
+                f"TO '{safe_target}' (FORMAT PARQUET, COMPRESSION ZSTD)"
+            )
+            tables.append(table)
+    finally:
+        con.close()
+        shutil.rmtree(parts_root, ignore_errors=True)
+    return tables
@@ -0,0 +1,60 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator
+
+from app.core.config import BLOCKING_EXECUTOR_WORKERS
+
+# Sized separately from the FastAPI/AnyIO threadpool so slow DB queries cannot starve
+# other sync work (and vice versa).
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_EXECUTOR_WORKERS, thread_name_prefix="querai-blocking")
+
+
+async def run_blocking(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run a blocking callable on the dedicated executor and await its result."""
+    loop = asyncio.get_running_loop()
+    # Carry context variables (request trace, current span) into the worker thread, as asyncio.to_thread does
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+def stats() -> dict:
+    """Thread and queue counts of the blocking executor (for /metrics)."""
+    return {"max_workers": _executor._max_workers, "threads": len(_executor._threads),
+            "queued": _executor._work_queue.qsize()}
+
+
+def shutdown() -> None:
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def iterate_blocking(fn: Callable[..., Iterator[Any]], *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+    """
+    Drive a blocking generator from async code: the generator is created and advanced on
+    the dedicated executor, and closed there too if the consumer stops early.
+    """
+    gen = await run_blocking(fn, *args, **kwargs)
+    sentinel = object()
+    # Cancellation can land while next() is still running in a worker thread. Closing the
+    # generator then would fail with "generator already executing" and leave its cleanup
+    # (leases, cursors) to GC, so close() waits for the in-flight step on this lock.
+    step_lock = threading.Lock()
+
+    def advance() -> Any:
+        with step_lock:
+            return next(gen, sentinel)
+
+    def close() -> None:
+        with step_lock:
+            gen.close()
+
+    try:
+        while True:
+            item = await run_blocking(advance)
+            if item is sentinel:
+                break
+            yield item
+    finally:
+        await run_blocking(close)
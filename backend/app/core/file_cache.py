@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import fnmatch
+import glob
+import hashlib
+import os
+import re
+import shutil
+import threading
+from typing import Dict
+from urllib.parse import urlparse
+
+import duckdb
+
+from app.core.config import FILE_CACHE_DIR
+from app.core.excel_ingest import excel_to_parquet
+from app.core.file_datasets import is_multi_file, split_locations
+
+# File stem of a snapshot's single table. Sheet tables are sanitized names that never start
+# with "_", so a sheet (e.g. one called "Data") cannot take it
+SNAPSHOT_TABLE = "_dataset"
+# Bumped when the snapshot layout changes so older snapshots are rebuilt
+# (2: one file per Excel sheet, 3: reserved single-table stem)
+SNAPSHOT_FORMAT = "3"
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def configure_s3(con) -> None:
+    """Enable httpfs and pass AWS settings from the environment to a DuckDB connection."""
+    con.execute("INSTALL httpfs; LOAD httpfs;")
+    region = os.getenv("AWS_REGION")
+    if region:
+        con.execute(f"SET s3_region='{region}'")
+    access_key = os.getenv("AWS_ACCESS_KEY_ID")
+    secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
+    if access_key and secret_key:
+        con.execute(f"SET s3_access_key_id='{access_key}'")
+        con.execute(f"SET s3_secret_access_key='{secret_key}'")
+
+
+def _split_s3_uri(uri: str) -> tuple[str, str]:
+    parsed = urlparse(uri)
+    return parsed.netloc, parsed.path.lstrip("/")
+
+
+def _listing_version(uri: str) -> str:
+    """Hash of every file a glob/prefix matches (key + ETag on S3, path + size + mtime locally)."""
+    digest = hashlib.sha256()
+    pattern = uri if not uri.endswith("/") else f"{uri}**"
+    if uri.startswith("s3://"):
+        import boto3
+
+        bucket, key_pattern = _split_s3_uri(pattern)
+        prefix = re.split(r"[*?\[]", key_pattern, maxsplit=1)[0]
+        pages = boto3.client("s3", region_name=os.getenv("AWS_REGION")).get_paginator("list_objects_v2").paginate(
+            Bucket=bucket, Prefix=prefix
+        )
+        for page in pages:
+            for obj in page.get("Contents") or []:
+                # fnmatch's `*` also crosses `/`, like a `**` glob
+                if fnmatch.fnmatchcase(obj["Key"], key_pattern):
+                    digest.update(f"{obj['Key']}:{obj['ETag']}\n".encode("utf-8"))
+    else:
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            if os.path.isfile(path):
+                st = os.stat(path)
+                digest.update(f"{path}:{st.st_size}-{st.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+def source_version(file_path: str) -> str:
+    """
+    Cheap version marker for a file source: the S3 ETag for s3:// URIs, size + mtime for
+    local paths, a hash over the matched files for globs/prefixes, and a hash of the
+    per-location markers when the connection lists several locations.
+    """
+    locations = split_locations(file_path)
+    if len(locations) != 1:
+        return hashlib.sha256("\n".join(map(source_version, locations)).encode("utf-8")).hexdigest()[:32]
+    file_path = locations[0]
+    if is_multi_file(file_path):
+        return _listing_version(file_path)
+    if file_path.startswith("s3://"):
+        import boto3
+
+        bucket, key = _split_s3_uri(file_path)
+        head = boto3.client("s3", region_name=os.getenv("AWS_REGION")).head_object(Bucket=bucket, Key=key)
+        return head["ETag"].strip('"')
+    st = os.stat(file_path)
+    return f"{st.st_size}-{st.st_mtime_ns}"
+
+
+def _lock_for(key: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def write_snapshot(source_type: str, file_path: str, target_dir: str) -> None:
+    """Convert the source file into zstd-compressed, column-typed Parquet files (one per table)."""
+    if source_type == 'excel':
+        workbook = file_path
+        if file_path.startswith("s3://"):
+            import boto3
+
+            # Streamed to disk: openpyxl's read-only mode needs a seekable file, not the whole workbook in memory
+            bucket, key = _split_s3_uri(file_path)
+            workbook = os.path.join(target_dir, ".workbook.xlsx")
+            boto3.client("s3", region_name=os.getenv("AWS_REGION")).download_file(bucket, key, workbook)
+        try:
+            excel_to_parquet(workbook, target_dir, SNAPSHOT_TABLE)
+        finally:
+            if workbook != file_path:
+                os.remove(workbook)
+        return
+    if source_type != 'csv':
+        raise ValueError(f"Unsupported file source type: '{source_type}'")
+    con = duckdb.connect(database=':memory:')
+    try:
+        if file_path.startswith("s3://"):
+            configure_s3(con)
+        safe_uri = file_path.replace("'", "''")
+        safe_target = os.path.join(target_dir, f"{SNAPSHOT_TABLE}.parquet").replace("'", "''")
+        con.execute(
+            f"COPY (SELECT * FROM read_csv_auto('{safe_uri}', HEADER=TRUE)) "
+            f"TO '{safe_target}' (FORMAT PARQUET, COMPRESSION ZSTD)"
+        )
+    finally:
+        con.close()
+
+
+def ensure_file_snapshot(source_type: str, file_path: str) -> str:
+    """
+    Return the directory holding a local Parquet snapshot of a CSV/Excel source,
+    building it if this version (ETag) of the file has not been ingested yet.
+    Each `<table>.parquet` file in the directory is exposed as a table: `data.parquet`
+    for a CSV or single-sheet workbook, one file per sheet otherwise.
+    """
+    source_key = hashlib.sha256(f"{source_type}:{file_path}".encode("utf-8")).hexdigest()[:16]
+    version = hashlib.sha256(f"{SNAPSHOT_FORMAT}:{source_version(file_path)}".encode("utf-8")).hexdigest()[:16]
+    base = os.path.join(FILE_CACHE_DIR, source_key)
+    snapshot_dir = os.path.join(base, version)
+    if os.path.isdir(snapshot_dir):
+        return snapshot_dir
+
+    with _lock_for(source_key):
+        if os.path.isdir(snapshot_dir):
+            return snapshot_dir
+        tmp_dir = f"{snapshot_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        try:
+            write_snapshot(source_type, file_path, tmp_dir)
+            os.replace(tmp_dir, snapshot_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        # Older versions of the same file are no longer reachable
+        for name in os.listdir(base):
+            if name != version and not name.startswith(f"{version}.tmp"):
+                shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+    return snapshot_dir
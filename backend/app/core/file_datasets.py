@@ -0,0 +1,97 @@
+"""
+Datasets of a file connection.
+
+A file connection's `s3_uri` holds one or more locations (comma or newline separated). Each
+location is a single file, a glob (`s3://bucket/logs/2024-*.csv`) or a prefix ending in `/`
+(`s3://bucket/events/`, typically Hive-partitioned as `dt=2024-01-01/part-0.parquet`), and is
+exposed as one table. Multi-file locations are read in place by DuckDB with Hive partition
+columns and a `filename` column, so filters on either only open the matching files.
+"""
+from __future__ import annotations
+
+import re
+from typing import List, NamedTuple
+from urllib.parse import urlparse
+
+FILE_SOURCE_TYPES = ("csv", "excel", "parquet", "json")
+
+# Table name when a connection has a single location (what single-file connections always used)
+DEFAULT_TABLE = "data"
+
+_GLOB_CHARS = re.compile(r"[*?\[]")
+_EXTENSIONS = {"csv": "csv", "parquet": "parquet", "json": "json"}
+
+
+class Dataset(NamedTuple):
+    name: str        # table name
+    uri: str         # file, glob or prefix
+    multi_file: bool
+
+
+def is_multi_file(uri: str) -> bool:
+    return uri.endswith("/") or bool(_GLOB_CHARS.search(uri))
+
+
+def split_locations(file_path: str) -> List[str]:
+    return [part.strip() for part in re.split(r"[\n,]", file_path or "") if part.strip()]
+
+
+def _table_name(uri: str) -> str:
+    """`s3://b/events/dt=*/x.parquet` -> events, `logs/daily_*.csv` -> daily, `/data/orders.csv` -> orders."""
+    path = urlparse(uri).path if uri.startswith("s3://") else uri
+    candidates = [urlparse(uri).netloc] if uri.startswith("s3://") else []
+    for segment in path.replace("\\", "/").split("/"):
+        if not segment:
+            continue
+        name = re.sub(r"\W+", "_", segment.split(".")[0]).strip("_").lower()
+        if name and "=" not in segment:  # Hive partition directories are columns, not names
+            candidates.append(name)
+        if _GLOB_CHARS.search(segment):
+            break
+    name = candidates[-1] if candidates else DEFAULT_TABLE
+    return f"t_{name}" if name[0].isdigit() else name
+
+
+def parse_datasets(source_type: str, file_path: str) -> List[Dataset]:
+    """
+    Datasets of a file connection, in the order given. A single location is the table `data`;
+    several are named after their path (deduplicated with a numeric suffix).
+    Raises ValueError for an empty path or a glob/prefix of Excel workbooks.
+    """
+    locations = split_locations(file_path)
+    if not locations:
+        raise ValueError("A file path or s3:// URI is required for file sources")
+    if source_type == "excel" and any(is_multi_file(uri) for uri in locations):
+        raise ValueError("Excel sources take workbook paths, not globs or prefixes")
+    if len(locations) == 1:
+        return [Dataset(DEFAULT_TABLE, locations[0], is_multi_file(locations[0]))]
+    datasets: List[Dataset] = []
+    used: set[str] = set()
+    for uri in locations:
+        base = name = _table_name(uri)
+        suffix = 2
+        while name in used:
+            name = f"{base}_{suffix}"
+            suffix += 1
+        used.add(name)
+        datasets.append(Dataset(name, uri, is_multi_file(uri)))
+    return datasets
+
+
+def reader_sql(source_type: str, dataset: Dataset) -> str:
+    """DuckDB table function reading a CSV/Parquet/JSON dataset straight from its location."""
+    uri = dataset.uri
+    if uri.endswith("/"):
+        uri = f"{uri}**/*.{_EXTENSIONS[source_type]}"
+    safe_uri = uri.replace("'", "''")
+    options = ""
+    if dataset.multi_file:
+        # Partition/filename columns are pushed down as file filters; files may add columns over time
+        options = ", hive_partitioning = true, union_by_name = true, filename = true"
+    if source_type == "csv":
+        return f"read_csv_auto('{safe_uri}', HEADER = TRUE{options})"
+    if source_type == "parquet":
+        return f"read_parquet('{safe_uri}'{options})"
+    if source_type == "json":
+        return f"read_json_auto('{safe_uri}'{options})"
+    raise ValueError(f"Unsupported file source type: '{source_type}'")
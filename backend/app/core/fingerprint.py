@@ -0,0 +1,36 @@
+import hashlib
+import json
+from typing import Dict, Iterable, List
+
+
+def schema_hash(schema_elements: Iterable[str]) -> str:
+    """Stable short hash of a flat schema list; order-sensitive like the stored list."""
+    h = hashlib.sha256()
+    for el in schema_elements:
+        h.update(el.encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()[:16]
+
+
+def source_fingerprint(source) -> str:
+    """Hash of a DataSource's connection-relevant fields (type, credentials, file path)."""
+    payload = json.dumps(source.dict(), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def table_hashes(typed_rows: Iterable[Dict[str, str]]) -> Dict[str, str]:
+    """Per-table hash of ordered (column, type) pairs keyed by "schema.table"."""
+    columns: Dict[str, List[str]] = {}
+    for row in typed_rows:
+        key = f"{row.get('schema') or ''}.{row.get('table') or ''}"
+        columns.setdefault(key, []).append(f"{row.get('column')}:{row.get('type') or ''}")
+    return {key: hashlib.md5(",".join(cols).encode("utf-8")).hexdigest() for key, cols in columns.items()}
+
+
+def diff_table_hashes(old: Dict[str, str], new: Dict[str, str]) -> Dict[str, List[str]]:
+    """Tables added, removed and changed between two `table_hashes` snapshots."""
+    return {
+        "added": sorted(set(new) - set(old)),
+        "removed": sorted(set(old) - set(new)),
+        "changed": sorted(k for k in set(new) & set(old) if new[k] != old[k]),
+    }
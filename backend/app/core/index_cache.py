@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+from app.core.config import INDEX_CACHE_DIR, INDEX_CACHE_MAX_BYTES
+from app.core.fingerprint import schema_hash
+from app.core.semantic_search import ProgressCallback, SemanticSearch
+
+# In-progress builds are written to `<hash>.tmp-*`; only ones this old are left over from a crash
+_STALE_TMP_SECONDS = 3600
+
+
+class SchemaIndexCache:
+    """
+    Per-connection cache of FAISS vector stores for large schemas.
+
+    Indexes are built once (at connection create/refresh time) and persisted under
+    `<root>/<connection_id>/<schema_hash>/`. Lookups go through an in-process LRU bounded
+    by an approximate byte budget; misses load the on-disk index via memory mapping and
+    only fall back to re-embedding when nothing usable is on disk.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self._root = root
+        self._max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], SemanticSearch]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # One build at a time per connection (re-entrant: get() builds while holding it)
+        self._build_locks: Dict[str, threading.RLock] = {}
+        self.stats = {"hits": 0, "disk_loads": 0, "builds": 0}
+
+    def _dir(self, connection_id: str, shash: str | None = None) -> str:
+        base = os.path.join(self._root, str(connection_id))
+        return os.path.join(base, shash) if shash else base
+
+    def _remember(self, key: Tuple[str, str], search: SemanticSearch) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[key] = search
+            self._bytes += search.nbytes
+            # Evict least recently used entries, but always keep the newest one
+            while self._bytes > self._max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def _lookup(self, key: Tuple[str, str]) -> SemanticSearch | None:
+        with self._lock:
+            search = self._entries.get(key)
+            if search is not None:
+                self._entries.move_to_end(key)
+            return search
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self.stats[counter] += 1
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._bytes
+
+    def _build_lock(self, connection_id: str) -> threading.RLock:
+        with self._lock:
+            return self._build_locks.setdefault(str(connection_id), threading.RLock())
+
+    def _remove_stale_dirs(self, connection_id: str, keep: str) -> None:
+        """Drop older builds; temp dirs of builds still in progress (e.g. in another worker) stay."""
+        base = self._dir(connection_id)
+        if not os.path.isdir(base):
+            return
+        now = time.time()
+        for name in os.listdir(base):
+            path = os.path.join(base, name)
+            if name == keep:
+                continue
+            try:
+                if ".tmp-" in name and now - os.path.getmtime(path) < _STALE_TMP_SECONDS:
+                    continue
+            except OSError:
+                continue  # renamed or removed concurrently
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _previous_embeddings(self, connection_id: str):
+        """Embeddings of the most recent on-disk build for this connection, if any."""
+        base = self._dir(connection_id)
+        if not os.path.isdir(base):
+            return None
+        builds = [os.path.join(base, n) for n in os.listdir(base) if ".tmp-" not in n]
+        for path in sorted(builds, key=os.path.getmtime, reverse=True):
+            try:
+                previous = SemanticSearch.load_embeddings(path)
+            except Exception as e:
+                print(f"Ignoring unreadable index build {path}: {e}")
+                continue
+            if previous is not None:
+                return previous
+        return None
+
+    def build(
+        self,
+        connection_id: str,
+        schema_elements: list[str],
+        progress: Optional[ProgressCallback] = None,
+        strategy: Optional[str] = None,
+    ) -> SemanticSearch:
+        """
+        Embed the schema, persist the index to disk and keep it hot in memory.
+        Vectors from the previous build are reused, so a refresh only embeds new/changed elements.
+        """
+        shash = schema_hash(schema_elements)
+        key = (str(connection_id), shash)
+        with self._build_lock(connection_id):
+            search = SemanticSearch()
+            search.create_vector_store(schema_elements, progress=progress,
+                                       previous=self._previous_embeddings(connection_id), strategy=strategy)
+
+            # Write into a temp dir first so readers never see a half-written index
+            final_dir = self._dir(connection_id, shash)
+            tmp_dir = f"{final_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+            search.save(tmp_dir)
+            shutil.rmtree(final_dir, ignore_errors=True)
+            os.replace(tmp_dir, final_dir)
+            self._remove_stale_dirs(connection_id, keep=shash)
+
+            self._remember(key, search)
+            return search
+
+    def get(self, connection_id: str, schema_elements: Sequence[str], strategy: Optional[str] = None,
+            shash: Optional[str] = None) -> SemanticSearch:
+        """
+        Return a ready vector store for the connection's current schema (`strategy` is used on rebuild).
+        With a known `shash` the elements are only read when the index has to be built.
+        """
+        shash = shash or schema_hash(schema_elements)
+        key = (str(connection_id), shash)
+
+        search = self._lookup(key)
+        if search is not None:
+            self._count("hits")
+            return search
+
+        # Concurrent cold lookups wait here and then find the first one's index in memory
+        with self._build_lock(connection_id):
+            search = self._lookup(key)
+            if search is not None:
+                self._count("hits")
+                return search
+            path = self._dir(connection_id, shash)
+            if os.path.isdir(path):
+                try:
+                    search = SemanticSearch.load(path)
+                    self._remember(key, search)
+                    self._count("disk_loads")
+                    return search
+                except Exception as e:
+                    print(f"Failed to load cached index for {connection_id}: {e}")
+
+            # Nothing usable on disk (first query after deploy, wiped cache, ...)
+            self._count("builds")
+            return self.build(connection_id, list(schema_elements), strategy=strategy)
+
+    def invalidate(self, connection_id: str, remove_files: bool = False) -> None:
+        """Drop in-memory entries for a connection, optionally deleting its on-disk indexes."""
+        cid = str(connection_id)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == cid]:
+                self._bytes -= self._entries.pop(key).nbytes
+            self._build_locks.pop(cid, None)
+        if remove_files:
+            shutil.rmtree(self._dir(cid), ignore_errors=True)
+
+
+index_cache = SchemaIndexCache(INDEX_CACHE_DIR, INDEX_CACHE_MAX_BYTES)
@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from app.core.config import JOBS_DB_PATH, JOBS_MAX_WORKERS, JOBS_PER_SOURCE, JOBS_RETENTION
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+def _boot_id() -> str:
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+# Owner of the jobs this process runs. API workers share JOBS_DB_PATH, so each job records
+# which process runs it: host + boot id + pid, plus a nonce for a pid reused after a restart
+INSTANCE_ID = f"{socket.gethostname()}:{_boot_id()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def _instance_gone(owner: Optional[str]) -> bool:
+    """True when the process that owned a job has exited (or the host rebooted since)."""
+    if not owner:
+        return True  # records from before owners were stored
+    try:
+        host, boot_id, pid_text, _ = owner.rsplit(":", 3)
+        pid = int(pid_text)
+    except ValueError:
+        return True
+    if owner == INSTANCE_ID:
+        return False
+    if host != socket.gethostname():
+        return False  # another machine/container sharing the file: cannot tell, leave its jobs alone
+    if boot_id != _boot_id() or pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+class JobCancelled(Exception):
+    """Raised at a job checkpoint once cancellation has been requested."""
+
+
+class JobStore:
+    """SQLite-backed job records, so status and results survive restarts without a broker."""
+
+    _COLUMNS = ("id", "kind", "user_id", "connection_id", "source_key", "status", "progress",
+                "message", "result", "error", "created_at", "started_at", "finished_at")
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._con = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY, kind TEXT, user_id TEXT, connection_id TEXT, source_key TEXT,
+                    status TEXT, progress REAL, message TEXT, result TEXT, error TEXT,
+                    created_at REAL, started_at REAL, finished_at REAL
+                )
+                """
+            )
+            self._con.execute("CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, created_at)")
+            columns = {row[1] for row in self._con.execute("PRAGMA table_info(jobs)")}
+            if "owner" not in columns:
+                self._con.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+
+    def _row(self, row: tuple | None) -> Dict[str, Any] | None:
+        if row is None:
+            return None
+        job = dict(zip(self._COLUMNS, row))
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def insert(self, job: Dict[str, Any], owner: str) -> None:
+        values = [json.dumps(job[c], default=str) if c == "result" and job.get(c) is not None else job.get(c)
+                  for c in self._COLUMNS]
+        with self._lock:
+            self._con.execute(
+                f"INSERT INTO jobs ({', '.join(self._COLUMNS)}, owner) "
+                f"VALUES ({', '.join('?' * (len(self._COLUMNS) + 1))})",
+                [*values, owner],
+            )
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        if "result" in fields and fields["result"] is not None:
+            fields["result"] = json.dumps(fields["result"], default=str)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._con.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", [*fields.values(), job_id])
+
+    def get(self, job_id: str) -> Dict[str, Any] | None:
+        with self._lock:
+            row = self._con.execute(
+                f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._row(row)
+
+    def list(self, user_id: str, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        sql = f"SELECT {', '.join(self._COLUMNS)} FROM jobs WHERE user_id = ?"
+        params: List[Any] = [user_id]
+        if status:
+            sql += " AND status = ?"
+            params.append(status)
+        sql += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._con.execute(sql, params).fetchall()
+        return [self._row(r) for r in rows]
+
+    def fail_interrupted(self) -> int:
+        """
+        Jobs left queued/running by a process that no longer exists can never finish: mark
+        them failed. Jobs of live sibling workers sharing the database are left alone.
+        """
+        with self._lock:
+            owners = [row[0] for row in self._con.execute(
+                "SELECT DISTINCT owner FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            )]
+            failed = 0
+            for owner in filter(_instance_gone, owners):
+                cur = self._con.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status IN (?, ?) AND owner IS ?",
+                    (FAILED, "Interrupted by server restart", time.time(), QUEUED, RUNNING, owner),
+                )
+                failed += cur.rowcount
+            return failed
+
+    def prune(self, older_than: float) -> None:
+        with self._lock:
+            self._con.execute(
+                f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED))}) AND finished_at < ?",
+                (*FINISHED, older_than),
+            )
+
+
+class JobContext:
+    """Handle passed to job bodies for progress reporting, cancellation checks and blocking work."""
+
+    def __init__(self, manager: "JobManager", job_id: str):
+        self._manager = manager
+        self.job_id = job_id
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check(self) -> None:
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def progress(self, fraction: float, message: Optional[str] = None) -> None:
+        """Record progress (0..1); also a cancellation checkpoint. Safe to call from worker threads."""
+        self.check()
+        fields: Dict[str, Any] = {"progress": round(max(0.0, min(1.0, fraction)), 4)}
+        if message is not None:
+            fields["message"] = message
+        self._manager.store.update(self.job_id, **fields)
+
+    async def run_blocking(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run blocking work on the job pool (kept apart from the query executor)."""
+        self.check()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._manager.executor, functools.partial(fn, *args, **kwargs))
+
+
+JobBody = Callable[[JobContext], Awaitable[Any]]
+
+
+class JobManager:
+    """
+    In-process job queue: a bounded worker pool, a per-source concurrency limit
+    (so one database is not crawled by several jobs at once) and SQLite persistence.
+    """
+
+    def __init__(self, store: JobStore, max_workers: int, per_source: int):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="querai-jobs")
+        self._max_workers = max_workers
+        self._per_source = per_source
+        self._slots: asyncio.Semaphore | None = None
+        self._source_slots: Dict[str, asyncio.Semaphore] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._contexts: Dict[str, JobContext] = {}
+
+    def recover(self) -> None:
+        """Startup housekeeping: fail jobs orphaned by exited workers and drop expired records."""
+        interrupted = self.store.fail_interrupted()
+        if interrupted:
+            print(f"Marked {interrupted} interrupted job(s) as failed")
+        self.store.prune(time.time() - JOBS_RETENTION)
+
+    def submit(
+        self,
+        kind: str,
+        body: JobBody,
+        user_id: str,
+        source_key: Optional[str] = None,
+        connection_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Queue `body` and return the job record; must be called from the event loop."""
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "user_id": str(user_id),
+            "connection_id": str(connection_id) if connection_id is not None else None,
+            "source_key": source_key,
+            "status": QUEUED,
+            "progress": 0.0,
+            "message": None,
+            "result": None,
+            "error": None,
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+        }
+        self.store.insert(job, INSTANCE_ID)
+        ctx = JobContext(self, job["id"])
+        self._contexts[job["id"]] = ctx
+        self._tasks[job["id"]] = asyncio.create_task(self._run(ctx, body, source_key))
+        return job
+
+    async def _run(self, ctx: JobContext, body: JobBody, source_key: Optional[str]) -> None:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_workers)
+        source_slot = None
+        if source_key:
+            source_slot = self._source_slots.setdefault(source_key, asyncio.Semaphore(self._per_source))
+        try:
+            # Wait for the source first so a job queued behind the same database
+            # does not hold a worker slot that other sources could use
+            if source_slot is not None:
+                await source_slot.acquire()
+            try:
+                async with self._slots:
+                    ctx.check()
+                    self.store.update(ctx.job_id, status=RUNNING, started_at=time.time())
+                    result = await body(ctx)
+            finally:
+                if source_slot is not None:
+                    source_slot.release()
+            self.store.update(ctx.job_id, status=SUCCEEDED, progress=1.0, result=result, finished_at=time.time())
+        except (JobCancelled, asyncio.CancelledError):
+            self.store.update(ctx.job_id, status=CANCELLED, finished_at=time.time())
+        except Exception as e:
+            print(f"Job {ctx.job_id} failed: {e}")
+            error = getattr(e, "detail", None) or str(e)
+            self.store.update(ctx.job_id, status=FAILED, error=str(error), finished_at=time.time())
+        finally:
+            self._tasks.pop(ctx.job_id, None)
+            self._contexts.pop(ctx.job_id, None)
+
+    def get(self, job_id: str) -> Dict[str, Any] | None:
+        return self.store.get(job_id)
+
+    def list(self, user_id: str, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        return self.store.list(str(user_id), status, limit)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Request cancellation. Queued jobs never start; running jobs stop at their next
+        checkpoint (blocking work already on a thread finishes its current step first).
+        """
+        ctx = self._contexts.get(job_id)
+        task = self._tasks.get(job_id)
+        if ctx is None or task is None:
+            return False
+        ctx._cancel.set()
+        task.cancel()
+        return True
+
+    def shutdown(self) -> None:
+        for job_id in list(self._tasks):
+            self.cancel(job_id)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+job_manager = JobManager(JobStore(JOBS_DB_PATH), JOBS_MAX_WORKERS, JOBS_PER_SOURCE)
@@ -1,158 +1,605 @@
+import asyncio
 import json
-import os
-from collections import defaultdict
-from typing import Dict, Any
-
-import requests
+import time
+from typing import Dict, Any, AsyncIterator, Iterator
 
 from app.services import gemini_service
 from app.schemas.query import QueryRequest, QueryResponse, DataSource, DBDetails
-from app.core.data_manager_factory import create_data_manager
-from app.core.semantic_search import SemanticSearch
+from app.core.config import (
+    QUERY_BATCH_SIZE, QUERY_MAX_ROWS, QUERY_MAX_BYTES, QUERY_STREAM_MAX_ROWS, QUERY_STREAM_MAX_BYTES,
+    PROMPT_SCHEMA_TOKEN_BUDGET, SEMANTIC_CANDIDATES, JOIN_PATH_MAX_HOPS,
+    SQL_REPAIR_MAX_ATTEMPTS, SQL_REPAIR_DEADLINE, SQL_REPAIR_SCHEMA_TOKEN_BUDGET, RESULT_PREVIEW_ROWS,
+)
+from app.core.connection_cache import connection_cache
+from app.core.data_manager import collect_rows, json_default, limit_batches
+from app.core.data_manager_factory import lease_data_manager
+from app.core.executor import run_blocking, iterate_blocking
+from app.core.file_datasets import FILE_SOURCE_TYPES
+from app.core.index_cache import index_cache
+from app.core.prompt_builder import build_schema_prompt, slice_schema_prompt
+from app.core.query_cache import LLMOutput, llm_cache, result_cache
+from app.core.result_shaping import shape_result
+from app.core.result_store import result_store
+from app.core.schema_index import get_schema_index
+from app.core.semantic_search import embed_text
+from app.core.telemetry import record, span
+from app.core.sql_guard import (
+    DIALECT_NAMES, SQLGuardError, check_plan, error_text, guard_sql, referenced_tables, repairable_error, timeout_error,
+)
+
+
+async def _get_connection_row(connection_id: str, user_id: str | None) -> Dict[str, Any]:
+    with span("connection.load"):
+        return await connection_cache.get(connection_id, user_id)
+
+
+def _error_response(error_msg: str, explanation: str | None = None) -> QueryResponse:
+    return QueryResponse(response_type="error", sql_query="", explanation=explanation or error_msg, data=[{"error": error_msg}])
+
+
+def _sql_error_response(sql_query: str, error: SQLGuardError) -> QueryResponse:
+    """Refused or timed-out SQL: keep the statement so the UI can show what was rejected and why."""
+    return QueryResponse(response_type="error", sql_query=sql_query, explanation=error.message,
+                         data=[{"error": error.message}], error=error.to_dict())
+
+
+def _execution_error(error: Exception) -> SQLGuardError | None:
+    """Structured form of guard refusals and statement timeouts; None for other failures."""
+    if isinstance(error, SQLGuardError):
+        return error
+    return timeout_error(error)
+
+
+def _guarded(manager: Any, ds: DataSource, sql_query: str, max_rows: int) -> tuple[str, str]:
+    """Validate, bound (one row over the cap, so truncation is still detected) and cost-check SQL."""
+    guarded_sql, count_sql = guard_sql(sql_query, ds.source_type, max_rows + 1)
+    check_plan(manager, guarded_sql)
+    return guarded_sql, count_sql
+
 
+def _execute_sql(connection_id: str, ds: DataSource, sql_query: str) -> tuple[list[Dict[str, Any]], bool, int | None]:
+    """Blocking part of SQL answers; runs on the dedicated executor."""
+    with lease_data_manager(connection_id, ds) as manager:
+        with span("sql.guard"):
+            guarded_sql, count_sql = _guarded(manager, ds, sql_query, QUERY_MAX_ROWS)
+        with span("sql.execute", source_type=ds.source_type) as attributes:
+            rows, truncated, total_count_hint = manager.execute_query_limited(
+                guarded_sql, QUERY_MAX_ROWS, QUERY_MAX_BYTES, QUERY_BATCH_SIZE, count_query=count_sql)
+            attributes.update(rows=len(rows), truncated=truncated)
+    return rows, truncated, total_count_hint
 
-def _build_focused_schema_from_parts(parts: list[str]) -> str:
+
+def _iter_sql(connection_id: str, ds: DataSource, sql_query: str, stats: Dict[str, Any],
+              max_rows: int = QUERY_STREAM_MAX_ROWS, max_bytes: int = QUERY_STREAM_MAX_BYTES) -> Iterator[list[Dict[str, Any]]]:
+    """Blocking generator of capped result batches for streaming endpoints."""
+    # The lease is held until the generator finishes or is closed (iterate_blocking closes it)
+    with lease_data_manager(connection_id, ds) as manager:
+        with span("sql.guard"):
+            guarded_sql, _ = _guarded(manager, ds, sql_query, max_rows)
+        # Recorded at the end: batches are yielded from different executor steps (includes time spent sending them)
+        started = time.perf_counter()
+        try:
+            yield from limit_batches(
+                manager.execute_query_iter(guarded_sql, QUERY_BATCH_SIZE),
+                max_rows,
+                max_bytes,
+                stats,
+            )
+        finally:
+            record("sql.stream", time.perf_counter() - started, source_type=ds.source_type, rows=stats.get("row_count"))
+
+
+async def _build_schema_context(request: QueryRequest, conn: Dict[str, Any], schema_elements_flat: list[str],
+                                is_large: bool, shash: str) -> str:
+    """
+    Compact schema text within the request's token budget: the whole schema for small ones,
+    a relevance-packed slice for large ones.
     """
-        Reconstructs a human-readable schema string from a list of relevant parts.
-        Example input: ['users.user_id', 'users.name', 'orders.amount']
-        Example output:
-        Table `users` has columns: user_id, name
-        Table `orders` has columns: amount
-        """
+    budget = request.schema_token_budget or PROMPT_SCHEMA_TOKEN_BUDGET
+    # Parsed once per schema version; a cold miss may build it from the flat list
+    with span("schema.index"):
+        index = await run_blocking(get_schema_index, request.connection_id, shash, conn)
+    if not is_large:
+        return build_schema_prompt(schema_elements_flat, index.types, budget=budget, refs=index.refs)
 
-    tables = defaultdict(list)
-    for part in parts:
-        split_parts = part.split(".")
-        table_name = ".".join(split_parts[:-1])
-        column_name = split_parts[-1]
-        tables[table_name].append(column_name)
+    # Use semantic search to rank columns (index is prebuilt per connection and cached)
+    with span("semantic.index"):
+        search = await run_blocking(index_cache.get, request.connection_id, schema_elements_flat,
+                                    conn.get("index_strategy"), shash)
+    hits = await run_blocking(search.search, request.question, SEMANTIC_CANDIDATES)
+    if not hits:
+        return ""
+    scores = dict(hits)
 
-    schema_str = ""
-    for table, columns in tables.items():
-        column_list = ", ".join(columns)
-        schema_str += f"Table {table} has columns: {column_list}\n"
+    # Expand with id/name-like columns of matched tables, ranked just below the table's best hit
+    best_by_table: Dict[str, float] = {}
+    for element, score in hits:
+        table = index.table_of(element)
+        best_by_table[table] = max(score, best_by_table.get(table, score))
+    for table, best in best_by_table.items():
+        for element in index.identifier_elements(table):
+            scores.setdefault(element, best - 1e-3)
 
-    return schema_str.strip()
+    # Shortest foreign-key paths between matched tables: join columns (and bridge tables)
+    # rank with the weaker end of the path
+    tables = list(best_by_table)
+    for source, target, edges in index.join_paths(tables, JOIN_PATH_MAX_HOPS):
+        score = min(best_by_table[source], best_by_table[target]) - 1e-3
+        for table, columns, ref_table, ref_columns in edges:
+            for t, cols in ((table, columns), (ref_table, ref_columns)):
+                if t not in tables:
+                    tables.append(t)
+                for column in cols:
+                    scores[f"{t}.{column}"] = max(score, scores.get(f"{t}.{column}", score))
 
+    # Join partners of matched tables only fill whatever budget the hits leave
+    floor = min(score for _, score in hits) - 1e-3
+    for table in list(best_by_table):
+        for neighbor in index.neighbors(table):
+            if neighbor not in best_by_table:
+                tables.append(neighbor)
+                for element in index.identifier_elements(neighbor):
+                    scores.setdefault(element, floor)
 
-SUPABASE_URL = os.getenv("SUPABASE_URL") or os.getenv("NEXT_PUBLIC_SUPABASE_URL")
-SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
+    return build_schema_prompt(index.elements(tables), index.types, scores=scores, budget=budget, refs=index.refs)
 
 
-def _sb_headers() -> Dict[str, str]:
-    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
-        raise RuntimeError("Supabase env vars missing (SUPABASE_URL / SUPABASE_SERVICE_KEY)")
-    return {
-        "apikey": SUPABASE_SERVICE_KEY,
-        "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
-        "Content-Type": "application/json",
-    }
+def _datasource_for(conn: Dict[str, Any]) -> DataSource:
+    """Build a DataSource from saved connection details to execute SQL."""
+    st = (conn.get("source_type") or "").lower()
+    if st in ("postgresql", "mysql"):
+        raw = conn.get("db_details") or "{}"
+        details_obj = json.loads(raw) if isinstance(raw, str) else raw
+        return DataSource(source_type=st, db_details=DBDetails(**details_obj), file_path=None)
+    elif st in FILE_SOURCE_TYPES:
+        return DataSource(source_type=st, db_details=None, file_path=conn.get("s3_uri"))
+    else:
+        raise RuntimeError(f"Unsupported source type: {st}")
 
 
-def _get_connection_row(connection_id: str, user_id: str | None) -> Dict[str, Any]:
-    params = {"id": f"eq.{connection_id}", "select": "*"}
-    if user_id:
-        params["user_id"] = f"eq.{user_id}"
-    r = requests.get(f"{SUPABASE_URL}/rest/v1/connections", headers=_sb_headers(), params=params)
-    if not r.ok or not r.json():
-        raise RuntimeError("Connection not found or cannot be read")
-    return r.json()[0]
+async def _cached_answer(request: QueryRequest, shash: str) -> LLMOutput | None:
+    """Repeated questions on the same schema version skip retrieval and the LLM round trip."""
+    if llm_cache.semantic_enabled:
+        return await run_blocking(llm_cache.get, request.connection_id, shash, request.question, embed_text)
+    return llm_cache.get(request.connection_id, shash, request.question)
 
 
-def process_query(request: QueryRequest) -> QueryResponse:
-    try:
-        if not request.connection_id:
-            error_msg = "A connection_id must be provided in the request."
-            return QueryResponse(response_type="error", sql_query="", explanation=error_msg, data=[{"error": error_msg}])
+async def _remember_answer(request: QueryRequest, shash: str, output: LLMOutput) -> None:
+    response_type, sql_query, _ = output
+    if not (response_type == "meta" or (response_type == "sql" and sql_query)):
+        return
+    if llm_cache.semantic_enabled:
+        await run_blocking(llm_cache.put, request.connection_id, shash, request.question, output, embed_text)
+    else:
+        llm_cache.put(request.connection_id, shash, request.question, output)
 
-        # Load connection row (includes schema artifacts and execution details)
-        conn = _get_connection_row(request.connection_id, request.user_id)
 
-        schema_elements_flat: list[str] = conn.get("schema_elements_flat") or []
-        is_large: bool = bool(conn.get("is_large"))
+def _finalize_answer(conn: Dict[str, Any], response_type: str, sql_query: str | None,
+                     explanation: str) -> tuple[QueryResponse, DataSource | None]:
+    # Handle the response based on its type (SQL, Meta, or Error)
+    if response_type == "error":
+        # Error occurred within the Gemini service
+        return _error_response(explanation), None
 
-        if not schema_elements_flat:
-            error_msg = "No cached schema found for the provided connection."
-            return QueryResponse(response_type="error", sql_query="", explanation=error_msg, data=[{"error": error_msg}])
+    elif response_type == "meta":
+        # This was a meta-question. No SQL is run.
+        # The 'explanation' field contains the full answer.
+        return QueryResponse(
+            response_type="meta",
+            sql_query="",  # No SQL was generated or run
+            explanation=explanation,
+            data=[]  # No data result
+        ), None
+
+    elif response_type == "sql":
+        # This was a data query. We must have a SQL query.
+        if not sql_query:
+            # Safeguard: LLM said 'sql' but sent no query
+            error_msg = "The AI identified this as a data query but failed to produce SQL."
+            return _error_response(error_msg, explanation), None
+
+        return QueryResponse(
+            response_type="sql",
+            sql_query=sql_query,
+            explanation=explanation,
+            data=[]
+        ), _datasource_for(conn)
+
+    else:
+        # Fallback for an unknown response type
+        error_msg = f"Received an unknown response type from the AI: {response_type}"
+        return _error_response(error_msg, explanation), None
 
+
+def _dialect(conn: Dict[str, Any]) -> str | None:
+    return DIALECT_NAMES.get((conn.get("source_type") or "").lower())
+
+
+async def prepare_query(request: QueryRequest) -> tuple[QueryResponse, DataSource | None, Dict[str, Any]]:
+    """
+    Resolve schema context and ask the LLM, without executing anything.
+    Returns the response skeleton, the DataSource to run `sql_query` against (None when the
+    answer is final: meta / error) and the context execution needs for repairs and caching:
+    {conn, shash, db_schema (None for cached answers), cached}.
+    """
+    if not request.connection_id:
+        return _error_response("A connection_id must be provided in the request."), None, {}
+
+    # Load connection row (includes schema artifacts and execution details)
+    conn = await _get_connection_row(request.connection_id, request.user_id)
+
+    schema_elements_flat: list[str] = conn.get("schema_elements_flat") or []
+    is_large: bool = bool(conn.get("is_large"))
+
+    if not schema_elements_flat:
+        return _error_response("No cached schema found for the provided connection."), None, {}
+
+    shash = conn["schema_hash"]
+    context: Dict[str, Any] = {"conn": conn, "shash": shash, "db_schema": None, "cached": True}
+    output = await _cached_answer(request, shash)
+    if output is None:
         # Build hybrid context for LLM
-        if not is_large:
-            db_schema = _build_focused_schema_from_parts(schema_elements_flat)
-        else:
-            # Use semantic search to filter
-            search = SemanticSearch()
-            search.create_vector_store(schema_elements_flat)
-            semantic_parts = search.find_relevant_schema_parts(request.question)
-
-            # Expand with id/name-like columns for matched tables
-            relevant_tables = set(".".join(p.split(".")[:-1]) for p in semantic_parts)
-            schema_parts = set(semantic_parts)
-            identifier_keywords = ['name', 'title', 'label', 'isim', 'ad']
-            for element in schema_elements_flat:
-                element_table = ".".join(element.split('.')[:-1])
-                element_column = element.split('.')[-1].lower()
-                if element_table in relevant_tables:
-                    if element_column.endswith('_id') or element_column == 'id':
-                        schema_parts.add(element)
-                    for keyword in identifier_keywords:
-                        if keyword in element_column:
-                            schema_parts.add(element)
-
-            db_schema = _build_focused_schema_from_parts(list(schema_parts))
+        db_schema = await _build_schema_context(request, conn, schema_elements_flat, is_large, shash)
+        context.update(db_schema=db_schema, cached=False)
 
         # Send the schema and question to the LLM
-        response_type, sql_query, explanation = gemini_service.generate_intelligent_response(request.question,
-                                                                                             db_schema)
-
-        # Handle the response based on its type (SQL, Meta, or Error)
-        if response_type == "error":
-            # Error occurred within the Gemini service
-            return QueryResponse(response_type="error", sql_query="", explanation=explanation, data=[{"error": explanation}])
-
-        elif response_type == "meta":
-            # This was a meta-question. No SQL is run.
-            # The 'explanation' field contains the full answer.
-            return QueryResponse(
-                response_type="meta",
-                sql_query="",  # No SQL was generated or run
-                explanation=explanation,
-                data=[]  # No data result
-            )
+        output = await gemini_service.generate_intelligent_response(request.question, db_schema, _dialect(conn))
+        if output[0] != "sql":
+            # SQL answers are cached once they have executed successfully
+            await _remember_answer(request, shash, output)
 
-        elif response_type == "sql":
-            # This was a data query. We must have a SQL query.
-            if not sql_query:
-                # Safeguard: LLM said 'sql' but sent no query
-                error_msg = "The AI identified this as a data query but failed to produce SQL."
-                return QueryResponse(response_type="error", sql_query="", explanation=explanation or error_msg, data=[{"error": error_msg}])
-
-            # Build a manager from saved connection details to execute SQL
-            st = (conn.get("source_type") or "").lower()
-            if st in ("postgresql", "mysql"):
-                raw = conn.get("db_details") or "{}"
-                details_obj = json.loads(raw) if isinstance(raw, str) else raw
-                ds = DataSource(source_type=st, db_details=DBDetails(**details_obj), file_path=None)
-            elif st in ("csv", "excel"):
-                ds = DataSource(source_type=st, db_details=None, file_path=conn.get("s3_uri"))
-            else:
-                raise RuntimeError(f"Unsupported source type: {st}")
+    return (*_finalize_answer(conn, *output), context)
 
-            manager = create_data_manager(ds)
-            data_result = manager.execute_query(sql_query)
 
-            return QueryResponse(
-                response_type="sql",
-                sql_query=sql_query,
-                explanation=explanation,
-                data=data_result
-            )
+async def _repair_sql(request: QueryRequest, context: Dict[str, Any], sql_query: str,
+                      error: Exception) -> tuple[str | None, str]:
+    """Ask the LLM to fix failed SQL, showing it the error and the schema of the tables involved."""
+    conn = context["conn"]
+    if context.get("db_schema") is None:
+        # Cached answers skipped schema selection; build it now
+        context["db_schema"] = await _build_schema_context(
+            request, conn, conn.get("schema_elements_flat") or [], bool(conn.get("is_large")), context["shash"])
+    schema_slice = slice_schema_prompt(context["db_schema"], referenced_tables(sql_query, conn.get("source_type")),
+                                       SQL_REPAIR_SCHEMA_TOKEN_BUDGET)
+    return await gemini_service.repair_sql(request.question, schema_slice, sql_query, error_text(error),
+                                           _dialect(conn))
+
+
+async def _next_repair(request: QueryRequest, context: Dict[str, Any], sql_query: str, error: Exception,
+                       deadline: float, attempts: list[Dict[str, Any]]) -> str | None:
+    """
+    Repair step shared by the execution paths, after a failed attempt was appended to `attempts`.
+    Returns the SQL to run next, or None when the failure is final: not fixable by a rewrite,
+    SQL_REPAIR_MAX_ATTEMPTS or the deadline used up, or no different SQL came back.
+    """
+    remaining = deadline - time.monotonic()
+    if len(attempts) > SQL_REPAIR_MAX_ATTEMPTS or remaining <= 0 or not repairable_error(error):
+        return None
+    started = time.perf_counter()
+    with span("sql.repair", attempt=len(attempts)) as attributes:
+        try:
+            fixed, fix = await asyncio.wait_for(_repair_sql(request, context, sql_query, error), timeout=remaining)
+        except asyncio.TimeoutError:
+            attributes["outcome"] = "timeout"
+            return None
+        attempts[-1].update(repair_ms=int((time.perf_counter() - started) * 1000), fix=fix)
+        if not fixed or fixed.strip() == sql_query.strip():
+            attributes["outcome"] = "unchanged"
+            return None
+        attributes["outcome"] = "rewritten"
+    return fixed
+
+
+def _record_repaired(attempts: list[Dict[str, Any]]) -> None:
+    """Time spent on a query that only succeeded after repairs (all attempts plus LLM repair calls)."""
+    if len(attempts) > 1:
+        ms = sum(a.get("ms", 0) + a.get("repair_ms", 0) for a in attempts)
+        record("sql.repaired", ms / 1000, attempts=len(attempts))
+
+
+async def _execute_with_repair(request: QueryRequest, context: Dict[str, Any], ds: DataSource, sql_query: str,
+                               attempts: list[Dict[str, Any]]) -> tuple[str, tuple[list[Dict[str, Any]], bool, int | None]]:
+    """
+    Execute SQL; when it fails with an error a rewrite could fix, send the error back to the LLM
+    and retry, at most SQL_REPAIR_MAX_ATTEMPTS times within SQL_REPAIR_DEADLINE seconds overall.
+    Appends {sql_query, ms, error?, repair_ms?, fix?} per attempt to `attempts`; returns
+    (executed sql, result). The last error is re-raised when no attempt succeeds.
+    """
+    deadline = time.monotonic() + SQL_REPAIR_DEADLINE
+    while True:
+        started = time.perf_counter()
+        try:
+            result = await run_blocking(_execute_sql, request.connection_id, ds, sql_query)
+        except Exception as e:
+            attempts.append({"sql_query": sql_query, "ms": int((time.perf_counter() - started) * 1000),
+                             "error": error_text(e)})
+            fixed = await _next_repair(request, context, sql_query, e, deadline, attempts)
+            if fixed is None:
+                raise
+            sql_query = fixed
+            continue
+        attempts.append({"sql_query": sql_query, "ms": int((time.perf_counter() - started) * 1000)})
+        return sql_query, result
 
+
+async def _shape_result(request: QueryRequest, response: QueryResponse, data_result: list[Dict[str, Any]]) -> None:
+    """
+    Result-shaping stage: chart series and column summary for large results (or on request);
+    beyond RESULT_PREVIEW_ROWS rows the full result is kept behind `result_handle`.
+    """
+    try:
+        with span("result.shape", rows=len(data_result)):
+            shaped = await run_blocking(shape_result, data_result, request.shape)
+        if shaped is None:
+            return
+        table, response.chart, response.summary = shaped
+        if len(data_result) > RESULT_PREVIEW_ROWS:
+            with span("result.store"):
+                response.result_handle = await run_blocking(result_store.save, table, request.user_id)
+    except Exception as e:
+        # Shaping is an extra; the plain rows still answer the question
+        print(f"Result shaping failed: {e}")
+
+
+async def process_query(request: QueryRequest) -> QueryResponse:
+    try:
+        response, ds, context = await prepare_query(request)
+        if ds is None:
+            return response
+
+        cached = result_cache.get(request.connection_id, response.sql_query)
+        if cached is not None:
+            data_result, truncated, total_count_hint = cached
+        else:
+            attempts: list[Dict[str, Any]] = []
+            try:
+                sql_query, (data_result, truncated, total_count_hint) = await _execute_with_repair(
+                    request, context, ds, response.sql_query, attempts
+                )
+            except Exception as e:
+                sql_error = _execution_error(e)
+                if sql_error is None:
+                    raise
+                print(f"SQL not executed ({sql_error.code}): {sql_error.message}")
+                failed = _sql_error_response(attempts[-1]["sql_query"] if attempts else response.sql_query, sql_error)
+                failed.attempts = attempts
+                return failed
+            _record_repaired(attempts)
+            response.attempts = attempts
+            if sql_query != response.sql_query or not context.get("cached"):
+                response.sql_query = sql_query
+                await _remember_answer(request, context["shash"], ("sql", sql_query, response.explanation))
+            result_cache.put(request.connection_id, response.sql_query, (data_result, truncated, total_count_hint))
+        await _shape_result(request, response, data_result)
+        response.data = data_result[:RESULT_PREVIEW_ROWS] if response.result_handle else data_result
+        response.truncated = truncated
+        response.total_count_hint = total_count_hint
+        return response
+
+    except Exception as e:
+        error_msg = f"An error occurred: {e}"
+        print(error_msg)
+        return _error_response(error_msg)
+
+
+async def stream_query_rows(request: QueryRequest) -> AsyncIterator[str]:
+    """
+    NDJSON stream for a question: one `meta` line (response_type/sql/explanation),
+    then one `rows` line per batch, then a `summary` line with the truncated flag and counts.
+    """
+    def line(obj: Dict[str, Any]) -> str:
+        return json.dumps(obj, default=json_default) + "\n"
+
+    try:
+        response, ds, context = await prepare_query(request)
+    except Exception as e:
+        error_msg = f"An error occurred: {e}"
+        print(error_msg)
+        yield line({"type": "error", "error": error_msg})
+        return
+
+    yield line({
+        "type": "meta",
+        "response_type": response.response_type,
+        "sql_query": response.sql_query,
+        "explanation": response.explanation,
+    })
+    if ds is None:
+        return
+
+    stats: Dict[str, Any] = {}
+    attempts: list[Dict[str, Any]] = []
+    sql_query = response.sql_query
+    deadline = time.monotonic() + SQL_REPAIR_DEADLINE
+    while True:
+        started = time.perf_counter()
+        sent_rows = False
+        try:
+            async for batch in iterate_blocking(_iter_sql, request.connection_id, ds, sql_query, stats):
+                sent_rows = True
+                yield line({"type": "rows", "rows": batch})
+            break
+        except Exception as e:
+            attempts.append({"sql_query": sql_query, "ms": int((time.perf_counter() - started) * 1000),
+                             "error": error_text(e)})
+            # Once rows went out the failure is final; before that, a repaired query can take over
+            fixed = None if sent_rows else await _next_repair(request, context, sql_query, e, deadline, attempts)
+            if fixed is not None:
+                yield line({"type": "repair", "sql_query": fixed, "error": attempts[-1]["error"],
+                            "fix": attempts[-1].get("fix")})
+                sql_query = fixed
+                continue
+            sql_error = _execution_error(e)
+            if sql_error is not None:
+                print(f"SQL not executed ({sql_error.code}): {sql_error.message}")
+                yield line({"type": "error", "error": sql_error.message, **sql_error.to_dict(), "attempts": attempts})
+                return
+            error_msg = f"An error occurred: {e}"
+            print(error_msg)
+            yield line({"type": "error", "error": error_msg, "attempts": attempts})
+            return
+
+    attempts.append({"sql_query": sql_query, "ms": int((time.perf_counter() - started) * 1000)})
+    _record_repaired(attempts)
+    if sql_query != response.sql_query or not context.get("cached"):
+        await _remember_answer(request, context["shash"], ("sql", sql_query, response.explanation))
+    yield line({
+        "type": "summary",
+        "row_count": stats.get("row_count", 0),
+        "truncated": stats.get("truncated", False),
+        "total_count_hint": None if stats.get("truncated") else stats.get("row_count", 0),
+        "attempts": attempts,
+    })
+
+
+async def _produce_rows(connection_id: str, ds: DataSource, sql_query: str, queue: asyncio.Queue,
+                        stats: Dict[str, Any]) -> None:
+    """Execute with the inline caps and hand batches to the event stream through `queue`."""
+    try:
+        async for batch in iterate_blocking(_iter_sql, connection_id, ds, sql_query, stats,
+                                            QUERY_MAX_ROWS, QUERY_MAX_BYTES):
+            await queue.put(("rows", batch))
+        await queue.put(("end", None))
+    except Exception as e:
+        await queue.put(("error", e))
+
+
+async def stream_query_events(request: QueryRequest) -> AsyncIterator[tuple[str, Dict[str, Any]]]:
+    """
+    Staged answer for Server-Sent Events, as (event, data) pairs:
+      stage        {stage: answer_cached | schema_selected | sql_generated | executing | repaired, ms}
+      sql          {sql_query} as soon as the SQL string is complete (again after a repair)
+      explanation  {delta} explanation text while the LLM is still generating
+      rows         {rows} result batches (inline caps: QUERY_MAX_ROWS / QUERY_MAX_BYTES)
+      done         final QueryResponse fields (with per-attempt timings and, for large results,
+                   chart / summary / result_handle) plus row_count and ms
+                   (always last unless `error`)
+      error        {error} failure, plus {code, message, attempts, ...} when SQL was refused, failed or timed
+                   out; the stream ends
+
+    SQL starts executing while the explanation is still streaming, so rows usually
+    follow the last explanation token immediately.
+    """
+    started = time.perf_counter()
+
+    def ms() -> int:
+        return int((time.perf_counter() - started) * 1000)
+
+    producer: asyncio.Task | None = None
+    producer_started = 0.0
+    early_sql: str | None = None
+    queue: asyncio.Queue = asyncio.Queue()
+    stats: Dict[str, Any] = {}
+    attempts: list[Dict[str, Any]] = []
+    try:
+        if not request.connection_id:
+            yield "done", {**_error_response("A connection_id must be provided in the request.").dict(), "ms": ms()}
+            return
+        conn = await _get_connection_row(request.connection_id, request.user_id)
+        schema_elements_flat: list[str] = conn.get("schema_elements_flat") or []
+        if not schema_elements_flat:
+            yield "done", {**_error_response("No cached schema found for the provided connection.").dict(), "ms": ms()}
+            return
+
+        shash = conn["schema_hash"]
+        context: Dict[str, Any] = {"conn": conn, "shash": shash, "db_schema": None, "cached": True}
+        output = await _cached_answer(request, shash)
+        if output is not None:
+            yield "stage", {"stage": "answer_cached", "ms": ms()}
+            if output[0] == "sql" and output[1]:
+                yield "sql", {"sql_query": output[1]}
+            yield "explanation", {"delta": output[2]}
+        else:
+            db_schema = await _build_schema_context(request, conn, schema_elements_flat,
+                                                   bool(conn.get("is_large")), shash)
+            context.update(db_schema=db_schema, cached=False)
+            yield "stage", {"stage": "schema_selected", "tables": db_schema.count("\n") + 1, "ms": ms()}
+
+            async for item in gemini_service.stream_intelligent_response(request.question, db_schema, _dialect(conn)):
+                if item["type"] == "sql":
+                    yield "stage", {"stage": "sql_generated", "ms": ms()}
+                    yield "sql", {"sql_query": item["sql_query"]}
+                    if result_cache.get(request.connection_id, item["sql_query"]) is None:
+                        # Start executing now; the explanation keeps streaming meanwhile
+                        early_sql = item["sql_query"]
+                        producer_started = time.perf_counter()
+                        producer = asyncio.create_task(_produce_rows(
+                            request.connection_id, _datasource_for(conn), early_sql, queue, stats))
+                elif item["type"] == "explanation":
+                    yield "explanation", {"delta": item["delta"]}
+                else:
+                    output = (item["response_type"], item["sql_query"], item["explanation"])
+            if output[0] != "sql":
+                # SQL answers are cached once they have executed successfully
+                await _remember_answer(request, shash, output)
+
+        response, ds = _finalize_answer(conn, *output)
+        if producer is not None and (ds is None or response.sql_query != early_sql):
+            # The final parse disagrees with what was streamed: drop the early execution
+            producer.cancel()
+            producer, queue, stats = None, asyncio.Queue(), {}
+        if ds is not None:
+            yield "stage", {"stage": "executing", "ms": ms()}
+            cached = result_cache.get(request.connection_id, response.sql_query)
+            if cached is not None:
+                data_result, truncated, total_count_hint = cached
+                yield "rows", {"rows": data_result}
+            else:
+                sql_query = response.sql_query
+                if producer is None:
+                    producer_started = time.perf_counter()
+                    producer = asyncio.create_task(
+                        _produce_rows(request.connection_id, ds, sql_query, queue, stats))
+                deadline = time.monotonic() + SQL_REPAIR_DEADLINE
+                batches: list[list[Dict[str, Any]]] = []
+                while True:
+                    kind, payload = await queue.get()
+                    if kind == "rows":
+                        batches.append(payload)
+                        yield "rows", {"rows": payload}
+                        continue
+                    attempt = {"sql_query": sql_query, "ms": int((time.perf_counter() - producer_started) * 1000)}
+                    if kind == "end":
+                        attempts.append(attempt)
+                        _record_repaired(attempts)
+                        break
+                    attempts.append({**attempt, "error": error_text(payload)})
+                    # Once rows went out the failure is final; before that, a repaired query can take over
+                    fixed = None if batches else await _next_repair(
+                        request, context, sql_query, payload, deadline, attempts)
+                    if fixed is None:
+                        raise payload
+                    yield "stage", {"stage": "repaired", "fix": attempts[-1].get("fix"), "ms": ms()}
+                    yield "sql", {"sql_query": fixed}
+                    sql_query, queue, stats = fixed, asyncio.Queue(), {}
+                    producer_started = time.perf_counter()
+                    producer = asyncio.create_task(_produce_rows(request.connection_id, ds, sql_query, queue, stats))
+                # Keeps DuckDB's Arrow batches for the shaping stage
+                data_result = collect_rows(batches)
+                truncated = bool(stats.get("truncated"))
+                total_count_hint = None if truncated else len(data_result)
+                response.attempts = attempts
+                if sql_query != response.sql_query or not context["cached"]:
+                    response.sql_query = sql_query
+                    await _remember_answer(request, shash, ("sql", sql_query, response.explanation))
+                result_cache.put(request.connection_id, response.sql_query, (data_result, truncated, total_count_hint))
+            await _shape_result(request, response, data_result)
+            response.data = []
+            response.truncated = truncated
+            response.total_count_hint = total_count_hint
+            yield "done", {**response.dict(), "row_count": len(data_result), "ms": ms()}
         else:
-            # Fallback for an unknown response type
-            error_msg = f"Received an unknown response type from the AI: {response_type}"
-            return QueryResponse(response_type="error", sql_query="", explanation=explanation or error_msg, data=[{"error": error_msg}])
+            yield "done", {**response.dict(), "row_count": 0, "ms": ms()}
 
     except Exception as e:
+        sql_error = _execution_error(e)
+        if sql_error is not None:
+            print(f"SQL not executed ({sql_error.code}): {sql_error.message}")
+            yield "error", {"error": sql_error.message, **sql_error.to_dict(), "attempts": attempts, "ms": ms()}
+            return
         error_msg = f"An error occurred: {e}"
         print(error_msg)
-        return QueryResponse(response_type="error", sql_query="", explanation=error_msg, data=[{"error": error_msg}])
+        yield "error", {"error": error_msg, "ms": ms()}
+    finally:
+        if producer is not None and not producer.done():
+            producer.cancel()
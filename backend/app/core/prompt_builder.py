@@ -0,0 +1,194 @@
+"""
+Compact, token-budgeted schema text for LLM prompts.
+
+One line per table, `schema.table(column type, ...)`, with abbreviated types and
+`-> table.column` after declared foreign keys. When
+relevance scores are given, columns are packed best-first until the token budget is
+spent; join keys of every included table are packed right after it so the model can
+still write joins.
+"""
+from __future__ import annotations
+
+import re
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+_WORD_RE = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate LLM token count without a model round trip: BPE/SentencePiece vocabularies
+    encode common words as one token and split long identifiers into ~4-character pieces;
+    digits go in groups of up to three and every punctuation mark is its own token.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for piece in _WORD_RE.findall(text):
+        if piece.isalpha():
+            tokens += 1 if len(piece) <= 6 else (len(piece) + 3) // 4
+        elif piece.isdigit():
+            tokens += (len(piece) + 2) // 3
+        else:
+            tokens += 1
+    return tokens
+
+
+def compact_type(type_name: Optional[str]) -> str:
+    """Short, dialect-neutral type label (`VARCHAR(255)` -> `str`, `TIMESTAMP WITH TIME ZONE` -> `ts`)."""
+    base = re.sub(r"\(.*", "", (type_name or "")).strip().lower()
+    if not base:
+        return ""
+    if base.endswith("[]") or base.startswith("array"):
+        return "list"
+    if base.startswith(("timestamp", "datetime")):
+        return "ts"
+    if base == "date":
+        return "date"
+    if base.startswith("time"):
+        return "time"
+    if base.startswith("interval"):
+        return "interval"
+    if base.startswith("bool") or base == "bit":
+        return "bool"
+    if "int" in base or base.endswith("serial"):
+        return "int"
+    if base.startswith(("numeric", "decimal", "double", "float", "real", "money", "number")):
+        return "num"
+    if base.startswith("json"):
+        return "json"
+    if base == "uuid":
+        return "uuid"
+    if "char" in base or base in ("text", "string", "clob", "tinytext", "mediumtext", "longtext", "enum", "set"):
+        return "str"
+    if "blob" in base or base in ("bytea", "binary", "varbinary"):
+        return "bytes"
+    return base.split()[0]
+
+
+def split_element(element: str) -> Tuple[str, str]:
+    """`schema.table.column` / `table.column` -> (table part, column)."""
+    table, _, column = element.rpartition(".")
+    return table, column
+
+
+def is_key_column(column: str) -> bool:
+    name = column.lower()
+    return name == "id" or name.endswith("_id")
+
+
+def column_types(schema_json: Any) -> Dict[str, str]:
+    """Flat element -> stored type, read from a connection's `schema_json` tree."""
+    types: Dict[str, str] = {}
+    for sch in schema_json or []:
+        schema_name = sch.get("schema_name")
+        for tbl in sch.get("tables") or []:
+            for col in tbl.get("columns") or []:
+                typ = col.get("type") if isinstance(col, dict) else None
+                if not typ:
+                    continue
+                name = col.get("name")
+                types[f"{schema_name}.{tbl.get('table_name')}.{name}"] = typ
+                if schema_name == "public":
+                    # File sources store "table.column" elements under the default schema
+                    types[f"{tbl.get('table_name')}.{name}"] = typ
+    return types
+
+
+def _entry(column: str, types: Dict[str, str], element: str, refs: Dict[str, str]) -> str:
+    typ = compact_type(types.get(element))
+    entry = f"{column} {typ}" if typ else column
+    ref = refs.get(element)
+    return f"{entry} -> {ref}" if ref else entry
+
+
+def build_schema_prompt(
+    elements: Sequence[str],
+    types: Optional[Dict[str, str]] = None,
+    scores: Optional[Dict[str, float]] = None,
+    budget: Optional[int] = None,
+    refs: Optional[Dict[str, str]] = None,
+) -> str:
+    """
+    Render schema elements as one `table(column type, ...)` line per table.
+
+    `scores` restricts the candidates to the scored elements and packs them in descending
+    score order; without it every element is a candidate, in the given order. Each candidate
+    is taken while its tokens (plus its table line, the first time) fit in `budget`.
+    Output keeps the original table and column order. `refs` maps foreign-key elements
+    to the `table.column` they reference.
+    """
+    types = types or {}
+    refs = refs or {}
+    tables: "OrderedDict[str, List[Tuple[str, str]]]" = OrderedDict()
+    for element in elements:
+        table, column = split_element(element)
+        if table:
+            tables.setdefault(table, []).append((column, element))
+
+    if scores is not None:
+        candidates: Iterable[str] = sorted(scores, key=lambda e: -scores[e])
+    else:
+        candidates = elements
+
+    selected: set = set()
+    opened: set = set()
+    used = 0
+
+    def take(element: str, table: str, column: str) -> bool:
+        nonlocal used
+        cost = count_tokens(_entry(column, types, element, refs)) + 1  # + separator
+        if table not in opened:
+            cost += count_tokens(f"{table}()") + 1  # + newline
+        if budget is not None and used + cost > budget:
+            return False
+        used += cost
+        selected.add(element)
+        opened.add(table)
+        return True
+
+    for element in candidates:
+        if element in selected:
+            continue
+        table, column = split_element(element)
+        if table not in tables:
+            continue
+        first_of_table = table not in opened
+        if not take(element, table, column):
+            continue
+        if first_of_table:
+            # Join keys travel with their table
+            for key_column, key_element in tables[table]:
+                if key_element not in selected and is_key_column(key_column):
+                    take(key_element, table, key_column)
+
+    lines = []
+    for table, columns in tables.items():
+        entries = [_entry(column, types, element, refs) for column, element in columns if element in selected]
+        if entries:
+            lines.append(f"{table}({', '.join(entries)})")
+    return "\n".join(lines)
+
+
+def slice_schema_prompt(schema_text: str, tables: Iterable[str], budget: int) -> str:
+    """
+    Cut a rendered schema down to `budget` tokens: lines of `tables` (matched by full or
+    unqualified, case-insensitive name) first, then the remaining lines in their order.
+    """
+    wanted = {t.lower() for t in tables}
+    lines = [line for line in schema_text.splitlines() if line.strip()]
+
+    def named(line: str) -> bool:
+        table = line.split("(", 1)[0].strip().lower()
+        return table in wanted or table.rpartition(".")[2] in wanted
+
+    kept = set()
+    used = 0
+    for i, line in sorted(enumerate(lines), key=lambda item: not named(item[1])):
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            continue
+        kept.add(i)
+        used += cost
+    return "\n".join(line for i, line in enumerate(lines) if i in kept)
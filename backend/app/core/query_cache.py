@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import (
+    LLM_CACHE_MAX_ENTRIES, LLM_CACHE_SEMANTIC, LLM_CACHE_SEMANTIC_THRESHOLD, LLM_CACHE_SEMANTIC_MAX_PER_CONNECTION,
+    RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL,
+)
+
+LLMOutput = Tuple[str, Optional[str], str]  # (response_type, sql_query, explanation)
+
+
+def normalize_question(question: str) -> str:
+    """Case/whitespace/trailing-punctuation insensitive form used as the exact-match key."""
+    q = re.sub(r"\s+", " ", (question or "").strip().lower())
+    return q.rstrip(" ?!.")
+
+
+class LLMResponseCache:
+    """
+    Two-tier cache for LLM outputs of a connection's schema version.
+
+    Tier 1: exact LRU keyed by (connection_id, schema_hash, normalized question).
+    Tier 2 (optional): near-duplicate lookup comparing the question embedding against
+    previously answered questions of the same connection/schema with a cosine threshold.
+    """
+
+    def __init__(self, max_entries: int, semantic: bool, threshold: float, semantic_max_per_connection: int):
+        self._max_entries = max_entries
+        self._semantic = semantic
+        self._threshold = threshold
+        self._semantic_max = semantic_max_per_connection
+        self._exact: "OrderedDict[Tuple[str, str, str], LLMOutput]" = OrderedDict()
+        # (connection_id, schema_hash) -> (embedding matrix, outputs aligned with rows)
+        self._vectors: Dict[Tuple[str, str], Tuple[np.ndarray, List[LLMOutput]]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self._semantic
+
+    def get(
+        self,
+        connection_id: str,
+        shash: str,
+        question: str,
+        embed: Callable[[str], np.ndarray] | None = None,
+    ) -> LLMOutput | None:
+        key = (str(connection_id), shash, normalize_question(question))
+        with self._lock:
+            value = self._exact.get(key)
+            if value is not None:
+                self._exact.move_to_end(key)
+                self.stats["exact_hits"] += 1
+                return value
+            entry = self._vectors.get(key[:2])
+
+        if self._semantic and embed is not None and entry is not None:
+            matrix, outputs = entry
+            scores = matrix @ embed(question)
+            best = int(np.argmax(scores))
+            if float(scores[best]) >= self._threshold:
+                with self._lock:
+                    self.stats["semantic_hits"] += 1
+                return outputs[best]
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(
+        self,
+        connection_id: str,
+        shash: str,
+        question: str,
+        value: LLMOutput,
+        embed: Callable[[str], np.ndarray] | None = None,
+    ) -> None:
+        key = (str(connection_id), shash, normalize_question(question))
+        vector = embed(question) if self._semantic and embed is not None else None
+        with self._lock:
+            self._exact[key] = value
+            self._exact.move_to_end(key)
+            while len(self._exact) > self._max_entries:
+                self._exact.popitem(last=False)
+
+            if vector is None:
+                return
+            matrix, outputs = self._vectors.get(key[:2], (np.empty((0, vector.shape[0]), dtype=np.float32), []))
+            matrix = np.vstack([matrix, vector[None, :]])[-self._semantic_max:]
+            outputs = (outputs + [value])[-self._semantic_max:]
+            self._vectors[key[:2]] = (matrix, outputs)
+
+    def invalidate(self, connection_id: str) -> None:
+        cid = str(connection_id)
+        with self._lock:
+            for key in [k for k in self._exact if k[0] == cid]:
+                self._exact.pop(key)
+            for key in [k for k in self._vectors if k[0] == cid]:
+                self._vectors.pop(key)
+
+
+class ResultCache:
+    """Short-lived cache of executed result data keyed by (connection_id, SQL text)."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, connection_id: str, sql_query: str) -> Any | None:
+        if self._ttl <= 0:
+            return None
+        key = (str(connection_id), sql_query.strip())
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[1]
+            if entry is not None:
+                self._entries.pop(key)
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, connection_id: str, sql_query: str, value: Any) -> None:
+        if self._ttl <= 0:
+            return
+        key = (str(connection_id), sql_query.strip())
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, connection_id: str) -> None:
+        cid = str(connection_id)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == cid]:
+                self._entries.pop(key)
+
+
+llm_cache = LLMResponseCache(
+    LLM_CACHE_MAX_ENTRIES, LLM_CACHE_SEMANTIC, LLM_CACHE_SEMANTIC_THRESHOLD, LLM_CACHE_SEMANTIC_MAX_PER_CONNECTION
+)
+result_cache = ResultCache(RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL)
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    return {"llm": dict(llm_cache.stats), "results": dict(result_cache.stats)}
+
+
+def invalidate_connection(connection_id: str) -> None:
+    llm_cache.invalidate(connection_id)
+    result_cache.invalidate(connection_id)
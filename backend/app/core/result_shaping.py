@@ -0,0 +1,232 @@
+"""
+Chart-sized views of large query results.
+
+Result rows are loaded once into an in-memory DuckDB database as an Arrow table (the
+result's own record batches for DuckDB sources, see `ArrowRows`) and reduced
+there: top-N categories with an "Other" bucket, time buckets, or Largest-Triangle-Three-Buckets
+downsampling of a line series, next to per-column statistics from `SUMMARIZE`.
+"""
+from __future__ import annotations
+
+from typing import Any, Dict, List, Optional, Tuple
+
+import duckdb
+import numpy as np
+import pyarrow as pa
+
+from app.core.config import RESULT_SHAPE_MAX_POINTS, RESULT_SHAPE_MIN_ROWS, RESULT_SHAPE_TOP_N
+from app.core.prompt_builder import is_key_column
+from app.schemas.query import ResultShape
+
+_AGGREGATES = {"sum": "sum({y})", "avg": "avg({y})", "min": "min({y})", "max": "max({y})", "count": "count(*)"}
+
+# Time bucket widths, narrowest first: (DuckDB interval, approximate seconds)
+_BUCKETS = (
+    ("1 second", 1), ("10 seconds", 10), ("1 minute", 60), ("5 minutes", 300), ("15 minutes", 900),
+    ("1 hour", 3600), ("6 hours", 21600), ("1 day", 86400), ("7 days", 604800),
+    ("1 month", 2629746), ("3 months", 7889238), ("1 year", 31556952),
+)
+
+_STAT_FIELDS = ("min", "max", "avg", "std", "q25", "q50", "q75")
+
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _column_kind(dtype: pa.DataType) -> str:
+    if pa.types.is_timestamp(dtype) or pa.types.is_date(dtype):
+        return "time"
+    if pa.types.is_integer(dtype) or pa.types.is_floating(dtype) or pa.types.is_decimal(dtype):
+        return "number"
+    if pa.types.is_string(dtype) or pa.types.is_large_string(dtype) or pa.types.is_boolean(dtype):
+        return "label"
+    return "other"
+
+
+def _axes(table: pa.Table, shape: ResultShape) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """(x column, y column, x kind): the requested columns, else the first time/label column and measure."""
+    kinds = {field.name: _column_kind(field.type) for field in table.schema}
+    x = shape.x if shape.x in kinds else None
+    if x is None:
+        x = next((c for c, k in kinds.items() if k == "time"), None) \
+            or next((c for c, k in kinds.items() if k == "label"), None)
+    y = shape.y if shape.y in kinds and kinds[shape.y] == "number" else None
+    if y is None:
+        y = next((c for c, k in kinds.items() if k == "number" and c != x and not is_key_column(c)), None)
+    return x, y, kinds.get(x) if x else None
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets: indices of `threshold` points (first and last included)
+    that keep the visual shape of the series `x` (ascending) / `y`.
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    every = (n - 2) / (threshold - 2)
+    picked = np.empty(threshold, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        # Area of the triangle (previous pick, candidate, average of the next bucket), doubled
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        picked[i + 1] = a
+    return picked
+
+
+def _number(value: Any) -> Any:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def _summary(con: duckdb.DuckDBPyConnection, kinds: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    """Per-column type, min/max, mean/std/quartiles (numbers), approx. distinct count and null share."""
+    cur = con.execute("SUMMARIZE result")
+    names = [d[0] for d in cur.description]
+    summary: Dict[str, Dict[str, Any]] = {}
+    for row in cur.fetchall():
+        stats = dict(zip(names, row))
+        column = stats.pop("column_name")
+        numeric = kinds.get(column) == "number"
+        summary[column] = {
+            "type": stats.get("column_type"),
+            "count": stats.get("count"),
+            "approx_unique": stats.get("approx_unique"),
+            "null_percentage": _number(stats.get("null_percentage")),
+            # SUMMARIZE renders statistics as text; numbers go back to numbers
+            **{f: (_number(stats.get(f)) if numeric else stats.get(f)) for f in _STAT_FIELDS if stats.get(f) is not None},
+        }
+    return summary
+
+
+def _aggregate(agg: str, y: Optional[str]) -> str:
+    if agg not in _AGGREGATES:
+        raise ValueError(f"Unsupported aggregate '{agg}'")
+    if y is None and agg != "count":
+        agg = "count"
+    return _AGGREGATES[agg].format(y=_ident(y) if y else "")
+
+
+def _top_n(con: duckdb.DuckDBPyConnection, x: str, y: Optional[str], agg: str, n: int) -> List[Dict[str, Any]]:
+    value = _aggregate(agg, y)
+    col = _ident(x)
+    rows = con.execute(f"""
+        WITH top AS (
+            SELECT {col} AS x, {value} AS y FROM result GROUP BY 1 ORDER BY 2 DESC NULLS LAST LIMIT {int(n)}
+        )
+        SELECT x, y, false AS other FROM top
+        UNION ALL
+        SELECT NULL, {value}, true FROM result
+        WHERE NOT EXISTS (SELECT 1 FROM top WHERE top.x IS NOT DISTINCT FROM result.{col})
+        HAVING count(*) > 0
+        ORDER BY other, y DESC NULLS LAST
+    """).fetchall()
+    return [{"x": "Other", "y": v, "other": True} if other else {"x": label, "y": v} for label, v, other in rows]
+
+
+def _bucket_width(con: duckdb.DuckDBPyConnection, x: str, is_date: bool, max_points: int) -> str:
+    """Narrowest bucket that spreads the time range over at most `max_points` buckets."""
+    col = _ident(x)
+    span = con.execute(f"SELECT epoch(max({col})) - epoch(min({col})) FROM result").fetchone()[0] or 0
+    for interval, seconds in _BUCKETS:
+        if is_date and seconds < 86400:
+            continue
+        if span / seconds <= max_points:
+            return interval
+    return _BUCKETS[-1][0]
+
+
+def _time_buckets(con: duckdb.DuckDBPyConnection, x: str, y: Optional[str], agg: str,
+                  bucket: str) -> List[Dict[str, Any]]:
+    col = _ident(x)
+    rows = con.execute(
+        f"SELECT time_bucket(CAST(? AS INTERVAL), {col}) AS x, {_aggregate(agg, y)} AS y "
+        f"FROM result WHERE {col} IS NOT NULL GROUP BY 1 ORDER BY 1",
+        [bucket],
+    ).fetchall()
+    return [{"x": bx, "y": by} for bx, by in rows]
+
+
+def _lttb(con: duckdb.DuckDBPyConnection, x: str, y: str, x_kind: str, max_points: int) -> List[Dict[str, Any]]:
+    xc, yc = _ident(x), _ident(y)
+    position = f"epoch({xc})" if x_kind == "time" else xc
+    series = con.execute(
+        f"SELECT {xc} AS x, {yc} AS y, CAST({position} AS DOUBLE) AS t, CAST({yc} AS DOUBLE) AS v "
+        f"FROM result WHERE {xc} IS NOT NULL AND {yc} IS NOT NULL ORDER BY {xc}"
+    ).fetch_arrow_table()
+    picked = lttb_indices(series["t"].to_numpy(), series["v"].to_numpy(), max_points)
+    return series.take(pa.array(picked)).select(["x", "y"]).to_pylist()
+
+
+def _auto_mode(con: duckdb.DuckDBPyConnection, x: Optional[str], y: Optional[str], x_kind: Optional[str],
+               row_count: int, max_points: int, top_n: int) -> str:
+    if x is None or y is None:
+        return "summary"
+    distinct = con.execute(f"SELECT count(DISTINCT {_ident(x)}) FROM result").fetchone()[0]
+    if x_kind == "time":
+        if distinct == row_count and row_count > max_points:
+            return "lttb"          # one point per timestamp: a line to thin out
+        if distinct > max_points:
+            return "time_bucket"   # several rows per timestamp: aggregate
+    elif x_kind == "label" and distinct > top_n:
+        return "top_n"
+    return "summary"
+
+
+def shape_result(
+    rows: List[Dict[str, Any]], shape: Optional[ResultShape] = None
+) -> Optional[Tuple[pa.Table, Optional[Dict[str, Any]], Dict[str, Dict[str, Any]]]]:
+    """
+    Shaping stage after execution. Returns (rows as an Arrow table, chart or None, column
+    summary), or None when the result is left as is: mode `none`, or `auto` below
+    RESULT_SHAPE_MIN_ROWS rows, or rows Arrow cannot type consistently. Rows that carry
+    their Arrow data (ArrowRows) are used as is; others are converted from the row dicts.
+    """
+    shape = shape or ResultShape()
+    if shape.mode == "none" or not rows:
+        return None
+    if shape.mode == "auto" and (RESULT_SHAPE_MIN_ROWS <= 0 or len(rows) < RESULT_SHAPE_MIN_ROWS):
+        return None
+    arrow = getattr(rows, "arrow", None)
+    try:
+        table = pa.Table.from_batches([arrow]) if isinstance(arrow, pa.RecordBatch) \
+            else arrow if arrow is not None else pa.Table.from_pylist(rows)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        print(f"Result shaping skipped (mixed column types): {e}")
+        return None
+
+    max_points = shape.max_points or RESULT_SHAPE_MAX_POINTS
+    top_n = shape.top_n or RESULT_SHAPE_TOP_N
+    kinds = {field.name: _column_kind(field.type) for field in table.schema}
+    con = duckdb.connect(database=":memory:")
+    try:
+        con.register("result", table)
+        summary = _summary(con, kinds)
+        x, y, x_kind = _axes(table, shape)
+        mode = shape.mode
+        if mode == "auto":
+            mode = _auto_mode(con, x, y, x_kind, table.num_rows, max_points, top_n)
+
+        chart: Dict[str, Any] = {"kind": mode, "x": x, "y": y, "source_rows": table.num_rows}
+        if mode == "top_n" and x is not None:
+            chart.update(agg=shape.agg, points=_top_n(con, x, y, shape.agg, top_n))
+        elif mode == "time_bucket" and x_kind == "time":
+            bucket = shape.bucket or _bucket_width(con, x, pa.types.is_date(table.schema.field(x).type), max_points)
+            chart.update(agg=shape.agg, bucket=bucket, points=_time_buckets(con, x, y, shape.agg, bucket))
+        elif mode == "lttb" and y is not None and x_kind in ("time", "number"):
+            chart.update(points=_lttb(con, x, y, x_kind, max_points))
+        else:
+            chart = None
+        return table, chart, summary
+    finally:
+        con.close()
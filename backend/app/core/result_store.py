@@ -0,0 +1,107 @@
+"""
+Short-lived server-side copies of shaped query results, addressed by an opaque handle.
+
+Shaped responses only carry a preview of their rows; the full rows are written once as a
+zstd-compressed Parquet file under RESULT_HANDLE_DIR and served in pages until
+RESULT_HANDLE_TTL expires. Files are written in small row groups so a page only decodes the
+row groups it overlaps.
+"""
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from app.core.config import RESULT_HANDLE_DIR, RESULT_HANDLE_TTL
+
+_HANDLE_RE = re.compile(r"[0-9a-f]{32}")
+_OWNER_KEY = b"querai.owner"
+# Rows per Parquet row group (the unit a page read decodes)
+_ROW_GROUP_ROWS = 10_000
+
+
+class ResultStore:
+    """Parquet files named by random handles; the owner (user id) is kept in the file metadata."""
+
+    def __init__(self, directory: str, ttl: float):
+        self._dir = directory
+        self._ttl = ttl
+        self._last_prune = 0.0
+        self._lock = threading.Lock()
+
+    def _path(self, handle: str) -> Optional[str]:
+        if not _HANDLE_RE.fullmatch(handle or ""):
+            return None
+        return os.path.join(self._dir, f"{handle}.parquet")
+
+    def _prune(self) -> None:
+        """Drop expired files, at most every tenth of the TTL."""
+        now = time.time()
+        with self._lock:
+            if now - self._last_prune < self._ttl / 10:
+                return
+            self._last_prune = now
+        for name in os.listdir(self._dir):
+            path = os.path.join(self._dir, name)
+            try:
+                if os.path.getmtime(path) < now - self._ttl:
+                    os.remove(path)
+            except OSError:
+                pass  # removed concurrently
+
+    def save(self, table: pa.Table, owner: Optional[str] = None) -> str:
+        os.makedirs(self._dir, exist_ok=True)
+        self._prune()
+        handle = uuid.uuid4().hex
+        path = self._path(handle)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), _OWNER_KEY: (owner or "").encode()})
+        tmp = f"{path}.tmp"
+        pq.write_table(table, tmp, compression="zstd", row_group_size=_ROW_GROUP_ROWS)
+        os.replace(tmp, path)
+        return handle
+
+    def _open(self, handle: str, owner: Optional[str]) -> Optional[pq.ParquetFile]:
+        path = self._path(handle)
+        if path is None:
+            return None
+        try:
+            if os.path.getmtime(path) < time.time() - self._ttl:
+                return None
+            parquet = pq.ParquetFile(path)
+        except OSError:
+            return None
+        stored_owner = (parquet.schema_arrow.metadata or {}).get(_OWNER_KEY, b"").decode()
+        if stored_owner and stored_owner != (owner or ""):
+            return None
+        return parquet
+
+    def page(self, handle: str, owner: Optional[str], offset: int, limit: int) -> Optional[Dict[str, Any]]:
+        """{rows, row_count, offset} for one page; None when the handle is unknown, expired or not the owner's."""
+        parquet = self._open(handle, owner)
+        if parquet is None:
+            return None
+        metadata = parquet.metadata
+        groups: List[int] = []
+        first_row = start = 0
+        for i in range(metadata.num_row_groups):
+            end = start + metadata.row_group(i).num_rows
+            if end > offset and start < offset + limit:
+                if not groups:
+                    first_row = start
+                groups.append(i)
+            start = end
+        rows = parquet.read_row_groups(groups).slice(offset - first_row, limit).to_pylist() if groups else []
+        return {"rows": rows, "row_count": metadata.num_rows, "offset": offset}
+
+    def rows(self, handle: str, owner: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        parquet = self._open(handle, owner)
+        return parquet.read().to_pylist() if parquet is not None else None
+
+
+result_store = ResultStore(RESULT_HANDLE_DIR, RESULT_HANDLE_TTL)
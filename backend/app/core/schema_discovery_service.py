@@ -1,8 +1,16 @@
 from __future__ import annotations
 
-from typing import List, Dict, Any
+import json
+from typing import List, Dict, Any, Optional
 
+from app.core.config import PROMPT_SCHEMA_TOKEN_BUDGET
 from app.core.data_manager_factory import create_data_manager
+from app.core.file_cache import source_version
+from app.core.fingerprint import diff_table_hashes, schema_hash, table_hashes
+from app.core.prompt_builder import build_schema_prompt, column_types, count_tokens
+from app.core.schema_index import SchemaIndex
+from app.core.schema_pack import pack_schema
+from app.core.semantic_search import choose_index_strategy
 from app.schemas.query import DataSource
 
 
@@ -12,7 +20,10 @@ class SchemaDiscoveryService:
     and produces processed artifacts ready to persist in Supabase:
       - schema_json: structured JSON for UX tree rendering
       - schema_elements_flat: the original flat list of schema elements
-      - is_large: boolean flag based on rough token count of the full schema text
+      - schema_pack: the flat list and column types in a compact binary form (read by the query path)
+      - schema_index: table -> columns lookups (key/name flags, row estimates, foreign-key join graph)
+      - is_large: True when the full schema prompt exceeds PROMPT_SCHEMA_TOKEN_BUDGET tokens
+      - schema_hash / table_hashes / source_version: change markers for incremental refresh
     """
 
     def _format_schema_for_ux(self, elements: List[str], typed: List[Dict[str, str]] | None = None) -> List[Dict[str, Any]]:
@@ -91,60 +102,201 @@ class SchemaDiscoveryService:
 
         return result
 
-    def _format_schema_for_llm(self, elements: List[str]) -> str:
-        """
-        Convert a flat list into a compact, human-readable schema text for LLM prompting.
-        Matches the style used elsewhere in the codebase.
-        """
-        from collections import defaultdict
+    def _format_schema_for_llm(self, elements: List[str], index: SchemaIndex) -> str:
+        """Full schema in the compact, typed prompt format used at query time (see prompt_builder)."""
+        return build_schema_prompt(elements, index.types, refs=index.refs)
 
-        tables = defaultdict(list)
-        for el in elements:
-            parts = el.split(".")
-            if len(parts) < 2:
-                continue
-            column = parts[-1]
-            table = ".".join(parts[:-1])
-            tables[table].append(column)
+    def _build_artifacts(
+        self,
+        schema_elements_flat: List[str],
+        typed_rows: List[Dict[str, str]],
+        hashes: Dict[str, str],
+        version: Optional[str],
+        relations: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        # Build UX JSON (use types if available)
+        schema_json = self._format_schema_for_ux(schema_elements_flat, typed_rows)
+        # Table/column lookups and join graph for query-time expansion, stored with the connection
+        index = SchemaIndex.from_schema(schema_elements_flat, schema_json, relations)
+
+        # Large = the full prompt-formatted schema does not fit the schema token budget
+        full_schema_text = self._format_schema_for_llm(schema_elements_flat, index)
+        token_count = count_tokens(full_schema_text)
+        is_large = token_count > PROMPT_SCHEMA_TOKEN_BUDGET
 
-        lines: List[str] = []
-        for table, cols in tables.items():
-            lines.append(f"Table {table} has columns: {', '.join(cols)}")
-        return "\n".join(lines).strip()
+        return {
+            "schema_json": schema_json,
+            "schema_elements_flat": schema_elements_flat,
+            "schema_index": index.to_dict(),
+            # Compact binary copy of the flat list + types the query path reads instead
+            "schema_pack": pack_schema(schema_elements_flat, column_types(schema_json)),
+            "is_large": is_large,
+            # Vector index type used for semantic focusing (None when the full schema fits the prompt)
+            "index_strategy": choose_index_strategy(len(schema_elements_flat)) if is_large else None,
+            # Change markers compared by the next refresh
+            "schema_hash": schema_hash(schema_elements_flat),
+            "table_hashes": hashes,
+            "source_version": version,
+        }
 
-    def _count_tokens(self, text: str) -> int:
-        """Rough token counter using whitespace split for now."""
-        return len(text.split()) if text else 0
+    def _source_version(self, source: DataSource) -> Optional[str]:
+        if not source.file_path:
+            return None
+        try:
+            return source_version(source.file_path)
+        except Exception as e:
+            print(f"Could not read source version for {source.file_path}: {e}")
+            return None
 
     def discover_and_process_schema(self, source: DataSource) -> Dict[str, Any]:
         """
         Connect to the data source, fetch flat schema, and produce artifacts.
 
-        Returns a dict with keys: schema_json, schema_elements_flat, is_large.
+        Returns a dict with keys: schema_json, schema_elements_flat, schema_index, is_large, index_strategy,
+        schema_hash, table_hashes, source_version.
         """
+        version = self._source_version(source)
         # Build manager from provided DataSource
         manager = create_data_manager(source)
 
-        # 1) Discover flat schema list
-        schema_elements_flat = manager.get_schema_elements()
-
-        # Attempt to get typed columns (optional per manager)
-        typed_rows = []
         try:
-            typed_rows = manager.get_schema_columns_with_types() or []
-        except Exception:
-            typed_rows = []
+            # Discover flat schema list and typed columns in a single crawl
+            schema_elements_flat, typed_rows = manager.discover_schema()
+            typed_rows = typed_rows or []
+            hashes = manager.table_fingerprints() or table_hashes(typed_rows)
+            relations = manager.discover_relations()
+        finally:
+            # Discovery uses a one-off manager; pooled query managers live in the registry
+            manager.close()
 
-        # 2) Build UX JSON (use types if available)
-        schema_json = self._format_schema_for_ux(schema_elements_flat, typed_rows)
+        return self._build_artifacts(schema_elements_flat, typed_rows, hashes, version, relations)
 
-        # 3) Build full schema text for token counting
-        full_schema_text = self._format_schema_for_llm(schema_elements_flat)
-        token_count = self._count_tokens(full_schema_text)
-        is_large = token_count > 3000
+    def _stored_typed_rows(self, current: Dict[str, Any]) -> List[Dict[str, str]]:
+        """Rebuild ordered typed rows of a DB connection from its stored artifacts."""
+        schema_json = current.get("schema_json") or []
+        if isinstance(schema_json, str):
+            schema_json = json.loads(schema_json)
+        types: Dict[tuple, str] = {}
+        for sch in schema_json:
+            for tbl in sch.get("tables") or []:
+                for col in tbl.get("columns") or []:
+                    types[(sch.get("schema_name"), tbl.get("table_name"), col.get("name"))] = col.get("type") or ""
 
-        return {
-            "schema_json": schema_json,
-            "schema_elements_flat": schema_elements_flat,
-            "is_large": is_large,
-        }
+        rows: List[Dict[str, str]] = []
+        for el in current.get("schema_elements_flat") or []:
+            parts = el.split(".")
+            if len(parts) < 3:
+                continue
+            schema_name, table_name, column = parts[0], ".".join(parts[1:-1]), parts[-1]
+            rows.append({
+                "schema": schema_name,
+                "table": table_name,
+                "column": column,
+                "type": types.get((schema_name, table_name, column), ""),
+            })
+        return rows
+
+    def _merge_tables(
+        self,
+        stored: List[Dict[str, str]],
+        fresh: List[Dict[str, str]],
+        removed: set,
+    ) -> List[Dict[str, str]]:
+        """Replace changed tables in place, drop removed ones and append new ones."""
+        fresh_by_table: Dict[str, List[Dict[str, str]]] = {}
+        for row in fresh:
+            fresh_by_table.setdefault(f"{row['schema']}.{row['table']}", []).append(row)
+
+        merged: List[Dict[str, str]] = []
+        emitted = set()
+        for row in stored:
+            key = f"{row['schema']}.{row['table']}"
+            if key in removed:
+                continue
+            if key in fresh_by_table:
+                if key not in emitted:
+                    merged.extend(fresh_by_table[key])
+                    emitted.add(key)
+                continue
+            merged.append(row)
+        for key, rows in fresh_by_table.items():
+            if key not in emitted:
+                merged.extend(rows)
+        return merged
+
+    def _keys_changed(self, current: Dict[str, Any], relations: Optional[Dict[str, Any]]) -> bool:
+        """
+        Whether `relations` give the stored columns different key flags or join edges than the
+        stored `schema_index` (row estimates drift constantly and are ignored).
+        """
+        stored = current.get("schema_index")
+        if isinstance(stored, str):
+            stored = json.loads(stored)
+        stored_index = SchemaIndex.from_dict(stored)
+        if stored_index is None:
+            return True
+        schema_json = current.get("schema_json") or []
+        if isinstance(schema_json, str):
+            schema_json = json.loads(schema_json)
+        fresh_index = SchemaIndex.from_schema(current.get("schema_elements_flat") or [], schema_json, relations)
+
+        def layout(index: SchemaIndex) -> tuple:
+            data = index.to_dict()
+            return [[table, columns] for table, columns, _ in data["tables"]], data["edges"]
+
+        return layout(fresh_index) != layout(stored_index)
+
+    def refresh_schema(self, source: DataSource, current: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Incremental re-discovery against the stored connection row `current`.
+
+        File sources are skipped outright when their version (ETag/size+mtime) is unchanged.
+        Databases compare catalog fingerprints per table plus their primary/foreign keys and
+        only re-read changed/new tables; sources without fingerprints fall back to a full crawl
+        compared by hash.
+
+        Returns the artifacts of `discover_and_process_schema` plus:
+          - changed: anything to persist (False means skip the write entirely)
+          - schema_changed: stored schema artifacts/index need updating
+          - diff: {"added": [...], "removed": [...], "changed": [...]} table names
+        """
+        unchanged = {"changed": False, "schema_changed": False, "diff": {"added": [], "removed": [], "changed": []}}
+
+        version = self._source_version(source)
+        if version is not None and version == current.get("source_version"):
+            return unchanged
+
+        stored_hashes = current.get("table_hashes") or {}
+        if isinstance(stored_hashes, str):
+            stored_hashes = json.loads(stored_hashes)
+
+        manager = create_data_manager(source)
+        try:
+            fingerprints = manager.table_fingerprints()
+            # Keys are a couple of catalog queries, so they are always re-read in full. Column
+            # fingerprints do not cover them, so an added/dropped FK alone still counts as a change.
+            relations = manager.discover_relations()
+            keys_changed = self._keys_changed(current, relations)
+            if fingerprints is not None and stored_hashes:
+                diff = diff_table_hashes(stored_hashes, fingerprints)
+                if not any(diff.values()) and not keys_changed:
+                    return unchanged
+                fresh = manager.discover_tables(diff["added"] + diff["changed"])
+                typed_rows = self._merge_tables(self._stored_typed_rows(current), fresh, set(diff["removed"]))
+                schema_elements_flat = [f"{d['schema']}.{d['table']}.{d['column']}" for d in typed_rows]
+                hashes = fingerprints
+            else:
+                schema_elements_flat, typed_rows = manager.discover_schema()
+                typed_rows = typed_rows or []
+                hashes = fingerprints or table_hashes(typed_rows)
+                diff = diff_table_hashes(stored_hashes, hashes)
+        finally:
+            manager.close()
+
+        artifacts = self._build_artifacts(schema_elements_flat, typed_rows, hashes, version, relations)
+        stored_hash = current.get("schema_hash") or schema_hash(current.get("schema_elements_flat") or [])
+        schema_changed = artifacts["schema_hash"] != stored_hash or any(diff.values()) or keys_changed
+        artifacts["schema_changed"] = schema_changed
+        artifacts["changed"] = schema_changed or version != current.get("source_version")
+        artifacts["diff"] = diff
+        return artifacts
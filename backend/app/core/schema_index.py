@@ -0,0 +1,285 @@
+"""
+Precomputed lookup structures over a connection's flat schema.
+
+Built once at discovery time and stored with the connection (`schema_index`), so the
+query path can expand semantic hits per matched table instead of scanning and splitting
+every schema element on each request.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.core.config import SCHEMA_INDEX_CACHE_MAX_ENTRIES
+from app.core.prompt_builder import column_types, compact_type, is_key_column, split_element
+
+SCHEMA_INDEX_VERSION = 2
+
+KEY = 1
+NAME = 2
+PRIMARY = 4
+
+_NAME_KEYWORDS = ("name", "title", "label", "isim", "ad")
+
+# (table, columns, referenced table, referenced columns)
+Edge = Tuple[str, Tuple[str, ...], str, Tuple[str, ...]]
+
+
+def _column_flags(column: str) -> int:
+    name = column.lower()
+    flags = KEY if is_key_column(name) else 0
+    if any(keyword in name for keyword in _NAME_KEYWORDS):
+        flags |= NAME
+    return flags
+
+
+def _reference_targets(column: str) -> Tuple[str, ...]:
+    """Table names a `<stem>_id` column conventionally points at (`customer_id` -> customer(s))."""
+    name = column.lower()
+    if not name.endswith("_id") or len(name) <= 3:
+        return ()
+    stem = name[:-3]
+    targets = [stem, f"{stem}s", f"{stem}es"]
+    if stem.endswith("y"):
+        targets.append(f"{stem[:-1]}ies")
+    return tuple(targets)
+
+
+def _inferred_edges(tables: "OrderedDict[str, List[Tuple[str, str, int]]]") -> List[Tuple[Edge, bool]]:
+    """Join edges by naming convention: `<stem>_id` -> table `<stem>`/`<stem>s`, same schema first."""
+    by_name: Dict[str, List[str]] = {}
+    for table in tables:
+        by_name.setdefault(split_element(table)[1].lower(), []).append(table)
+    edges: List[Tuple[Edge, bool]] = []
+    for table, columns in tables.items():
+        schema = split_element(table)[0]
+        for column, _, flags in columns:
+            if not flags & KEY:
+                continue
+            for target in _reference_targets(column):
+                candidates = [t for t in by_name.get(target, []) if t != table]
+                if not candidates:
+                    continue
+                same_schema = [t for t in candidates if split_element(t)[0] == schema]
+                ref = (same_schema or candidates)[0]
+                ref_columns = ("id",) if any(c == "id" for c, _, _ in tables[ref]) else ()
+                edges.append(((table, (column,), ref, ref_columns), False))
+                break
+    return edges
+
+
+class SchemaIndex:
+    """
+    Table -> columns map with compact types, id/name/primary-key column flags, row estimates
+    and a join graph between tables. Edges are the source's declared foreign keys, or inferred
+    from `<name>_id` columns when it declares none. Tables keep their discovery order,
+    columns their table order.
+    """
+
+    def __init__(
+        self,
+        tables: Sequence[Tuple[str, Sequence[Tuple[str, str, int]], Optional[int]]],
+        edges: Iterable[Tuple[Edge, bool]],
+    ):
+        self._columns: "OrderedDict[str, List[Tuple[str, str, int]]]" = OrderedDict()
+        self._rows: Dict[str, Optional[int]] = {}
+        self.types: Dict[str, str] = {}
+        for table, columns, rows in tables:
+            cols = [(column, typ, flags) for column, typ, flags in columns]
+            self._columns[table] = cols
+            self._rows[table] = rows
+            for column, typ, _ in cols:
+                if typ:
+                    self.types[f"{table}.{column}"] = typ
+        self._position = {table: i for i, table in enumerate(self._columns)}
+
+        self._edges: List[Tuple[Edge, bool]] = []
+        self._adjacent: Dict[str, List[Edge]] = {}
+        # Declared foreign-key columns render as `column type -> table.column` in prompts
+        self.refs: Dict[str, str] = {}
+        for (a, cols, b, ref_cols), declared in edges:
+            if a not in self._columns or b not in self._columns or a == b:
+                continue
+            edge = (a, tuple(cols), b, tuple(ref_cols))
+            self._edges.append((edge, declared))
+            self._adjacent.setdefault(a, []).append(edge)
+            self._adjacent.setdefault(b, []).append(edge)
+            if declared and len(cols) == len(ref_cols):
+                for col, ref_col in zip(cols, ref_cols):
+                    self.refs[f"{a}.{col}"] = f"{b}.{ref_col}"
+
+    @classmethod
+    def build(
+        cls,
+        elements: Sequence[str],
+        types: Optional[Dict[str, str]] = None,
+        relations: Optional[Dict[str, Any]] = None,
+    ) -> "SchemaIndex":
+        """
+        Index flat elements (`schema.table.column` / `table.column`) with their stored types
+        and, when the source provides them, keys and row estimates (`discover_relations`).
+        """
+        types = types or {}
+        relations = relations or {}
+        primary_keys = relations.get("primary_keys") or {}
+        foreign_keys = relations.get("foreign_keys") or []
+        fk_columns = {f"{fk['table']}.{col}" for fk in foreign_keys for col in fk.get("columns") or []}
+
+        tables: "OrderedDict[str, List[Tuple[str, str, int]]]" = OrderedDict()
+        for element in elements:
+            table, column = split_element(element)
+            if not table:
+                continue
+            flags = _column_flags(column)
+            if column in primary_keys.get(table, ()):
+                flags |= PRIMARY | KEY
+            if element in fk_columns:
+                flags |= KEY
+            tables.setdefault(table, []).append((column, compact_type(types.get(element)), flags))
+
+        if foreign_keys:
+            edges = [((fk["table"], tuple(fk.get("columns") or ()), fk["ref_table"], tuple(fk.get("ref_columns") or ())),
+                      True) for fk in foreign_keys]
+        else:
+            edges = _inferred_edges(tables)
+        row_estimates = relations.get("row_estimates") or {}
+        return cls([(table, columns, row_estimates.get(table)) for table, columns in tables.items()], edges)
+
+    @classmethod
+    def from_schema(cls, elements: Sequence[str], schema_json: Any,
+                    relations: Optional[Dict[str, Any]] = None) -> "SchemaIndex":
+        return cls.build(elements, column_types(schema_json), relations)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON form stored on the connection row (lists, since jsonb does not keep key order)."""
+        return {
+            "v": SCHEMA_INDEX_VERSION,
+            "tables": [[table, [list(c) for c in columns], self._rows.get(table)]
+                       for table, columns in self._columns.items()],
+            "edges": [[a, list(cols), b, list(ref_cols), int(declared)]
+                      for (a, cols, b, ref_cols), declared in self._edges],
+        }
+
+    @classmethod
+    def from_dict(cls, data: Any) -> Optional["SchemaIndex"]:
+        """Rebuild from `to_dict` output; None for missing or outdated payloads."""
+        if not isinstance(data, dict) or data.get("v") != SCHEMA_INDEX_VERSION:
+            return None
+        tables = [(table, [tuple(c) for c in columns], rows) for table, columns, rows in data.get("tables") or []]
+        edges = [((a, tuple(cols), b, tuple(ref_cols)), bool(declared))
+                 for a, cols, b, ref_cols, declared in data.get("edges") or []]
+        return cls(tables, edges)
+
+    def table_of(self, element: str) -> str:
+        return split_element(element)[0]
+
+    def row_estimate(self, table: str) -> Optional[int]:
+        return self._rows.get(table)
+
+    def elements(self, tables: Iterable[str]) -> List[str]:
+        """Elements of the given tables in schema order (tables by discovery order)."""
+        ordered = sorted((t for t in set(tables) if t in self._columns), key=self._position.__getitem__)
+        return [f"{table}.{column}" for table in ordered for column, _, _ in self._columns[table]]
+
+    def identifier_elements(self, table: str, flags: int = KEY | NAME) -> List[str]:
+        """Key and/or name-like columns of a table (join keys and human-readable labels)."""
+        return [f"{table}.{column}" for column, _, f in self._columns.get(table, ()) if f & flags]
+
+    def neighbors(self, table: str) -> List[str]:
+        """Directly joinable tables, smallest first (lookup/dimension tables before fact tables)."""
+        adjacent = {b if a == table else a for a, _, b, _ in self._adjacent.get(table, ())}
+        unknown = float("inf")
+        return sorted(adjacent, key=lambda t: (self._rows.get(t) if self._rows.get(t) is not None else unknown,
+                                               self._position[t]))
+
+    def join_paths(self, tables: Sequence[str], max_hops: int) -> List[Tuple[str, str, List[Edge]]]:
+        """
+        Shortest join path (at most `max_hops` edges) between each pair of `tables`, as
+        (from table, to table, edges). Breadth-first over the join graph, one search per table.
+        """
+        wanted = [t for t in dict.fromkeys(tables) if t in self._adjacent]
+        paths: List[Tuple[str, str, List[Edge]]] = []
+        for i, source in enumerate(wanted):
+            targets = set(wanted[i + 1:])
+            if not targets:
+                break
+            parent: Dict[str, Tuple[str, Edge] | None] = {source: None}
+            frontier = [source]
+            for _ in range(max_hops):
+                next_frontier = []
+                for table in frontier:
+                    for edge in self._adjacent.get(table, ()):
+                        other = edge[2] if edge[0] == table else edge[0]
+                        if other not in parent:
+                            parent[other] = (table, edge)
+                            next_frontier.append(other)
+                frontier = next_frontier
+                if not frontier or targets.issubset(parent):
+                    break
+            for target in wanted[i + 1:]:
+                if target not in parent:
+                    continue
+                edges: List[Edge] = []
+                node = target
+                while parent[node] is not None:
+                    node, edge = parent[node]
+                    edges.append(edge)
+                paths.append((source, target, edges[::-1]))
+        return paths
+
+
+class _SchemaIndexMemo:
+    """Small LRU of parsed indexes keyed by (connection_id, schema_hash)."""
+
+    def __init__(self, max_entries: int):
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], SchemaIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> SchemaIndex | None:
+        with self._lock:
+            index = self._entries.get(key)
+            if index is not None:
+                self._entries.move_to_end(key)
+            return index
+
+    def put(self, key: Tuple[str, str], index: SchemaIndex) -> None:
+        with self._lock:
+            self._entries[key] = index
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, connection_id: str) -> None:
+        cid = str(connection_id)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == cid]:
+                self._entries.pop(key)
+
+
+_memo = _SchemaIndexMemo(SCHEMA_INDEX_CACHE_MAX_ENTRIES)
+
+
+def get_schema_index(connection_id: str, shash: str, conn: Dict[str, Any]) -> SchemaIndex:
+    """
+    Index for a connection's current schema: in-memory hit, else the stored `schema_index`,
+    else built from `schema_elements_flat` with the types of the decoded `schema_pack` or
+    `schema_json` (rows saved before the current index format).
+    """
+    key = (str(connection_id), shash)
+    index = _memo.get(key)
+    if index is not None:
+        return index
+    index = SchemaIndex.from_dict(conn.get("schema_index"))
+    if index is None:
+        # Without stored relations the join graph falls back to `<name>_id` inference
+        pack = conn.get("schema_pack")
+        types = pack.types() if pack is not None else column_types(conn.get("schema_json"))
+        index = SchemaIndex.build(conn.get("schema_elements_flat") or [], types)
+    _memo.put(key, index)
+    return index
+
+
+def invalidate_schema_index(connection_id: str) -> None:
+    _memo.invalidate(connection_id)
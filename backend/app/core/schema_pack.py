@@ -0,0 +1,143 @@
+"""
+Compact binary form of a connection's schema (`schema_pack`).
+
+One row per column in an Arrow table: schema and table names and column types are
+dictionary-encoded (each distinct name stored once, rows hold integer codes) and the
+buffers are zstd-compressed in an Arrow IPC stream, stored base64-encoded. Decoding
+only maps the buffers; the flat element list, type map and UX tree are built on first use.
+"""
+from __future__ import annotations
+
+import base64
+from collections.abc import Sequence
+from typing import Any, Dict, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+SCHEMA_PACK_VERSION = b"1"
+
+_FIELDS = pa.schema([
+    pa.field("schema", pa.dictionary(pa.int32(), pa.string())),   # null for file sources ("table.column")
+    pa.field("table", pa.dictionary(pa.int32(), pa.string())),
+    pa.field("column", pa.string()),
+    pa.field("type", pa.dictionary(pa.int16(), pa.string())),     # null when the source gave no type
+], metadata={b"querai.schema_pack": SCHEMA_PACK_VERSION})
+
+
+def _split(element: str) -> tuple[Optional[str], str, str]:
+    """`schema.table.column` / `table.column` -> (schema or None, table, column)."""
+    parts = element.split(".")
+    if len(parts) == 2:
+        return None, parts[0], parts[1]
+    return parts[0], ".".join(parts[1:-1]), parts[-1]
+
+
+def pack_schema(elements: List[str], types: Optional[Dict[str, str]] = None) -> str:
+    """Encode flat elements (in their stored order) and their types (element -> type) as a `schema_pack`."""
+    types = types or {}
+    schemas, tables, columns, column_types = [], [], [], []
+    for element in elements:
+        schema, table, column = _split(element)
+        schemas.append(schema)
+        tables.append(table)
+        columns.append(column)
+        column_types.append(types.get(element) or None)
+    table = pa.Table.from_arrays([
+        pa.array(schemas, pa.string()).dictionary_encode(),
+        pa.array(tables, pa.string()).dictionary_encode(),
+        pa.array(columns, pa.string()),
+        pa.array(column_types, pa.string()).dictionary_encode().cast(_FIELDS.field("type").type),
+    ], schema=_FIELDS)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression="zstd")) as writer:
+        writer.write_table(table)
+    return base64.b64encode(sink.getvalue().to_pybytes()).decode("ascii")
+
+
+class SchemaElements(Sequence):
+    """Read-only flat element list of a pack; strings are built on first access, `len` is free."""
+
+    def __init__(self, pack: "SchemaPack"):
+        self._pack = pack
+        self._items: Optional[List[str]] = None
+
+    def _list(self) -> List[str]:
+        if self._items is None:
+            t = self._pack.table
+            qualified = pc.binary_join_element_wise(t["schema"].cast(pa.string()), t["table"].cast(pa.string()),
+                                                    t["column"], ".")
+            # File sources have no schema part: "table.column"
+            bare = pc.binary_join_element_wise(t["table"].cast(pa.string()), t["column"], ".")
+            self._items = pc.coalesce(qualified, bare).to_pylist()
+        return self._items
+
+    def __len__(self) -> int:
+        return self._pack.table.num_rows
+
+    def __getitem__(self, index):
+        return self._list()[index]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._list())
+
+
+class SchemaPack:
+    """Decoded `schema_pack`: the Arrow table plus lazily built views of it."""
+
+    def __init__(self, table: pa.Table):
+        self.table = table
+        self.elements = SchemaElements(self)
+        self._types: Optional[Dict[str, str]] = None
+        self._tree: Optional[List[Dict[str, Any]]] = None
+
+    @classmethod
+    def decode(cls, payload: Any) -> Optional["SchemaPack"]:
+        """Pack from its stored (base64) form; None for missing payloads or unknown versions."""
+        if not payload or not isinstance(payload, str):
+            return None
+        reader = pa.ipc.open_stream(pa.py_buffer(base64.b64decode(payload)))
+        if (reader.schema.metadata or {}).get(b"querai.schema_pack") != SCHEMA_PACK_VERSION:
+            return None
+        return cls(reader.read_all())
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def types(self) -> Dict[str, str]:
+        """Element -> stored type, also keyed `table.column` for the default schema (as `column_types`)."""
+        if self._types is None:
+            types: Dict[str, str] = {}
+            column_types = self.table["type"].to_pylist()
+            schemas = self.table["schema"].to_pylist()
+            for element, schema, typ in zip(self.elements, schemas, column_types):
+                if not typ:
+                    continue
+                types[element] = typ
+                if schema is None:
+                    types[f"public.{element}"] = typ
+                elif schema == "public":
+                    types[element[len("public."):]] = typ
+            self._types = types
+        return self._types
+
+    def tree(self) -> List[Dict[str, Any]]:
+        """The `schema_json` UX tree: schemas and tables sorted by name, columns unique and sorted."""
+        if self._tree is None:
+            grouped: Dict[str, Dict[str, Dict[str, Optional[str]]]] = {}
+            rows = zip(self.table["schema"].to_pylist(), self.table["table"].to_pylist(),
+                       self.table["column"].to_pylist(), self.table["type"].to_pylist())
+            for schema, table, column, typ in rows:
+                grouped.setdefault(schema or "public", {}).setdefault(table, {}).setdefault(column, typ)
+            self._tree = [
+                {
+                    "schema_name": schema,
+                    "tables": [
+                        {"table_name": table,
+                         "columns": [{"name": c, "type": t} if t else {"name": c} for c, t in sorted(columns.items())]}
+                        for table, columns in sorted(tables.items())
+                    ],
+                }
+                for schema, tables in sorted(grouped.items())
+            ]
+        return self._tree
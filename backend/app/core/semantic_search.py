@@ -1,34 +1,332 @@
+import base64
+import json
+import os
+import threading
+
 import numpy as np
 import faiss
-from sentence_transformers import SentenceTransformer
 
-_model_cache = SentenceTransformer('paraphrase-multilingual-mpnet-base-v2')
+from typing import Callable, Optional
+
+from app.core.config import (
+    EMBEDDING_MODEL, EMBEDDING_SERVICE_URL, EMBEDDING_SERVICE_TIMEOUT,
+    EMBED_BATCH_SIZE, EMBED_PROCESSES, EMBED_MULTIPROCESS_MIN, EMBED_PROGRESS_CHUNK,
+    INDEX_STRATEGY, INDEX_HNSW_MIN, INDEX_IVFPQ_MIN, INDEX_HNSW_M, INDEX_HNSW_EF_SEARCH, INDEX_IVF_NPROBE,
+)
+from app.core.telemetry import span
+
+INDEX_FILE = "index.faiss"
+ELEMENTS_FILE = "elements.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+META_FILE = "meta.json"
+
+ProgressCallback = Callable[[int, int], None]
+
+INDEX_STRATEGIES = ("flat", "hnsw", "ivfpq")
+# PQ trains 256 centroids per sub-quantizer (8-bit codes); k-means wants ~39 points per centroid
+IVFPQ_MIN_VECTORS = 39 * 256
+
+_model_cache = None
+_model_lock = threading.Lock()
+
+
+class RemoteEncoder:
+    """Minimal `encode()`-compatible client for the shared embedding service."""
+
+    def __init__(self, base_url: str, timeout: float):
+        import httpx
+
+        self._client = httpx.Client(base_url=base_url.rstrip("/"), timeout=timeout)
+
+    def encode(self, sentences, batch_size: int = 32, **kwargs) -> np.ndarray:
+        texts = [sentences] if isinstance(sentences, str) else list(sentences)
+        r = self._client.post("/embed", json={"texts": texts, "batch_size": batch_size})
+        r.raise_for_status()
+        payload = r.json()
+        data = np.frombuffer(base64.b64decode(payload["data"]), dtype=np.float32)
+        return data.reshape(len(texts), payload["dim"])
+
+
+def load_local_model():
+    """Load the SentenceTransformer in this process (import deferred: torch is slow to import)."""
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+
+def get_model():
+    """Return the process-wide embedding model, loading it on first use (thread-safe)."""
+    global _model_cache
+    if _model_cache is None:
+        with _model_lock:
+            if _model_cache is None:
+                if EMBEDDING_SERVICE_URL:
+                    _model_cache = RemoteEncoder(EMBEDDING_SERVICE_URL, EMBEDDING_SERVICE_TIMEOUT)
+                else:
+                    with span("embedding.load_model"):
+                        _model_cache = load_local_model()
+    return _model_cache
+
+
+def warm_up() -> threading.Thread:
+    """Load the model in a background thread so the first large-schema query doesn't pay for it."""
+    def _load():
+        try:
+            get_model()
+        except Exception as e:
+            print(f"Embedding model warm-up failed: {e}")
+
+    thread = threading.Thread(target=_load, name="embedding-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def embed_elements(
+    elements: list[str],
+    batch_size: int = EMBED_BATCH_SIZE,
+    progress: Optional[ProgressCallback] = None,
+) -> np.ndarray:
+    """
+    Embed many strings in chunks and return unit-length float32 vectors.
+    Large inputs use sentence-transformers' multi-process pool when EMBED_PROCESSES > 1;
+    `progress(done, total)` is called after every chunk.
+    """
+    model = get_model()
+    total = len(elements)
+    chunks: list[np.ndarray] = []
+    use_pool = EMBED_PROCESSES > 1 and total >= EMBED_MULTIPROCESS_MIN and hasattr(model, "start_multi_process_pool")
+
+    pool = model.start_multi_process_pool(target_devices=["cpu"] * EMBED_PROCESSES) if use_pool else None
+    try:
+        step = max(EMBED_PROGRESS_CHUNK, batch_size)
+        for start in range(0, total, step):
+            chunk = elements[start:start + step]
+            with span("embedding.encode", texts=len(chunk)):
+                if pool is not None:
+                    vectors = model.encode_multi_process(chunk, pool, batch_size=batch_size)
+                else:
+                    vectors = model.encode(chunk, batch_size=batch_size)
+            chunks.append(np.asarray(vectors, dtype=np.float32))
+            if progress:
+                progress(min(start + step, total), total)
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+
+    if not chunks:
+        return np.empty((0, 0), dtype=np.float32)
+    embeddings = np.ascontiguousarray(np.vstack(chunks), dtype=np.float32)
+    faiss.normalize_L2(embeddings)
+    return embeddings
+
+
+def embed_text(text: str) -> np.ndarray:
+    """Unit-length float32 embedding of a single text (for cosine comparisons)."""
+    model = get_model()
+    with span("embedding.encode", texts=1):
+        vector = np.asarray(model.encode([text])[0], dtype=np.float32)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+def choose_index_strategy(size: int, strategy: Optional[str] = None) -> str:
+    """
+    Exact search for small schemas, graph (HNSW) for large, compressed IVF-PQ for huge.
+    `strategy` (else a pinned INDEX_STRATEGY) wins, except IVF-PQ below IVFPQ_MIN_VECTORS:
+    too few vectors to train the quantizers, so the size-based choice applies instead.
+    """
+    strategy = strategy or (INDEX_STRATEGY if INDEX_STRATEGY in INDEX_STRATEGIES else None)
+    if strategy and (strategy != "ivfpq" or size >= IVFPQ_MIN_VECTORS):
+        return strategy
+    if size < INDEX_HNSW_MIN:
+        return "flat"
+    if size < INDEX_IVFPQ_MIN:
+        return "hnsw"
+    return "ivfpq"
+
+
+def _pq_subquantizers(dimension: int) -> int:
+    """Largest PQ sub-quantizer count <= 64 that divides the dimension."""
+    for m in (64, 48, 32, 24, 16, 12, 8, 4, 2, 1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+
+def set_search_params(index) -> None:
+    """Apply query-time knobs (they are not always preserved by write/read)."""
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = INDEX_HNSW_EF_SEARCH
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = INDEX_IVF_NPROBE
+
+
+def build_faiss_index(embeddings: np.ndarray, strategy: str):
+    """Inner-product index over unit-length vectors (i.e. cosine similarity)."""
+    count, dimension = embeddings.shape
+    if strategy == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, INDEX_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = 200
+    elif strategy == "ivfpq":
+        if count < IVFPQ_MIN_VECTORS:
+            raise ValueError(f"IVF-PQ needs at least {IVFPQ_MIN_VECTORS} vectors to train, got {count}")
+        nlist = max(1, min(int(4 * np.sqrt(count)), count // 39))
+        quantizer = faiss.IndexFlatIP(dimension)
+        index = faiss.IndexIVFPQ(quantizer, dimension, nlist, _pq_subquantizers(dimension), 8,
+                                 faiss.METRIC_INNER_PRODUCT)
+        # Training on a sample is enough and keeps build time bounded
+        sample_size = min(count, max(nlist * 39, 100_000))
+        sample = embeddings[np.random.default_rng(0).choice(count, sample_size, replace=False)]
+        index.train(np.ascontiguousarray(sample))
+    elif strategy == "flat":
+        index = faiss.IndexFlatIP(dimension)
+    else:
+        raise ValueError(f"Unknown index strategy: '{strategy}'")
+    index.add(embeddings)
+    set_search_params(index)
+    return index
+
+
+def index_nbytes(index, strategy: str) -> int:
+    """Approximate in-memory size of a `build_faiss_index` index (vectors/codes and graph links)."""
+    if strategy == "ivfpq":
+        # PQ code plus the 8-byte id per vector in the inverted lists
+        return index.ntotal * (faiss.try_extract_index_ivf(index).code_size + 8)
+    if strategy == "hnsw":
+        return index.ntotal * (index.d * 4 + INDEX_HNSW_M * 2 * 4)
+    return index.ntotal * index.d * 4
+
 
 class SemanticSearch:
-    def __init__(self, model_name: str = 'paraphrase-multilingual-mpnet-base-v2'):
-        self.model = _model_cache
+    def __init__(self, model_name: str = EMBEDDING_MODEL):
         self.index = None
         self.schema_elements = []
+        self.embeddings = None
+        self.index_strategy = None
+
+    @property
+    def model(self):
+        return get_model()
 
-    def create_vector_store(self, schema_elements: list[str]):
+    def create_vector_store(
+        self,
+        schema_elements: list[str],
+        progress: Optional[ProgressCallback] = None,
+        previous: Optional[tuple[list[str], np.ndarray]] = None,
+        strategy: Optional[str] = None,
+    ):
+        """
+        Build the index for `schema_elements`.
+        `previous` = (elements, embeddings) of an earlier build; vectors of unchanged
+        elements are reused so only new/changed elements are embedded.
+        `strategy` = flat | hnsw | ivfpq, checked by choose_index_strategy (IVF-PQ falls back below
+        IVFPQ_MIN_VECTORS); defaults to the size-based choice.
+        """
         if not schema_elements:
             raise ValueError("Schema elements cannot be empty.")
 
         self.schema_elements = schema_elements
 
-        embeddings = self.model.encode(schema_elements)
-        dimension = embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(dimension)
-        self.index.add(np.array(embeddings, dtype=np.float32))
+        reused: dict[str, int] = {}
+        prev_vectors = None
+        if previous is not None:
+            prev_elements, prev_vectors = previous
+            reused = {el: i for i, el in enumerate(prev_elements)}
+        missing = [el for el in schema_elements if el not in reused]
+        fresh = embed_elements(missing, progress=progress) if missing else None
 
-    def find_relevant_schema_parts(self, query: str, k: int = 15) -> list[str]:
+        if fresh is not None and prev_vectors is not None and fresh.shape[1] != prev_vectors.shape[1]:
+            # Model changed between builds; previous vectors are not comparable
+            missing, fresh = schema_elements, embed_elements(schema_elements, progress=progress)
+
+        if fresh is not None and len(missing) == len(schema_elements):
+            embeddings = fresh
+        else:
+            dimension = prev_vectors.shape[1]
+            embeddings = np.empty((len(schema_elements), dimension), dtype=np.float32)
+            fresh_pos = {el: i for i, el in enumerate(missing)}
+            for row, el in enumerate(schema_elements):
+                if el in fresh_pos:
+                    embeddings[row] = fresh[fresh_pos[el]]
+                else:
+                    embeddings[row] = prev_vectors[reused[el]]
+            if progress and not missing:
+                progress(len(schema_elements), len(schema_elements))
+
+        self.embeddings = embeddings
+        self.index_strategy = choose_index_strategy(len(schema_elements), strategy)
+        with span("faiss.build", strategy=self.index_strategy, vectors=len(schema_elements)):
+            self.index = build_faiss_index(embeddings, self.index_strategy)
+
+    def save(self, directory: str) -> None:
+        """Persist the FAISS index, the element list and the raw embeddings into `directory`."""
+        if self.index is None:
+            raise RuntimeError("Vector store is not initialized. Please call create_vector_store() first.")
+        os.makedirs(directory, exist_ok=True)
+        faiss.write_index(self.index, os.path.join(directory, INDEX_FILE))
+        with open(os.path.join(directory, ELEMENTS_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.schema_elements, f)
+        with open(os.path.join(directory, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"model": EMBEDDING_MODEL, "index_strategy": self.index_strategy}, f)
+        if self.embeddings is not None:
+            np.save(os.path.join(directory, EMBEDDINGS_FILE), self.embeddings)
+            # Kept on disk for incremental rebuilds; no need to hold a second copy in memory
+            self.embeddings = None
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "SemanticSearch":
+        """Load a persisted vector store; the index is memory-mapped by default."""
+        search = cls()
+        index_path = os.path.join(directory, INDEX_FILE)
+        try:
+            search.index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP if mmap else 0)
+        except RuntimeError:
+            # Not every index type supports mmap (e.g. HNSW graphs); read it into memory instead
+            search.index = faiss.read_index(index_path)
+        set_search_params(search.index)
+        with open(os.path.join(directory, ELEMENTS_FILE), encoding="utf-8") as f:
+            search.schema_elements = json.load(f)
+        meta_path = os.path.join(directory, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                search.index_strategy = json.load(f).get("index_strategy")
+        return search
+
+    @staticmethod
+    def load_embeddings(directory: str) -> Optional[tuple[list[str], np.ndarray]]:
+        """(elements, embeddings) of a persisted build, memory-mapped; None if unavailable."""
+        path = os.path.join(directory, EMBEDDINGS_FILE)
+        meta_path = os.path.join(directory, META_FILE)
+        if not os.path.exists(path) or not os.path.exists(meta_path):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            if json.load(f).get("model") != EMBEDDING_MODEL:
+                return None
+        with open(os.path.join(directory, ELEMENTS_FILE), encoding="utf-8") as f:
+            elements = json.load(f)
+        return elements, np.load(path, mmap_mode="r")
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate in-memory footprint (vectors/codes + element strings)."""
+        if self.index is None:
+            return 0
+        return index_nbytes(self.index, self.index_strategy) + sum(len(el) for el in self.schema_elements)
+
+    def search(self, query: str, k: int = 15) -> list[tuple[str, float]]:
+        """Top-k schema elements for the query with their cosine similarity."""
         if self.index is None:
             raise RuntimeError("Vector store is not initialized. Please call create_vector_store() first.")
 
         effective_k = min(k, self.index.ntotal)
 
-        query_embedding = self.model.encode([query])
-        _, indices = self.index.search(np.array(query_embedding, dtype=np.float32), effective_k)
+        # Index vectors are unit-length; normalize the query the same way
+        query_embedding = embed_text(query)[None, :]
+        with span("faiss.search", strategy=self.index_strategy, k=effective_k):
+            scores, indices = self.index.search(query_embedding, effective_k)
 
-        return [self.schema_elements[i] for i in indices[0]]
+        return [(self.schema_elements[i], float(score)) for i, score in zip(indices[0], scores[0]) if i >= 0]
 
+    def find_relevant_schema_parts(self, query: str, k: int = 15) -> list[str]:
+        return [element for element, _ in self.search(query, k)]
@@ -0,0 +1,210 @@
+"""
+Pre-execution checks for LLM-generated SQL.
+
+Every statement is parsed with sqlglot and must be a single read-only query; its LIMIT is
+injected or clamped to the caller's row cap, and engines that can estimate a plan
+(PostgreSQL, MySQL, DuckDB) are asked for one so runaway joins are refused before they run.
+Execution errors are classified here too: structured timeouts, and whether a rewritten
+statement could succeed (the repair loop in the orchestrator).
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, Optional, Set, Tuple
+
+import duckdb
+import sqlglot
+from sqlalchemy import exc as sa_exc
+from sqlglot import exp
+
+from app.core.config import SQL_MAX_PLAN_COST, SQL_MAX_PLAN_ROWS
+
+# source_type -> sqlglot dialect / name used in LLM prompts
+DIALECTS = {"postgresql": "postgres", "mysql": "mysql", "csv": "duckdb", "excel": "duckdb", "parquet": "duckdb",
+            "json": "duckdb"}
+DIALECT_NAMES = {"postgresql": "PostgreSQL", "mysql": "MySQL", "csv": "DuckDB", "excel": "DuckDB", "parquet": "DuckDB",
+                 "json": "DuckDB"}
+
+# Guard refusals a rewritten query can fix
+_REPAIRABLE_CODES = ("parse_error", "multiple_statements", "not_allowed", "rows_exceeded")
+# MySQL server errors that are about the session, not the statement
+_MYSQL_NOT_REPAIRABLE = {1040, 1044, 1045, 1205, 1213, 3024}
+
+# Statement/clause nodes that write, lock or change session state
+_FORBIDDEN = tuple(
+    getattr(exp, name)
+    for name in ("Insert", "Update", "Delete", "Merge", "Create", "Drop", "Alter", "TruncateTable", "Command",
+                 "Into", "Lock", "Grant", "Revoke", "Copy", "Set", "Transaction", "Commit", "Rollback", "Use",
+                 "Pragma", "LoadData")
+    if hasattr(exp, name)
+)
+
+# File connections: generated SQL may only read the registered views. Their names are always
+# plain identifiers, so quoted paths (`FROM '/etc/passwd'`) and table functions (read_csv,
+# glob, duckdb_secrets(), ...) are refused; only these row generators are allowed
+_DUCKDB_TABLE_FUNCTIONS = {"generate_series", "range", "unnest"}
+_DUCKDB_FORBIDDEN_FUNCTIONS = {"current_setting", "getenv"}
+_PLAIN_NAME = re.compile(r"^\w+$")
+
+_TIMEOUT_MARKERS = (
+    "statement timeout",                          # PostgreSQL: canceling statement due to statement timeout
+    "maximum statement execution time exceeded",  # MySQL 3024
+    "interrupt",                                  # DuckDB: INTERRUPT Error
+)
+
+
+class SQLGuardError(Exception):
+    """Generated SQL refused before (or stopped during) execution; `code` is stable for the UI."""
+
+    def __init__(self, code: str, message: str, **detail: Any):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.detail = detail
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"code": self.code, "message": self.message, **self.detail}
+
+
+def _limit_value(node: exp.Expression | None) -> Optional[int]:
+    """Literal row count of a LIMIT / FETCH FIRST clause; None when absent or not a literal."""
+    if node is None:
+        return None
+    value = node.args.get("count") if isinstance(node, exp.Fetch) else node.expression
+    if isinstance(value, exp.Literal) and value.is_int:
+        return int(value.name)
+    return None
+
+
+def _check_duckdb_sources(root: exp.Expression) -> None:
+    for table in root.find_all(exp.Table):
+        source = table.this
+        if isinstance(source, exp.Func):
+            name = (source.sql_name() if not isinstance(source, exp.Anonymous) else source.name).lower()
+            if name not in _DUCKDB_TABLE_FUNCTIONS:
+                raise SQLGuardError("not_allowed", "Only the connection's tables can be queried.", function=name)
+        elif not _PLAIN_NAME.match(table.name):
+            raise SQLGuardError("not_allowed", "Only the connection's tables can be queried.", table=table.name)
+    for func in root.find_all(exp.Anonymous):
+        if func.name.lower() in _DUCKDB_FORBIDDEN_FUNCTIONS:
+            raise SQLGuardError("not_allowed", "Only the connection's tables can be queried.", function=func.name.lower())
+
+
+def guard_sql(sql_query: str, source_type: str, max_rows: int) -> Tuple[str, str]:
+    """
+    Validate generated SQL and bound its result size.
+
+    Returns (sql to execute, validated sql without the added/clamped LIMIT); the second
+    is what row-count hints should describe. Raises SQLGuardError with codes
+    `parse_error`, `multiple_statements`, `not_select` or (file connections reading
+    anything but their views) `not_allowed`.
+    """
+    dialect = DIALECTS.get((source_type or "").lower())
+    text = (sql_query or "").strip().rstrip(";").strip()
+    try:
+        statements = [s for s in sqlglot.parse(text, read=dialect) if s is not None]
+    except sqlglot.errors.ParseError as e:
+        raise SQLGuardError("parse_error", f"The generated SQL could not be parsed: {e}") from e
+    if not statements:
+        raise SQLGuardError("parse_error", "The generated SQL is empty.")
+    if len(statements) > 1:
+        raise SQLGuardError("multiple_statements", "Only a single SQL statement can be executed.",
+                            statements=len(statements))
+
+    root = statements[0]
+    if not isinstance(root, exp.Query):
+        raise SQLGuardError("not_select", "Only SELECT queries can be executed.", statement=root.key.upper())
+    forbidden = next(root.find_all(*_FORBIDDEN), None)
+    if forbidden is not None:
+        raise SQLGuardError("not_select", "Only read-only SELECT queries can be executed.",
+                            statement=forbidden.key.upper())
+    if dialect == "duckdb":
+        _check_duckdb_sources(root)
+
+    current = _limit_value(root.args.get("limit"))
+    if current is not None and current <= max_rows:
+        return text, text
+    # Missing, non-literal (LIMIT ALL, expressions) or above the cap: the cap wins
+    return root.limit(max_rows, copy=True).sql(dialect=dialect), text
+
+
+def check_plan(manager: Any, sql_query: str) -> Optional[Dict[str, float]]:
+    """
+    Refuse plans above SQL_MAX_PLAN_COST / SQL_MAX_PLAN_ROWS (0 disables a check).
+    Returns the estimate, or None when the engine has none.
+    """
+    if SQL_MAX_PLAN_COST <= 0 and SQL_MAX_PLAN_ROWS <= 0:
+        return None
+    estimate = manager.explain_estimate(sql_query)
+    if not estimate:
+        return None
+    cost = estimate.get("cost")
+    if SQL_MAX_PLAN_COST > 0 and cost is not None and cost > SQL_MAX_PLAN_COST:
+        raise SQLGuardError("cost_exceeded", "The query plan is too expensive to run on this connection.",
+                            cost=cost, max_cost=SQL_MAX_PLAN_COST)
+    rows = estimate.get("rows")
+    if SQL_MAX_PLAN_ROWS > 0 and rows is not None and rows > SQL_MAX_PLAN_ROWS:
+        raise SQLGuardError("rows_exceeded", "The query would process too many rows (check for a missing join condition).",
+                            rows=rows, max_rows=SQL_MAX_PLAN_ROWS)
+    return estimate
+
+
+def timeout_error(error: Exception) -> Optional[SQLGuardError]:
+    """Map a driver's statement-timeout/interrupt error to a structured `timeout` error."""
+    text = str(error).lower()
+    if any(marker in text for marker in _TIMEOUT_MARKERS):
+        return SQLGuardError("timeout", "The query ran longer than this connection's statement timeout.")
+    return None
+
+
+def referenced_tables(sql_query: str, source_type: str) -> Set[str]:
+    """Lower-cased `table` and `schema.table` names a query reads; empty when it does not parse."""
+    try:
+        tree = sqlglot.parse_one(sql_query, read=DIALECTS.get((source_type or "").lower()))
+    except sqlglot.errors.ParseError:
+        return set()
+    names: Set[str] = set()
+    for table in tree.find_all(exp.Table):
+        if table.name:
+            names.add(table.name.lower())
+            if table.db:
+                names.add(f"{table.db}.{table.name}".lower())
+    return names
+
+
+def repairable_error(error: Exception) -> bool:
+    """
+    True when a rewritten statement could succeed: syntax, unknown names, type mismatches and
+    runaway joins. Timeouts, connectivity, permissions and resource errors are final.
+    """
+    if isinstance(error, SQLGuardError):
+        return error.code in _REPAIRABLE_CODES
+    if timeout_error(error) is not None:
+        return False
+    if isinstance(error, duckdb.Error):
+        return isinstance(error, (duckdb.ParserException, duckdb.BinderException, duckdb.CatalogException,
+                                  duckdb.ConversionException, duckdb.InvalidInputException))
+    if isinstance(error, sa_exc.DBAPIError):
+        if error.connection_invalidated or isinstance(error, (sa_exc.InterfaceError, sa_exc.InternalError)):
+            return False
+        orig = error.orig
+        pgcode = getattr(orig, "pgcode", None)
+        if pgcode:
+            # 42: syntax error / undefined object, 22: data exception, 21: cardinality violation
+            return pgcode[:2] in ("42", "22", "21") and pgcode != "42501"  # 42501: insufficient privilege
+        errno = orig.args[0] if orig is not None and orig.args and isinstance(orig.args[0], int) else None
+        if errno is not None:
+            return 1000 <= errno < 2000 and errno not in _MYSQL_NOT_REPAIRABLE
+        return isinstance(error, (sa_exc.ProgrammingError, sa_exc.DataError))
+    return False
+
+
+def error_text(error: Exception, limit: int = 500) -> str:
+    """Driver message for prompts and logs, without the SQL echo SQLAlchemy appends."""
+    if isinstance(error, SQLGuardError):
+        text = error.message
+    elif isinstance(error, sa_exc.DBAPIError) and error.orig is not None:
+        text = str(error.orig)
+    else:
+        text = str(error)
+    return text.strip()[:limit]
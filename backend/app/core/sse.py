@@ -0,0 +1,12 @@
+import json
+from typing import Any, Dict
+
+from app.core.data_manager import json_default
+
+# Disable proxy buffering (nginx) and caching so events reach the browser as they are produced
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, default=json_default)}\n\n"
@@ -0,0 +1,186 @@
+"""
+Request tracing and Prometheus metrics.
+
+`span(stage)` times a hot-path stage: the duration lands in the `querai_stage_duration_seconds`
+histogram, in the current request's trace (printed for requests slower than TRACE_SLOW_MS)
+and, when OTEL_EXPORTER_OTLP_ENDPOINT is set, in an OpenTelemetry span exported over OTLP.
+`TelemetryMiddleware` opens the per-request trace and records request latency by route.
+"""
+from __future__ import annotations
+
+import contextvars
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Optional
+
+from prometheus_client import Counter, Histogram
+
+from app.core.config import OTEL_EXPORTER_OTLP_ENDPOINT, OTEL_SERVICE_NAME, TRACE_SLOW_MS
+
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUEST_SECONDS = Histogram(
+    "querai_http_request_duration_seconds", "HTTP request latency, until the last body chunk is sent.",
+    ("method", "route", "status"), buckets=_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "querai_stage_duration_seconds", "Latency of hot-path stages (Supabase, embedding, FAISS, LLM, SQL, ...).",
+    ("stage",), buckets=_BUCKETS,
+)
+STAGE_ERRORS = Counter("querai_stage_errors_total", "Stages that raised.", ("stage",))
+LLM_TOKENS = Counter("querai_llm_tokens_total", "Gemini tokens per call type.", ("call", "kind"))
+
+# Stage records of the request being served ({stage, ms, ...attributes}); None outside requests
+_trace: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar("querai_trace", default=None)
+
+_tracer = None
+_provider = None
+
+
+def _init_otel() -> None:
+    """OTLP span export, only when an endpoint is configured and the SDK/exporter are installed."""
+    global _tracer, _provider
+    if not OTEL_EXPORTER_OTLP_ENDPOINT:
+        return
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as e:
+        print(f"OpenTelemetry export disabled (install opentelemetry-sdk and opentelemetry-exporter-otlp-proto-http): {e}")
+        return
+    _provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    # The exporter reads OTEL_EXPORTER_OTLP_ENDPOINT (and the other OTEL_* variables) itself
+    _provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(_provider)
+    _tracer = trace.get_tracer("querai")
+
+
+_init_otel()
+
+
+def _otel_attributes(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    return {f"querai.{k}": v for k, v in attributes.items() if isinstance(v, (str, bool, int, float))}
+
+
+def _finish(stage: str, seconds: float, error: bool, attributes: Dict[str, Any]) -> None:
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    if error:
+        STAGE_ERRORS.labels(stage).inc()
+    trace = _trace.get()
+    if trace is not None:
+        trace.append({"stage": stage, "ms": round(seconds * 1000, 1), **({"error": True} if error else {}), **attributes})
+
+
+def record(stage: str, seconds: float, error: bool = False, **attributes: Any) -> None:
+    """Record a stage timed elsewhere (e.g. from HTTP client hooks)."""
+    _finish(stage, seconds, error, attributes)
+    if _tracer is not None:
+        end = time.time_ns()
+        otel_span = _tracer.start_span(stage, start_time=end - int(seconds * 1e9), attributes=_otel_attributes(attributes))
+        otel_span.end(end_time=end)
+
+
+@contextmanager
+def span(stage: str, **attributes: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Time a stage. The yielded dict holds the span attributes; callers may add to it
+    (row counts, token usage) before the block ends. Must not stay open across a `yield`
+    of a generator driven by `iterate_blocking` (each step runs in a different context).
+    """
+    with (_tracer.start_as_current_span(stage) if _tracer is not None else nullcontext()) as otel_span:
+        started = time.perf_counter()
+        error = False
+        try:
+            yield attributes
+        except BaseException:
+            error = True
+            raise
+        finally:
+            _finish(stage, time.perf_counter() - started, error, attributes)
+            if otel_span is not None:
+                otel_span.set_attributes(_otel_attributes(attributes))
+
+
+def record_llm_usage(call: str, response: Any, attributes: Optional[Dict[str, Any]] = None) -> None:
+    """Count prompt/completion tokens of a Gemini response (no-op when it carries no usage)."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    tokens = {
+        "prompt": getattr(usage, "prompt_token_count", 0) or 0,
+        "completion": getattr(usage, "candidates_token_count", 0) or 0,
+    }
+    for kind, count in tokens.items():
+        if count:
+            LLM_TOKENS.labels(call, kind).inc(count)
+    if attributes is not None:
+        attributes.update(prompt_tokens=tokens["prompt"], completion_tokens=tokens["completion"])
+
+
+def _route(scope: Dict[str, Any]) -> str:
+    """Route template (`/api/chats/{chat_id}`), not the raw path, to keep label cardinality bounded."""
+    route = scope.get("route")
+    template = getattr(route, "path", None)
+    if template:
+        # Routes of included routers may carry the template without the include prefix (`/api`)
+        segments = scope.get("path", "").strip("/").split("/")
+        prefix = segments[:max(len(segments) - len(template.strip("/").split("/")), 0)]
+        return "/" + "/".join(prefix + [template.strip("/")]) if prefix else template
+    endpoint = scope.get("endpoint")
+    return getattr(endpoint, "__name__", "unmatched")
+
+
+class TelemetryMiddleware:
+    """ASGI middleware: per-request trace, latency histogram and a log line for slow requests."""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    @staticmethod
+    def _request_span(scope: Dict[str, Any]) -> Any:
+        """Server span for the request, unless the framework's own instrumentation already opened one."""
+        if _tracer is None:
+            return nullcontext()
+        from opentelemetry import trace
+
+        if trace.get_current_span().is_recording():
+            return nullcontext()
+        return _tracer.start_as_current_span(f"{scope.get('method')} {scope.get('path')}")
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace: List[Dict[str, Any]] = []
+        token = _trace.set(trace)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            with self._request_span(scope):
+                await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = time.perf_counter() - started
+            _trace.reset(token)
+            route = _route(scope)
+            REQUEST_SECONDS.labels(scope.get("method", ""), route, str(status)).observe(seconds)
+            ms = seconds * 1000
+            if TRACE_SLOW_MS >= 0 and ms >= TRACE_SLOW_MS:
+                print("trace " + json.dumps({"method": scope.get("method"), "route": route, "status": status,
+                                             "ms": round(ms, 1), "stages": trace}, default=str))
+
+
+def shutdown() -> None:
+    """Flush spans still buffered for export."""
+    if _provider is not None:
+        _provider.shutdown()
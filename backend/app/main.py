@@ -1,5 +1,10 @@
 from fastapi import FastAPI
-from app.api import query_router, chat_router, connection_router
+from app.api import query_router, chat_router, connection_router, job_router, metrics_router
+from app.core import executor, semantic_search, telemetry
+from app.core.config import EMBEDDING_WARMUP
+from app.core.data_manager_factory import close_all_data_managers
+from app.core.jobs import job_manager
+from app.services import supabase_client
 
 app = FastAPI(
     title="Querai API",
@@ -9,6 +14,32 @@ app = FastAPI(
 app.include_router(query_router.router, prefix="/api")
 app.include_router(chat_router.router, prefix="/api")
 app.include_router(connection_router.router, prefix="/api")
+app.include_router(job_router.router, prefix="/api")
+app.include_router(metrics_router.router)
+app.add_middleware(telemetry.TelemetryMiddleware)
+
+
+@app.on_event("startup")
+def warm_up_embeddings():
+    # Optional: load the embedding model in the background instead of on the first large-schema query
+    if EMBEDDING_WARMUP:
+        semantic_search.warm_up()
+
+
+@app.on_event("startup")
+def recover_jobs():
+    # Jobs of exited processes cannot resume; mark them failed and prune old records
+    job_manager.recover()
+
+
+@app.on_event("shutdown")
+async def shutdown_resources():
+    await supabase_client.aclose()
+    job_manager.shutdown()
+    close_all_data_managers()
+    executor.shutdown()
+    telemetry.shutdown()
+
 
 @app.get("/")
 def read_root():
@@ -9,22 +9,36 @@ class DBDetails(BaseModel):
     username: str = None
     password: str = None
     database: str = None
+    statement_timeout_ms: int = None
 
 
 class DataSource(BaseModel):
     """Defines the source of the data to be queried."""
-    source_type: str = Field(..., description="e.g., 'postgresql', 'mysql', 'csv', 'excel'")
+    source_type: str = Field(..., description="e.g., 'postgresql', 'mysql', 'csv', 'excel', 'parquet', 'json'")
 
     db_details: Optional[DBDetails] = None
 
     file_path: Optional[str] = None
 
 
+class ResultShape(BaseModel):
+    """Optional result-shaping stage for charts; columns are inferred when not given."""
+    mode: str = Field("auto", description="'auto' | 'none' | 'top_n' | 'time_bucket' | 'lttb' | 'summary'")
+    x: Optional[str] = Field(None, description="Label or time column")
+    y: Optional[str] = Field(None, description="Measure column")
+    agg: str = Field("sum", description="'sum' | 'avg' | 'min' | 'max' | 'count' for top_n / time_bucket")
+    max_points: Optional[int] = Field(None, ge=10, le=10000, description="Points in a time_bucket / lttb series")
+    top_n: Optional[int] = Field(None, ge=1, le=100, description="Categories kept before the 'Other' bucket")
+    bucket: Optional[str] = Field(None, description="time_bucket width, e.g. '1 hour'; picked from the time range when omitted")
+
+
 class QueryRequest(BaseModel):
     """The main request model for the API."""
     question: str = Field(..., max_length=750, description="Question to be answered")
     connection_id: Optional[str] = Field(None, description="ID of a saved connection")
     user_id: Optional[str] = Field(None, description="User ID for ownership checks")
+    schema_token_budget: Optional[int] = Field(None, ge=200, description="Token budget for the schema part of the prompt")
+    shape: Optional[ResultShape] = Field(None, description="Result shaping for charts (automatic for large results)")
 
 
 class QueryResponse(BaseModel):
@@ -32,3 +46,10 @@ class QueryResponse(BaseModel):
     sql_query: str
     explanation: str
     data: List[Dict[str, Any]]
+    truncated: bool = Field(default=False, description="True when row/byte limits cut the result short")
+    total_count_hint: Optional[int] = Field(default=None, description="Total rows if known (exact or estimated)")
+    error: Optional[Dict[str, Any]] = Field(default=None, description="Structured error ({code, message, ...}) when SQL was refused or failed")
+    attempts: Optional[List[Dict[str, Any]]] = Field(default=None, description="Per-attempt execution timings ({sql_query, ms, error?, fix?}) when SQL ran")
+    chart: Optional[Dict[str, Any]] = Field(default=None, description="Chart-sized series ({kind, x, y, points, source_rows, ...}) of a shaped result")
+    summary: Optional[Dict[str, Dict[str, Any]]] = Field(default=None, description="Per-column statistics of a shaped result")
+    result_handle: Optional[str] = Field(default=None, description="Handle for GET /query/results/{handle} when `data` is only a preview")
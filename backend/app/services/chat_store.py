@@ -0,0 +1,239 @@
+"""
+Append-only chat history on Supabase REST.
+
+Messages live in `chat_messages` (one row per message, unique on (chat_id, seq)), so a new
+exchange is a single INSERT instead of a read-modify-write of the whole history. Result sets
+keep a small inline preview (plus the chart series of shaped results); the full (already
+capped) rows go to `chat_results`, gzip-compressed. Chats from before `chat_messages` keep
+their history in the legacy `chats.messages` array; it is copied in as seq 1..n the first
+time such a chat is read or appended to.
+"""
+import base64
+import gzip
+import json
+from typing import Any, Dict, List, Optional
+
+from app.core.config import CHAT_APPEND_RETRIES, CHAT_RESULT_MAX_BYTES, CHAT_RESULT_PREVIEW_ROWS
+from app.core.data_manager import json_default
+from app.services import supabase_client
+from app.services.supabase_client import sb_headers
+
+MESSAGE_FIELDS = "seq,role,content,sql,response_type,truncated,results,chart,result_id,row_count,created_at"
+
+
+class ChatConflict(Exception):
+    """The chat advanced past the sequence number the writer expected."""
+
+    def __init__(self, current_seq: int):
+        super().__init__(f"Chat has newer messages (seq {current_seq})")
+        self.current_seq = current_seq
+
+
+class ChatStoreError(Exception):
+    """Supabase rejected a chat history read/write."""
+
+
+def compress_results(rows: List[Dict[str, Any]]) -> tuple[str, int]:
+    """
+    Gzip + base64 encode result rows, dropping trailing rows until the payload fits
+    CHAT_RESULT_MAX_BYTES. Returns (payload, stored row count).
+    """
+    count = len(rows)
+    while True:
+        raw = json.dumps(rows[:count], default=json_default, separators=(",", ":")).encode("utf-8")
+        payload = base64.b64encode(gzip.compress(raw, compresslevel=6)).decode("ascii")
+        if len(payload) <= CHAT_RESULT_MAX_BYTES or count <= 1:
+            return payload, count
+        count //= 2
+
+
+def decompress_results(payload: str) -> List[Dict[str, Any]]:
+    return json.loads(gzip.decompress(base64.b64decode(payload)))
+
+
+def _jsonable(value: Any) -> Any:
+    # Driver values (Decimal, dates, ...) must be plain JSON before going through httpx
+    return json.loads(json.dumps(value, default=json_default))
+
+
+async def latest_seq(chat_id: str) -> int:
+    r = await supabase_client.get_client().get(
+        "/chat_messages",
+        headers=sb_headers(),
+        params={"chat_id": f"eq.{chat_id}", "select": "seq", "order": "seq.desc", "limit": "1"},
+    )
+    if not r.is_success:
+        raise ChatStoreError(r.text)
+    rows = r.json()
+    return int(rows[0]["seq"]) if rows else 0
+
+
+def _message_row(chat_id: str, user_id: str, seq: int, role: str, content: Any,
+                 answer: Optional[Dict[str, Any]] = None, result_id: Optional[str] = None) -> Dict[str, Any]:
+    # Every row of a bulk insert carries the same keys (PostgREST requires matching objects)
+    answer = answer or {}
+    rows = answer.get("results") or []
+    return {
+        "chat_id": chat_id,
+        "user_id": user_id,
+        "seq": seq,
+        "role": role,
+        "content": content,
+        "sql": answer.get("sql"),
+        "response_type": answer.get("response_type"),
+        "truncated": bool(answer.get("truncated")),
+        "results": _jsonable(rows[:CHAT_RESULT_PREVIEW_ROWS]) if answer else None,
+        "chart": _jsonable(answer.get("chart")),
+        "result_id": result_id,
+        "row_count": len(rows) if answer else None,
+    }
+
+
+async def _backfill_legacy(chat_id: str, user_id: str) -> int:
+    """
+    Copy the legacy `chats.messages` array of a chat without `chat_messages` rows into the
+    table as seq 1..n. Returns the tail seq afterwards (0 when there was nothing to copy).
+    """
+    r = await supabase_client.get_client().get(
+        "/chats",
+        headers=sb_headers(),
+        params={"id": f"eq.{chat_id}", "user_id": f"eq.{user_id}", "select": "messages"},
+    )
+    if not r.is_success:
+        raise ChatStoreError(r.text)
+    data = r.json()
+    legacy = (data[0].get("messages") if data else None) or []
+    if not legacy:
+        return 0
+    rows = []
+    for seq, message in enumerate(legacy, start=1):
+        content = message.get("content")
+        if message.get("role") == "assistant":
+            explanation = content.get("explanation") if isinstance(content, dict) else content
+            answer = {k: message.get(k) for k in ("sql", "response_type", "truncated")}
+            answer["results"] = message.get("results") or []
+            rows.append(_message_row(chat_id, user_id, seq, "assistant", explanation, answer))
+        else:
+            rows.append(_message_row(chat_id, user_id, seq, message.get("role") or "user", content))
+    r = await supabase_client.get_client().post(
+        "/chat_messages", headers=sb_headers("return=minimal"), json=rows,
+    )
+    if r.is_success:
+        return len(rows)
+    if r.status_code != 409:
+        raise ChatStoreError(r.text)
+    # A concurrent request copied (or appended) first
+    return await latest_seq(chat_id)
+
+
+async def current_seq(chat_id: str, user_id: str) -> int:
+    """Tail seq of a chat, copying its legacy message array in first when it has no rows yet."""
+    seq = await latest_seq(chat_id)
+    return seq or await _backfill_legacy(chat_id, user_id)
+
+
+async def _delete_results(result_id: str) -> None:
+    r = await supabase_client.get_client().delete(
+        "/chat_results", headers=sb_headers("return=minimal"), params={"id": f"eq.{result_id}"},
+    )
+    if not r.is_success:
+        print(f"Deleting orphaned chat results failed: {r.text}")
+
+
+async def _store_results(chat_id: str, user_id: str, rows: List[Dict[str, Any]]) -> tuple[Optional[str], int]:
+    payload, stored = compress_results(rows)
+    r = await supabase_client.get_client().post(
+        "/chat_results",
+        headers=sb_headers("return=representation"),
+        json={"chat_id": chat_id, "user_id": user_id, "encoding": "gzip+base64",
+              "payload": payload, "row_count": stored},
+    )
+    if not r.is_success:
+        print(f"Storing chat results failed: {r.text}")
+        return None, 0
+    data = r.json()
+    created = data[0] if isinstance(data, list) and data else data
+    return created.get("id"), stored
+
+
+async def append_exchange(
+    chat_id: str,
+    user_id: str,
+    question: str,
+    assistant: Dict[str, Any],
+    expected_seq: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Append a user message and the assistant answer as seq n+1 / n+2.
+
+    With `expected_seq` the write only succeeds if the chat is still at that sequence
+    (optimistic concurrency; ChatConflict otherwise). Without it, a concurrent writer that
+    took the same seq just causes a retry on top of the new tail, so nothing is overwritten.
+    """
+    base = expected_seq if expected_seq is not None else await current_seq(chat_id, user_id)
+    result_id = None
+    if len(assistant.get("results") or []) > CHAT_RESULT_PREVIEW_ROWS:
+        result_id, _ = await _store_results(chat_id, user_id, assistant["results"])
+    try:
+        for _ in range(max(1, CHAT_APPEND_RETRIES)):
+            messages = [
+                _message_row(chat_id, user_id, base + 1, "user", question),
+                _message_row(chat_id, user_id, base + 2, "assistant", assistant.get("explanation"), assistant, result_id),
+            ]
+            # Both rows go in one statement: either the whole exchange lands or none of it
+            r = await supabase_client.get_client().post(
+                "/chat_messages", headers=sb_headers("return=minimal"), json=messages,
+            )
+            if r.is_success:
+                return {"seq": base + 2, "result_id": result_id}
+            if r.status_code != 409:
+                raise ChatStoreError(r.text)
+            current = await latest_seq(chat_id)
+            if expected_seq is not None:
+                raise ChatConflict(current)
+            base = current
+        raise ChatConflict(base)
+    except Exception:
+        # The exchange did not land: nothing references the stored result set
+        if result_id is not None:
+            await _delete_results(result_id)
+        raise
+
+
+async def list_messages(
+    chat_id: str,
+    user_id: str,
+    before_seq: Optional[int] = None,
+    limit: int = 50,
+) -> List[Dict[str, Any]]:
+    """One page of history in ascending order: the `limit` messages just before `before_seq`."""
+    params = {
+        "chat_id": f"eq.{chat_id}",
+        "user_id": f"eq.{user_id}",
+        "select": MESSAGE_FIELDS,
+        "order": "seq.desc",
+        "limit": str(limit),
+    }
+    if before_seq is not None:
+        params["seq"] = f"lt.{before_seq}"
+    r = await supabase_client.get_client().get("/chat_messages", headers=sb_headers(), params=params)
+    if not r.is_success:
+        raise ChatStoreError(r.text)
+    rows = r.json()
+    if not rows and before_seq is None and await _backfill_legacy(chat_id, user_id):
+        return await list_messages(chat_id, user_id, before_seq, limit)
+    return list(reversed(rows))
+
+
+async def get_results(result_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+    r = await supabase_client.get_client().get(
+        "/chat_results",
+        headers=sb_headers(),
+        params={"id": f"eq.{result_id}", "user_id": f"eq.{user_id}", "select": "payload,row_count"},
+    )
+    if not r.is_success:
+        raise ChatStoreError(r.text)
+    data = r.json()
+    if not data:
+        return None
+    return {"results": decompress_results(data[0]["payload"]), "row_count": data[0].get("row_count")}
@@ -0,0 +1,44 @@
+"""
+Shared embedding service.
+
+Run one instance per host and point every API worker at it with EMBEDDING_SERVICE_URL,
+so the SentenceTransformer (~1 GB) is held once instead of once per uvicorn worker:
+
+    uvicorn app.services.embedding_server:app --host 127.0.0.1 --port 8100 --workers 1
+    EMBEDDING_SERVICE_URL=http://127.0.0.1:8100 uvicorn app.main:app --workers 4
+"""
+import base64
+from typing import List
+
+import numpy as np
+from fastapi import FastAPI
+from pydantic import BaseModel
+
+from app.core.semantic_search import load_local_model
+
+app = FastAPI(title="Querai Embedding Service")
+_model = None
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+    batch_size: int = 32
+
+
+@app.on_event("startup")
+def load_model():
+    global _model
+    # Always load locally here, even if EMBEDDING_SERVICE_URL is set in the shared .env
+    _model = load_local_model()
+
+
+@app.post("/embed")
+def embed(req: EmbedRequest):
+    vectors = np.asarray(_model.encode(req.texts, batch_size=req.batch_size), dtype=np.float32)
+    dim = vectors.shape[1] if vectors.ndim == 2 else 0
+    return {"dim": dim, "data": base64.b64encode(vectors.tobytes()).decode("ascii")}
+
+
+@app.get("/")
+def health():
+    return {"status": "ok", "loaded": _model is not None}
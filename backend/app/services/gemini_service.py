@@ -1,18 +1,24 @@
 import google.generativeai as genai
 import json
+import re
+import time
+from typing import Any, AsyncIterator, Dict
 from app.core.config import GEMINI_API_KEY
+from app.core.telemetry import record, record_llm_usage, span
 
 genai.configure(api_key=GEMINI_API_KEY)
 model = genai.GenerativeModel('gemini-2.5-flash')
 
 
-def generate_intelligent_response(question: str, db_schema: str) -> tuple[str, str | None, str]:
-    """
-    Uses Gemini to analyze user intent and generate either a SQL query
-    or a meta-data answer, along with an explanation.
-    Returns a tuple: (response_type, sql_query, explanation)
-    """
-    prompt = f"""
+def _dialect_rule(dialect: str | None) -> str:
+    if not dialect:
+        return ""
+    return f"\n    4.  Write SQL for {dialect}: use only its syntax, functions and identifier quoting."
+
+
+def _intent_prompt(question: str, db_schema: str, dialect: str | None = None) -> str:
+    """Prompt asking Gemini for the {response_type, sql_query, explanation} JSON answer."""
+    return f"""
     You are a data analysis expert. Your task is to analyze the user's question and the database schema to determine the user's **intent**.
 
     **Intent 1: Data Query (SQL)**
@@ -24,7 +30,7 @@ def generate_intelligent_response(question: str, db_schema: str) -> tuple[str, s
     **Instructions and Constraints:**
     1.  You MUST use ONLY the tables and columns present in the schema for both intents.
     2.  If the question cannot be answered using the schema or it is irrelevant, you MUST respond with "error": "sql", "sql_query": "", and "explanation": "Cannot answer this question with the available data" clearly stating why.
-    3.  Your final output must be a single, minified JSON object based on the detected intent.
+    3.  Your final output must be a single, minified JSON object based on the detected intent.{_dialect_rule(dialect)}
 
     **Output Format based on Intent:**
 
@@ -43,24 +49,39 @@ def generate_intelligent_response(question: str, db_schema: str) -> tuple[str, s
         }}
 
     ### Database Schema:
+    (One line per table: `table(column type, ...)`. Types are abbreviated: int, num, str, ts, date, bool, json. `-> table.column` marks a foreign key; join on it.)
     {db_schema}
 
     ### User Question:
     {question}
     """
 
-    try:
-        response = model.generate_content(prompt)
 
-        # Clean the response to ensure it's valid JSON
-        cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
-        result = json.loads(cleaned_response)
+def _parse_intent(text: str) -> tuple[str, str | None, str]:
+    # Clean the response to ensure it's valid JSON
+    cleaned_response = text.strip().replace("```json", "").replace("```", "")
+    result = json.loads(cleaned_response)
+
+    response_type = result.get("response_type", "meta")  # Default to meta if type is missing
+    sql_query = result.get("sql_query")  # This will be null for 'meta' type
+    explanation = result.get("explanation", "No explanation provided.")
+
+    return response_type, sql_query, explanation
 
-        response_type = result.get("response_type", "meta")  # Default to meta if type is missing
-        sql_query = result.get("sql_query")  # This will be null for 'meta' type
-        explanation = result.get("explanation", "No explanation provided.")
 
-        return response_type, sql_query, explanation
+async def generate_intelligent_response(question: str, db_schema: str,
+                                        dialect: str | None = None) -> tuple[str, str | None, str]:
+    """
+    Uses Gemini to analyze user intent and generate either a SQL query
+    or a meta-data answer, along with an explanation.
+    `dialect` (e.g. "PostgreSQL") pins the SQL syntax the query must use.
+    Returns a tuple: (response_type, sql_query, explanation)
+    """
+    try:
+        with span("llm.intent") as attributes:
+            response = await model.generate_content_async(_intent_prompt(question, db_schema, dialect))
+            record_llm_usage("intent", response, attributes)
+        return _parse_intent(response.text)
 
     except (Exception, json.JSONDecodeError) as e:
         print(f"Error calling Gemini API or parsing JSON: {e}")
@@ -69,7 +90,143 @@ def generate_intelligent_response(question: str, db_schema: str) -> tuple[str, s
         return "error", None, error_message
 
 
-def generate_chat_title(question: str) -> str:
+class _JsonStringField:
+    """Incrementally decodes the string value of one key while a JSON object is still streaming in."""
+
+    _ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+
+    def __init__(self, key: str):
+        self._pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(key))
+        self._pos: int | None = None
+        self.value = ""
+        self.done = False
+
+    def feed(self, buffer: str) -> str:
+        """Given the whole text received so far, return the newly decoded part of the value."""
+        if self.done:
+            return ""
+        if self._pos is None:
+            match = self._pattern.search(buffer)
+            if not match:
+                return ""
+            self._pos = match.end()
+
+        out = []
+        i = self._pos
+        while i < len(buffer):
+            ch = buffer[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch == "\\":
+                if i + 1 >= len(buffer):
+                    break  # escape split across chunks; wait for more text
+                esc = buffer[i + 1]
+                if esc == "u":
+                    if i + 6 > len(buffer):
+                        break
+                    code = int(buffer[i + 2:i + 6], 16)
+                    if 0xD800 <= code < 0xDC00:
+                        # Surrogate pair: decode both halves together
+                        if i + 12 > len(buffer):
+                            break
+                        out.append(json.loads(f'"{buffer[i:i + 12]}"'))
+                        i += 12
+                    else:
+                        out.append(chr(code))
+                        i += 6
+                    continue
+                out.append(self._ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            out.append(ch)
+            i += 1
+        self._pos = i
+        delta = "".join(out)
+        self.value += delta
+        return delta
+
+
+async def stream_intelligent_response(question: str, db_schema: str,
+                                      dialect: str | None = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming variant of `generate_intelligent_response`. Yields, in order of arrival:
+      {"type": "sql", "response_type": "sql", "sql_query": str}   once the SQL string is complete
+      {"type": "explanation", "delta": str}                      explanation text as it is generated
+      {"type": "result", "response_type", "sql_query", "explanation"}  parsed full answer (always last)
+    """
+    text = ""
+    sql_field = _JsonStringField("sql_query")
+    explanation_field = _JsonStringField("explanation")
+    # Timed by hand: a span kept open across yields would parent the consumer's own spans
+    started = time.perf_counter()
+    attributes: Dict[str, Any] = {"stream": True}
+    try:
+        response = await model.generate_content_async(_intent_prompt(question, db_schema, dialect), stream=True)
+        async for chunk in response:
+            try:
+                text += chunk.text
+            except ValueError:
+                continue  # chunk without text parts (e.g. safety metadata)
+            if not sql_field.done:
+                sql_field.feed(text)
+                if sql_field.done and sql_field.value:
+                    yield {"type": "sql", "response_type": "sql", "sql_query": sql_field.value}
+            delta = explanation_field.feed(text)
+            if delta:
+                yield {"type": "explanation", "delta": delta}
+        record_llm_usage("intent", response, attributes)
+        response_type, sql_query, explanation = _parse_intent(text)
+    except (Exception, json.JSONDecodeError) as e:
+        print(f"Error calling Gemini API or parsing JSON: {e}")
+        response_type, sql_query, explanation = "error", None, f"An error occurred: {str(e)}"
+    record("llm.intent", time.perf_counter() - started, error=response_type == "error", **attributes)
+    yield {"type": "result", "response_type": response_type, "sql_query": sql_query, "explanation": explanation}
+
+
+async def repair_sql(question: str, db_schema: str, failed_sql: str, error: str,
+                     dialect: str | None = None) -> tuple[str | None, str]:
+    """
+    Ask Gemini to fix a query that failed to execute, given the database error and
+    the schema of the tables involved. Returns (fixed sql or None, one-line description of the fix).
+    """
+    prompt = f"""
+    You are a SQL expert. The query below was generated to answer the user's question but failed.
+    Fix it so it runs{f" on {dialect}" if dialect else ""} and still answers the question.
+
+    **Constraints:**
+    1.  Use ONLY the tables and columns present in the schema.
+    2.  Return a single read-only SELECT statement.
+    3.  Your output must be a single, minified JSON object: {{"sql_query": "FIXED_SQL", "fix": "What was wrong, in one sentence."}}
+    4.  If the query cannot be fixed with this schema, return {{"sql_query": null, "fix": "Why not."}}
+
+    ### Database Schema:
+    (One line per table: `table(column type, ...)`. `-> table.column` marks a foreign key.)
+    {db_schema}
+
+    ### User Question:
+    {question}
+
+    ### Failed SQL:
+    {failed_sql}
+
+    ### Database Error:
+    {error}
+    """
+    try:
+        with span("llm.repair") as attributes:
+            response = await model.generate_content_async(prompt)
+            record_llm_usage("repair", response, attributes)
+        cleaned_response = response.text.strip().replace("```json", "").replace("```", "")
+        result = json.loads(cleaned_response)
+        return result.get("sql_query") or None, result.get("fix") or ""
+    except (Exception, json.JSONDecodeError) as e:
+        print(f"Error calling Gemini API for SQL repair: {e}")
+        return None, f"Repair failed: {e}"
+
+
+async def generate_chat_title(question: str) -> str:
     """
     Uses Gemini to generate a very short title for a chat session
     based on the user's first question.
@@ -83,7 +240,9 @@ def generate_chat_title(question: str) -> str:
     ### Title:
     """
     try:
-        response = model.generate_content(prompt)
+        with span("llm.title") as attributes:
+            response = await model.generate_content_async(prompt)
+            record_llm_usage("title", response, attributes)
         title = response.text.strip().replace("\"", "").replace("*", "")
 
         if not title:
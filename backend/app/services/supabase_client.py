@@ -0,0 +1,62 @@
+import time
+from typing import Dict
+
+import httpx
+
+from app.core.config import (
+    SUPABASE_URL, SUPABASE_SERVICE_KEY,
+    SUPABASE_MAX_CONNECTIONS, SUPABASE_MAX_KEEPALIVE, SUPABASE_TIMEOUT,
+)
+from app.core.telemetry import record
+
+_client: httpx.AsyncClient | None = None
+
+
+def sb_headers(prefer: str | None = None) -> Dict[str, str]:
+    if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
+        raise RuntimeError("Supabase env vars missing (SUPABASE_URL / SUPABASE_SERVICE_KEY)")
+    headers = {
+        "apikey": SUPABASE_SERVICE_KEY,
+        "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
+        "Content-Type": "application/json",
+    }
+    if prefer:
+        headers["Prefer"] = prefer
+    return headers
+
+
+async def _start_timer(request: httpx.Request) -> None:
+    request.extensions["querai_started"] = time.perf_counter()
+
+
+async def _record_timing(response: httpx.Response) -> None:
+    # Time to response headers; PostgREST bodies are read right after
+    started = response.request.extensions.get("querai_started")
+    if started is not None:
+        record("supabase", time.perf_counter() - started, error=response.status_code >= 400,
+               method=response.request.method, table=response.request.url.path.rsplit("/", 1)[-1],
+               status=response.status_code)
+
+
+def get_client() -> httpx.AsyncClient:
+    """Process-wide AsyncClient so every Supabase call reuses pooled HTTP/2 connections."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=f"{SUPABASE_URL}/rest/v1",
+            http2=True,
+            timeout=SUPABASE_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=SUPABASE_MAX_CONNECTIONS,
+                max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+            ),
+            event_hooks={"request": [_start_timer], "response": [_record_timing]},
+        )
+    return _client
+
+
+async def aclose() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
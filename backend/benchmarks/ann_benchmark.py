@@ -0,0 +1,115 @@
+"""
+Recall/latency benchmark for the semantic-search index strategies (flat, hnsw, ivfpq).
+
+Builds each index type over synthetic schemas of increasing size and reports build time,
+estimated index memory, per-query latency and recall@k against exact (flat) search. Use the
+output to tune INDEX_HNSW_MIN / INDEX_IVFPQ_MIN (or pin INDEX_STRATEGY) per deployment.
+
+Usage (from backend/):
+    python benchmarks/ann_benchmark.py --sizes 1000,10000,100000,1000000
+    python benchmarks/ann_benchmark.py --sizes 1000,10000 --real-model   # embed synthetic column names
+
+By default vectors are synthetic: clustered unit-length float32 vectors with the model's
+dimension (768), which behave like schema embeddings (columns of a table sit close
+together) without spending hours on encoding. 1M x 768 needs ~3 GB RAM per copy.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")  # config guard; Gemini is not called
+
+from app.core.semantic_search import (  # noqa: E402
+    IVFPQ_MIN_VECTORS, build_faiss_index, embed_elements, embed_text, index_nbytes,
+)
+
+WORDS = ["order", "customer", "invoice", "product", "sales", "region", "user", "payment", "event",
+         "session", "inventory", "shipment", "account", "campaign", "ticket", "employee"]
+SUFFIXES = ["id", "name", "amount", "created_at", "status", "code", "total", "date", "type", "count"]
+
+
+def synthetic_vectors(size: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    tables = max(1, size // 20)
+    centers = rng.standard_normal((tables, dim)).astype(np.float32)
+    assign = rng.integers(0, tables, size)
+    vectors = centers[assign] + 0.35 * rng.standard_normal((size, dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def synthetic_elements(size: int, rng: np.random.Generator) -> list[str]:
+    out = []
+    for i in range(size):
+        table = f"{WORDS[i // 20 % len(WORDS)]}_{i // 20}"
+        out.append(f"schema_{i // 5000}.{table}.{rng.choice(WORDS)}_{rng.choice(SUFFIXES)}")
+    return out
+
+
+def queries_for(vectors: np.ndarray, count: int, rng: np.random.Generator) -> np.ndarray:
+    picks = vectors[rng.choice(len(vectors), count, replace=False)]
+    noisy = picks + 0.2 * rng.standard_normal(picks.shape).astype(np.float32)
+    faiss.normalize_L2(noisy)
+    return noisy
+
+
+def run(size: int, args: argparse.Namespace, rng: np.random.Generator) -> None:
+    if args.real_model:
+        vectors = embed_elements(synthetic_elements(size, rng))
+        questions = [f"total {rng.choice(WORDS)} {rng.choice(SUFFIXES)} by {rng.choice(WORDS)}"
+                     for _ in range(args.queries)]
+        queries = np.stack([embed_text(q) for q in questions])
+    else:
+        vectors = synthetic_vectors(size, args.dim, rng)
+        queries = queries_for(vectors, min(args.queries, size), rng)
+
+    exact = faiss.IndexFlatIP(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, args.k)
+
+    for strategy in args.strategies.split(","):
+        if strategy == "ivfpq" and size < IVFPQ_MIN_VECTORS:
+            continue  # too few points to train the quantizers (the service falls back too)
+        started = time.perf_counter()
+        index = build_faiss_index(vectors, strategy)
+        build_s = time.perf_counter() - started
+
+        latencies = []
+        found = np.empty_like(truth)
+        for i, q in enumerate(queries):
+            t0 = time.perf_counter()
+            _, ids = index.search(q[None, :], args.k)
+            latencies.append(time.perf_counter() - t0)
+            found[i] = ids[0]
+
+        recall = np.mean([len(set(found[i]) & set(truth[i])) / args.k for i in range(len(queries))])
+        lat = np.array(latencies) * 1000
+        mem_mb = index_nbytes(index, strategy) / 2**20
+        print(f"{size:>9} {strategy:>6} {build_s:>9.2f} {mem_mb:>9.1f} {np.percentile(lat, 50):>8.3f} "
+              f"{np.percentile(lat, 95):>8.3f} {recall:>8.3f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--strategies", default="flat,hnsw,ivfpq")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=15)
+    parser.add_argument("--real-model", action="store_true", help="embed synthetic column names with the real model")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    print(f"{'columns':>9} {'index':>6} {'build s':>9} {'mem MB':>9} {'p50 ms':>8} {'p95 ms':>8} {'recall':>8}")
+    for size in (int(x) for x in args.sizes.split(",") if x.strip()):
+        run(size, args, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Concurrency scaling benchmark for the Querai API.
+
+Fires a fixed number of requests at increasing concurrency levels and reports throughput
+and latency percentiles per level, so regressions in the async path (threadpool
+saturation, blocking calls on the event loop) show up as a flattening req/s curve.
+
+Usage (from backend/, with the API running):
+    python benchmarks/load_benchmark.py --base-url http://localhost:8000 \
+        --connection-id <id> --user-id <uuid> --question "How many orders?" \
+        --concurrency 1,4,16,64 --requests 200
+
+Without --connection-id the health endpoint (GET /) is used, which isolates server
+overhead from Supabase/Gemini/database latency.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List, Tuple
+
+import httpx
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+async def _one(client: httpx.AsyncClient, args: argparse.Namespace) -> Tuple[float, bool]:
+    start = time.perf_counter()
+    try:
+        if args.connection_id:
+            r = await client.post("/api/query", json={
+                "question": args.question,
+                "connection_id": args.connection_id,
+                "user_id": args.user_id,
+            })
+        else:
+            r = await client.get("/")
+        ok = r.is_success
+    except httpx.HTTPError:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+async def _run_level(args: argparse.Namespace, concurrency: int) -> None:
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        async def worker() -> Tuple[float, bool]:
+            async with sem:
+                return await _one(client, args)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(worker() for _ in range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies = [lat for lat, ok in results if ok]
+    errors = sum(1 for _, ok in results if not ok)
+    rps = len(results) / elapsed if elapsed else 0.0
+    mean = statistics.mean(latencies) if latencies else 0.0
+    print(
+        f"{concurrency:>6} {rps:>9.1f} {mean * 1000:>9.1f} "
+        f"{_percentile(latencies, 50) * 1000:>9.1f} {_percentile(latencies, 95) * 1000:>9.1f} "
+        f"{_percentile(latencies, 99) * 1000:>9.1f} {errors:>7}"
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--connection-id", default=None)
+    parser.add_argument("--user-id", default=None)
+    parser.add_argument("--question", default="How many rows are there?")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32,64")
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+    target = "POST /api/query" if args.connection_id else "GET /"
+    print(f"Target: {args.base_url} {target}, {args.requests} requests per level")
+    print(f"{'conc':>6} {'req/s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for level in levels:
+        await _run_level(args, level)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -13,7 +13,7 @@ export default async function ChatPage({ params }) {
 
   const { data: chat } = await supabase
     .from('chats')
-    .select('id,title,data_source_id,messages')
+    .select('id,title,data_source_id')
     .eq('id', id)
     .eq('user_id', user.id)
     .single()
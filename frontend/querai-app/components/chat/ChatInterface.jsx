@@ -9,6 +9,7 @@ import { useChatStore } from "@/lib/stores/chatStore";
 import { useConnectionStore } from "@/lib/stores/connectionStore";
 import { toast } from "sonner";
 import { createClient } from "@/lib/supabase/client";
+import { loadChatMessages } from "@/lib/chatMessages";
 import { FadeIn } from "@/components/brand/Motion";
 
 export default function ChatInterface() {
@@ -43,7 +44,7 @@ export default function ChatInterface() {
         const supabase = createClient();
         const { data, error } = await supabase
           .from('chats')
-          .select('id,messages,data_source_id')
+          .select('id,data_source_id')
           .eq('id', savedId)
           .single();
         if (error || !data) {
@@ -54,7 +55,7 @@ export default function ChatInterface() {
           setDataSource(null);
           return;
         }
-        const msgs = Array.isArray(data?.messages) ? data.messages : [];
+        const msgs = await loadChatMessages(supabase, savedId);
         const normalized = msgs.map((m) => {
           if (m?.role === 'assistant') {
             const explanation = typeof m.content === 'string' ? m.content : (m.content?.explanation || '');
@@ -2,6 +2,7 @@
 
 import { useEffect, useRef, useState } from "react";
 import { createClient } from "@/lib/supabase/client";
+import { loadChatMessages } from "@/lib/chatMessages";
 import { MessageSquare, Trash2 } from "lucide-react";
 import { useChatStore } from "@/lib/stores/chatStore";
 import { Button } from "@/components/ui/button";
@@ -65,10 +66,10 @@ export default function ChatList({ isCollapsed = false }) {
     // Load messages for the selected chat into store
     const { data } = await supabase
       .from('chats')
-      .select('messages,data_source_id')
+      .select('data_source_id')
       .eq('id', id)
       .single();
-    const msgs = Array.isArray(data?.messages) ? data.messages : [];
+    const msgs = await loadChatMessages(supabase, id);
     const normalized = msgs.map((m) => {
       if (m?.role === 'assistant') {
         const explanation = typeof m.content === 'string' ? m.content : (m.content?.explanation || '');
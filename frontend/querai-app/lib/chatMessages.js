@@ -0,0 +1,27 @@
+// Loads the most recent page of a chat's history from the append-only `chat_messages` table.
+// Rows keep the legacy message shape (role, content, sql, results, response_type), so
+// callers normalize them exactly like the old `chats.messages` array.
+export async function loadChatMessages(supabase, chatId, limit = 200) {
+  const { data, error } = await supabase
+    .from('chat_messages')
+    .select('seq,role,content,sql,results,response_type,truncated,result_id,row_count,created_at')
+    .eq('chat_id', chatId)
+    .order('seq', { ascending: false })
+    .limit(limit);
+  if (error || !Array.isArray(data)) return [];
+  if (data.length === 0) return loadLegacyMessages(supabase, chatId, limit);
+  return data.reverse();
+}
+
+// Chats from before `chat_messages` keep their history in `chats.messages` until the backend
+// copies it over (on the chat's next message or history read).
+async function loadLegacyMessages(supabase, chatId, limit) {
+  const { data, error } = await supabase
+    .from('chats')
+    .select('messages')
+    .eq('id', chatId)
+    .single();
+  const messages = Array.isArray(data?.messages) ? data.messages : [];
+  if (error || messages.length === 0) return [];
+  return messages.map((m, i) => ({ ...m, seq: i + 1 })).slice(-limit);
+}
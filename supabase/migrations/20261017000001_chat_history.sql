@@ -0,0 +1,45 @@
+-- Append-only chat history: one row per message plus compressed full result sets.
+-- append_exchange relies on unique (chat_id, seq): a concurrent writer that took the same
+-- seq gets a 409 and retries on top of the new tail instead of duplicating it.
+
+create table if not exists public.chat_results (
+  id uuid primary key default gen_random_uuid(),
+  chat_id uuid not null references public.chats (id) on delete cascade,
+  user_id uuid not null,
+  encoding text not null default 'gzip+base64',
+  payload text not null,
+  row_count integer,
+  created_at timestamptz not null default now()
+);
+
+create table if not exists public.chat_messages (
+  id bigint generated always as identity primary key,
+  chat_id uuid not null references public.chats (id) on delete cascade,
+  user_id uuid not null,
+  seq integer not null,
+  role text not null,
+  content text,
+  sql text,
+  response_type text,
+  truncated boolean not null default false,
+  results jsonb,
+  chart jsonb,
+  result_id uuid references public.chat_results (id) on delete set null,
+  row_count integer,
+  created_at timestamptz not null default now(),
+  constraint chat_messages_chat_seq_key unique (chat_id, seq)
+);
+
+create index if not exists chat_results_chat_id_idx on public.chat_results (chat_id);
+
+-- The frontend reads history directly with the user's session; the backend uses the service key
+alter table public.chat_messages enable row level security;
+alter table public.chat_results enable row level security;
+
+drop policy if exists "chat_messages_select_own" on public.chat_messages;
+create policy "chat_messages_select_own" on public.chat_messages
+  for select using (user_id = auth.uid());
+
+drop policy if exists "chat_results_select_own" on public.chat_results;
+create policy "chat_results_select_own" on public.chat_results
+  for select using (user_id = auth.uid());
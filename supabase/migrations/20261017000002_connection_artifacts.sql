@@ -0,0 +1,20 @@
+-- Columns the backend reads and writes on connections beyond the original
+-- schema_json / schema_elements_flat / is_large:
+--   schema_index   per-table lookups and join graph used for semantic expansion
+--   schema_pack    compact schema (base64 Arrow IPC, zstd) the query path loads
+--   index_strategy FAISS index type picked for the schema size (flat / hnsw / ivfpq)
+--   schema_hash    schema version: cache keys and connection-cache revalidation
+--   table_hashes   per-table fingerprints for incremental refresh
+--   source_version file ETag / size+mtime, to skip unchanged files on refresh
+--   updated_at     set on every refresh write; revalidated together with schema_hash
+-- Existing rows keep working: the backend falls back to schema_elements_flat / schema_json
+-- while these are null and fills them on the next refresh.
+
+alter table public.connections
+  add column if not exists schema_index jsonb,
+  add column if not exists schema_pack text,
+  add column if not exists index_strategy text,
+  add column if not exists schema_hash text,
+  add column if not exists table_hashes jsonb,
+  add column if not exists source_version text,
+  add column if not exists updated_at timestamptz not null default now();